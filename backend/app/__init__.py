@@ -1,5 +1,6 @@
 # backend/app/__init__.py (VERSÃO FINAL E CORRIGIDA)
 
+import click
 from flask import Flask
 from flask_cors import CORS
 from ..config import Config  # Importa a classe Config da raiz do projeto
@@ -27,6 +28,7 @@ def create_app(config_class=Config):
         parametros,
         simulacao,
         localidades,
+        importacao,
     )
 
     # 4. Registra cada blueprint na aplicação, definindo seus prefixos de URL
@@ -37,6 +39,49 @@ def create_app(config_class=Config):
     app.register_blueprint(parametros.bp)
     app.register_blueprint(simulacao.bp)
     app.register_blueprint(localidades.bp)
+    app.register_blueprint(importacao.bp)
+
+    # 5. Carrega o índice de localidades (compilando-o, se preciso)
+    from .services.locality_service import carregar_indice_localidades
+
+    carregar_indice_localidades()
+
+    # 6. Comandos de linha de comando (ex: `flask --app run migrar-tabelas`)
+    from . import database
+
+    @app.cli.command("migrar-tabelas")
+    def migrar_tabelas():
+        """Converte o dados.json (arquivo único) para um arquivo por tabela."""
+        database.migrar_para_tabelas()
+
+    @app.cli.command("importar-sqlite")
+    @click.option("--json", "caminho_json", default=None, help="Caminho do dados.json.")
+    def importar_sqlite(caminho_json):
+        """Importa um dados.json existente para o banco SQLite."""
+        database.importar_json_para_sqlite(caminho_json)
+
+    @app.cli.command("importar-historico")
+    @click.argument("caminho")
+    @click.option("--formato", default=None, help="csv ou xlsx (padrão: pela extensão).")
+    def importar_historico(caminho, formato):
+        """Importa um CSV/XLSX de histórico de consumo (upsert por UC e IDMes)."""
+        from .services.import_service import formato_do_arquivo
+        from .services.import_service import importar_historico as importar
+
+        relatorio = importar(caminho, formato_do_arquivo(caminho, formato))
+        for erro in relatorio["erros"]:
+            print(f"[ERRO] Linha {erro['linha']}: {erro['erro']}")
+        print(
+            f"[INFO] Importação concluída: {relatorio['importadas']} de "
+            f"{relatorio['linhas_lidas']} linhas, {relatorio['ucs']} UCs."
+        )
+
+    @app.cli.command("compilar-localidades")
+    def compilar_localidades():
+        """Gera o índice de localidades a partir do ListaDeMunicipios.xls."""
+        from .services.locality_service import compilar_indice_localidades
+
+        compilar_indice_localidades()
 
     print("--- Aplicação Flask criada e rotas registradas com sucesso! ---")
 
@@ -1,49 +1,1863 @@
 # backend/app/database.py
+import heapq
+import itertools
 import json
 import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: o servidor de desenvolvimento roda em um único processo.
+    fcntl = None
+
 from ..config import Config  # Importa a classe de configuração da raiz do projeto
+from .search_index import IndiceTrigramas, corresponde, textos_da_linha
+
+# Lista de todas as "tabelas" conhecidas do banco JSON.
+TABELAS = [
+    Config.LEADS_TABLE,
+    Config.UNIDADES_TABLE,
+    Config.HISTORICO_TABLE,
+    Config.VENDEDORES_TABLE,
+    Config.CONTATOS_TABLE,
+    Config.PROPOSTA_TABLE,
+    Config.OBSERVACOES_TABLE,
+    Config.UC_PROPOSTA_TABLE,
+    Config.CONTATO_PROPOSTA_TABLE,
+    Config.DATA_ENVIO_PROPOSTA_TABLE,
+    Config.PARAM_CLIENTES_TABLE,
+    Config.PARAM_SIMULACAO_TABLE,
+    Config.PARAM_PRECOS_ANO_TABLE,
+    Config.PARAM_CUSTOS_MES_TABLE,
+    Config.AJUSTE_IPCA_TABLE,
+    Config.AJUSTE_TARIFA_TABLE,
+    Config.DADOS_GERACAO_TABLE,
+    Config.CURVA_GERACAO_TABLE,
+    Config.AGREGADOS_UC_TABLE,
+]
+
+# Campos que identificam uma linha em cada tabela (a "chave primária").
+# Tabelas sem chave natural são gravadas no journal por inteiro ("replace").
+CHAVES_TABELAS = {
+    Config.LEADS_TABLE: ("Cpf_CnpjLead",),
+    Config.UNIDADES_TABLE: ("Cpf_CnpjLead", "NumeroDaUcLead"),
+    Config.HISTORICO_TABLE: ("NumeroDaUcLead", "IDMes"),
+    Config.VENDEDORES_TABLE: ("Cpf_CnpjLead",),
+    Config.CONTATOS_TABLE: ("Cpf_CnpjLead",),
+    Config.PROPOSTA_TABLE: ("NProposta",),
+    Config.UC_PROPOSTA_TABLE: ("IdProposta", "Uc"),
+    Config.PARAM_CLIENTES_TABLE: ("Cliente",),
+    Config.PARAM_PRECOS_ANO_TABLE: ("Ano", "Fonte"),
+    Config.PARAM_CUSTOS_MES_TABLE: ("MesRef",),
+    Config.AJUSTE_IPCA_TABLE: ("Ano",),
+    Config.AJUSTE_TARIFA_TABLE: ("CnpjDistribuidora", "Ano"),
+    Config.DADOS_GERACAO_TABLE: ("Fonte", "Local"),
+    Config.CURVA_GERACAO_TABLE: ("IdMes", "Fonte", "Local"),
+    Config.AGREGADOS_UC_TABLE: ("NumeroDaUcLead", "Tipo", "Periodo"),
+}
+
+# Campos (além da chave) pelos quais as rotas buscam linhas, normalmente
+# chaves estrangeiras. No motor JSON viram índices hash em memória; no SQLite,
+# colunas indexadas.
+INDICES_TABELAS = {
+    Config.UNIDADES_TABLE: ("NumeroDaUcLead", "Cpf_CnpjLead"),
+    Config.HISTORICO_TABLE: ("NumeroDaUcLead",),
+    Config.UC_PROPOSTA_TABLE: ("IdProposta",),
+    Config.OBSERVACOES_TABLE: ("IdProposta",),
+    Config.CONTATO_PROPOSTA_TABLE: ("IdProposta",),
+    Config.AJUSTE_TARIFA_TABLE: ("CnpjDistribuidora",),
+    Config.AGREGADOS_UC_TABLE: ("NumeroDaUcLead",),
+}
 
+# Campos com índice de trigramas para a busca textual de find_page(busca=...).
+INDICES_TEXTO = {
+    Config.LEADS_TABLE: ("RazaoSocialLead", "Cpf_CnpjLead", "NomeFantasia"),
+}
 
-def read_data():
+
+class IntegrityError(Exception):
+    """Violação de chave primária (ex: inserir um lead com CPF/CNPJ já existente)."""
+
+
+class ConflictError(Exception):
     """
-    Lê todos os dados do arquivo JSON.
-    Se o arquivo não existir ou estiver vazio, retorna uma estrutura de dados padrão.
+    Linhas lidas por uma transação (tx.find) foram alteradas por outra gravação
+    antes do commit. A transação é descartada e pode ser refeita.
     """
+
+
+# --- CACHE EM MEMÓRIA ---
+# Cada arquivo do banco (o dados.json inteiro, ou um arquivo por tabela no layout
+# "por_tabela") é uma "partição" com seu próprio cache, journal e lock.
+# Uma partição só é relida do disco quando o arquivo muda (inode, mtime ou
+# tamanho); no modo journal, guardamos também até que byte do log já foi
+# aplicado, para ler apenas os registros novos. As listas e linhas do cache
+# nunca são alteradas no lugar: cada mudança gera novos objetos.
+_particoes_lock = threading.Lock()
+_particoes = {}
+_migracao = {"verificada": None}
+_cache_stats = {"hits": 0, "misses": 0, "recargas_parciais": 0}
+_commit_stats = {"commits": 0, "lotes": 0}
+# Carimbos de versão das tabelas em memória: cada alteração recebe um novo.
+_carimbos = itertools.count(1)
+
+
+def _assinatura(stat_result):
+    """Identifica uma versão do arquivo a partir do seu inode, mtime e tamanho."""
+    return (stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def _stat(caminho):
     try:
-        # Abre o arquivo usando o caminho definido no config.py
-        with open(Config.JSON_DB_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Se o arquivo não for encontrado ou estiver corrompido/vazio,
-        # criamos uma estrutura vazia para evitar que o app quebre.
-        return {
-            Config.LEADS_TABLE: [],
-            Config.UNIDADES_TABLE: [],
-            Config.HISTORICO_TABLE: [],
-            Config.VENDEDORES_TABLE: [],
-            Config.CONTATOS_TABLE: [],
-            Config.PROPOSTA_TABLE: [],
-            Config.OBSERVACOES_TABLE: [],
-            Config.UC_PROPOSTA_TABLE: [],
-            Config.CONTATO_PROPOSTA_TABLE: [],
-            Config.DATA_ENVIO_PROPOSTA_TABLE: [],
-            Config.PARAM_CLIENTES_TABLE: [],
-            Config.PARAM_SIMULACAO_TABLE: [],
-            Config.PARAM_PRECOS_ANO_TABLE: [],
-            Config.PARAM_CUSTOS_MES_TABLE: [],
-            Config.AJUSTE_IPCA_TABLE: [],
-            Config.AJUSTE_TARIFA_TABLE: [],
-            Config.DADOS_GERACAO_TABLE: [],
-            Config.CURVA_GERACAO_TABLE: [],
-        }
-
-
-def write_data(data):
-    """
-    Escreve um dicionário Python inteiro de volta no arquivo JSON.
-    """
-    # Abre o arquivo em modo de escrita ('w')
-    with open(Config.JSON_DB_PATH, "w", encoding="utf-8") as f:
+        return os.stat(caminho)
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def _lock_arquivo(caminho):
+    """
+    Lock exclusivo entre processos (ex: vários workers do gunicorn) sobre o
+    arquivo `caminho`, que é criado vazio se não existir.
+    """
+    with open(caminho, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _caminho_tmp(caminho):
+    """Nome do arquivo temporário de `caminho`, único por processo."""
+    return f"{caminho}.{os.getpid()}.tmp"
+
+
+def _gravar_json_atomico(caminho, conteudo):
+    """
+    Grava `conteudo` em um arquivo temporário e o troca pelo definitivo com
+    os.replace, para que um leitor nunca veja um arquivo pela metade.
+    Retorna a assinatura do novo arquivo.
+    """
+    caminho_tmp = _caminho_tmp(caminho)
+    with open(caminho_tmp, "w", encoding="utf-8") as f:
         # Usa json.dump para salvar os dados de forma formatada (indent=4)
         # e garantindo a codificação correta de caracteres como 'ç' e 'ã'.
-        json.dump(data, f, indent=4, ensure_ascii=False)
+        json.dump(conteudo, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(caminho_tmp, caminho)
+    return _assinatura(os.stat(caminho))
+
+
+# --- JOURNAL ---
+
+
+def _chave(linha, campos):
+    return tuple(linha.get(campo) for campo in campos)
+
+
+def _mapa_unico(linhas, campos):
+    """Mapeia chave -> linha. Retorna None se houver chaves repetidas."""
+    mapa = {}
+    for linha in linhas:
+        chave = _chave(linha, campos)
+        if chave in mapa:
+            return None
+        mapa[chave] = linha
+    return mapa
+
+
+def _diferencas(antigos, novos, tabelas):
+    """
+    Compara as tabelas indicadas e devolve a lista de operações do journal
+    necessárias para transformar `antigos` em `novos`.
+    """
+    operacoes = []
+    for tabela in tabelas:
+        novas = novos.get(tabela)
+        antigas = antigos.get(tabela, [])
+        if novas is None or novas is antigas:
+            continue
+
+        campos = CHAVES_TABELAS.get(tabela)
+        mapa_antigo = _mapa_unico(antigas, campos) if campos else None
+        mapa_novo = _mapa_unico(novas, campos) if campos else None
+
+        if mapa_antigo is None or mapa_novo is None:
+            # Sem chave confiável: grava a tabela inteira (tabelas pequenas de parâmetros).
+            if antigas != novas:
+                operacoes.append({"tabela": tabela, "op": "replace", "linhas": novas})
+            continue
+
+        for chave in mapa_antigo.keys() - mapa_novo.keys():
+            operacoes.append({"tabela": tabela, "op": "del", "chave": list(chave)})
+        for chave, linha in mapa_novo.items():
+            if mapa_antigo.get(chave) != linha:
+                operacoes.append(
+                    {"tabela": tabela, "op": "put", "chave": list(chave), "linha": linha}
+                )
+    return operacoes
+
+
+class _Tabela:
+    """
+    Linhas de uma tabela em memória, com índices hash na chave primária e nos
+    campos de INDICES_TABELAS. Os índices são atualizados a cada put/del, então
+    buscas por chave, buscas por chave estrangeira e verificações de unicidade
+    custam O(1) em vez de percorrer a lista. Linhas com a mesma chave (dados
+    antigos) são toleradas.
+    """
+
+    def __init__(self, nome, linhas):
+        self.nome = nome
+        self.campos = CHAVES_TABELAS.get(nome)
+        self._campos_indice = [
+            campo
+            for campo in INDICES_TABELAS.get(nome, ())
+            if self.campos and (campo,) != tuple(self.campos)
+        ]
+        self._campos_texto = INDICES_TEXTO.get(nome) if self.campos else None
+        self.substituir(linhas)
+
+    def substituir(self, linhas):
+        """Troca todas as linhas da tabela e reconstrói os índices."""
+        # A lista materializada nunca é alterada no lugar: cada mudança cria outra,
+        # então quem já a recebeu (ex: uma DocumentoView) não é afetado.
+        self._lista = list(linhas)
+        self._por_chave = {}
+        self._indices = {campo: {} for campo in self._campos_indice}
+        # O índice de trigramas é construído só na primeira busca textual.
+        self._texto = None
+        self.versao = self._criacao = next(_carimbos)
+        # Carimbo da última alteração por valor de campo indexado (ex: por UC);
+        # valores sem registro não mudaram desde a criação da tabela.
+        self._versoes_valor = {campo: {} for campo in self._campos_indice}
+        if not self.campos:
+            return
+        for linha in self._lista:
+            chave = _chave(linha, self.campos)
+            self._por_chave.setdefault(chave, []).append(linha)
+            self._indexar(chave, linha)
+
+    def _indexar(self, chave, linha):
+        for campo, indice in self._indices.items():
+            indice.setdefault(linha.get(campo), {})[chave] = None
+
+    def _desindexar(self, chave, linha):
+        for campo, indice in self._indices.items():
+            valor = linha.get(campo)
+            chaves = indice.get(valor)
+            if chaves is not None:
+                chaves.pop(chave, None)
+                if not chaves:
+                    del indice[valor]
+
+    def _marcar(self, linha):
+        for campo, versoes in self._versoes_valor.items():
+            versoes[linha.get(campo)] = self.versao
+
+    def put(self, chave, linha):
+        self.versao = next(_carimbos)
+        for antiga in self._por_chave.get(chave, ()):
+            self._desindexar(chave, antiga)
+            self._marcar(antiga)
+        # Uma chave já existente mantém a sua posição na tabela.
+        self._por_chave[chave] = [linha]
+        self._indexar(chave, linha)
+        self._marcar(linha)
+        if self._texto is not None:
+            self._texto.adicionar(chave, linha)
+        self._lista = None
+
+    def delete(self, chave):
+        self.versao = next(_carimbos)
+        for antiga in self._por_chave.pop(chave, ()):
+            self._desindexar(chave, antiga)
+            self._marcar(antiga)
+        if self._texto is not None:
+            self._texto.remover(chave)
+        self._lista = None
+
+    def versao_de(self, filtros):
+        """
+        Carimbo das linhas que atendem a `filtros`. Com um único campo indexado
+        (ex: NumeroDaUcLead) o carimbo só muda quando essas linhas mudam;
+        nos demais casos é o carimbo da tabela inteira.
+        """
+        if len(filtros) == 1:
+            [(campo, valor)] = filtros.items()
+            if campo in self._versoes_valor:
+                return self._versoes_valor[campo].get(valor, self._criacao)
+        return self.versao
+
+    def get(self, chave):
+        linhas = self._por_chave.get(chave)
+        return linhas[0] if linhas else None
+
+    def linhas(self):
+        if self._lista is None:
+            self._lista = [l for linhas in self._por_chave.values() for l in linhas]
+        return self._lista
+
+    def buscar(self, filtros):
+        """Linhas cujos campos são iguais aos filtros, usando um índice se houver."""
+        if self.campos and all(campo in filtros for campo in self.campos):
+            candidatas = self._por_chave.get(
+                tuple(filtros[campo] for campo in self.campos), []
+            )
+        else:
+            campo = next((c for c in filtros if c in self._indices), None)
+            if campo is not None:
+                candidatas = [
+                    linha
+                    for chave in self._indices[campo].get(filtros[campo], ())
+                    for linha in self._por_chave[chave]
+                ]
+            else:
+                candidatas = self.linhas()
+        return _filtrar(candidatas, filtros)
+
+    def buscar_texto(self, consulta):
+        """Linhas que contêm `consulta` nos campos de INDICES_TEXTO."""
+        if self._campos_texto is None:
+            raise ValueError(f"A tabela '{self.nome}' não tem índice de texto.")
+        if self._texto is None:
+            self._texto = IndiceTrigramas(self._campos_texto)
+            for chave, linhas in self._por_chave.items():
+                self._texto.adicionar(chave, linhas[0])
+        chaves = self._texto.buscar(consulta)
+        if chaves is None:
+            return [
+                linha
+                for linha in self.linhas()
+                if corresponde(consulta, textos_da_linha(linha, self._campos_texto))
+            ]
+        return [linha for chave in chaves for linha in self._por_chave[chave]]
+
+
+class _Particao:
+    """
+    Um arquivo do banco, seu journal e o cache correspondente (um _Tabela por
+    tabela). No layout "arquivo_unico" existe uma única partição com todas as
+    tabelas; no "por_tabela", uma por tabela (e o arquivo guarda só a lista de linhas).
+    """
+
+    def __init__(self, caminho, caminho_journal, tabela=None, usa_journal=None):
+        self.caminho = caminho
+        self.caminho_journal = caminho_journal
+        self.caminho_lock = f"{caminho}.lock"
+        self.tabela = tabela
+        self.usa_journal = (
+            Config.JSON_DB_JOURNAL if usa_journal is None else usa_journal
+        )
+        self.lock = threading.RLock()
+        self.snapshot = None
+        self.journal = None
+        self.offset = 0
+        self.tabelas = None
+        self.compactando = False
+
+    def _carregar_snapshot(self):
+        """Lê o arquivo do disco e retorna (assinatura, {tabela: linhas})."""
+        try:
+            with open(self.caminho, "r", encoding="utf-8") as f:
+                assinatura = _assinatura(os.fstat(f.fileno()))
+                try:
+                    conteudo = json.load(f)
+                except json.JSONDecodeError:
+                    # Arquivo corrompido/vazio: usamos a estrutura vazia para o app não quebrar.
+                    conteudo = None
+        except FileNotFoundError:
+            assinatura, conteudo = None, None
+
+        if self.tabela:
+            linhas = conteudo if isinstance(conteudo, list) else []
+            return assinatura, {self.tabela: linhas}
+
+        dados = conteudo if isinstance(conteudo, dict) else {}
+        for tabela in TABELAS:
+            dados.setdefault(tabela, [])
+        return assinatura, dados
+
+    def _conteudo_snapshot(self):
+        """O que vai para o arquivo: a lista da tabela, ou o documento inteiro."""
+        if self.tabela:
+            return self._tabela(self.tabela).linhas()
+        return self.documento()
+
+    def _ler_journal(self, offset):
+        """
+        Lê os registros completos do journal a partir de `offset` (em bytes).
+        Retorna (inode, operações, novo_offset). Uma linha final incompleta
+        (ainda sendo gravada) é deixada para a próxima leitura.
+        """
+        try:
+            with open(self.caminho_journal, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                f.seek(offset)
+                conteudo = f.read()
+        except FileNotFoundError:
+            return None, [], 0
+
+        operacoes = []
+        fim = conteudo.rfind(b"\n") + 1
+        for linha in conteudo[:fim].splitlines():
+            if not linha.strip():
+                continue
+            try:
+                operacoes.extend(json.loads(linha.decode("utf-8"))["ops"])
+            except (ValueError, KeyError) as e:
+                print(f"[AVISO] Registro inválido ignorado no journal: {e}")
+        return inode, operacoes, offset + fim
+
+    def _anexar_journal(self, operacoes):
+        """Anexa um registro ao journal e retorna (inode, tamanho final do arquivo)."""
+        registro = json.dumps({"ops": operacoes}, ensure_ascii=False) + "\n"
+        with open(self.caminho_journal, "ab") as f:
+            if f.tell() > self.offset and os.fstat(f.fileno()).st_ino == self.journal:
+                # Restos de uma gravação interrompida (linha sem "\n"): descartamos,
+                # senão o próximo registro seria colado nela.
+                f.truncate(self.offset)
+            f.write(registro.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            return os.fstat(f.fileno()).st_ino, f.tell()
+
+    def _tabela(self, nome):
+        tabela = self.tabelas.get(nome)
+        if tabela is None:
+            tabela = self.tabelas[nome] = _Tabela(nome, [])
+        return tabela
+
+    def _aplicar_em_memoria(self, operacoes):
+        """Aplica operações do journal às tabelas em memória, O(1) por put/del."""
+        for op in operacoes:
+            tabela = self._tabela(op["tabela"])
+            if op["op"] == "replace":
+                tabela.substituir(op["linhas"])
+            elif not tabela.campos:
+                continue
+            elif op["op"] == "put":
+                tabela.put(tuple(op["chave"]), op["linha"])
+            elif op["op"] == "del":
+                tabela.delete(tuple(op["chave"]))
+
+    def _recarregar(self):
+        """Recarga completa: último snapshot + todo o journal por cima."""
+        for _ in range(3):
+            self.snapshot, dados = self._carregar_snapshot()
+            self.tabelas = {
+                nome: _Tabela(nome, linhas) for nome, linhas in dados.items()
+            }
+            if not self.usa_journal:
+                return
+            self.journal, operacoes, self.offset = self._ler_journal(0)
+            self._aplicar_em_memoria(operacoes)
+
+            # Se outro processo compactou entre as duas leituras, lemos o snapshot
+            # antigo e o journal já truncado: falta o que foi consolidado. Relemos.
+            stat_snapshot = _stat(self.caminho)
+            if (_assinatura(stat_snapshot) if stat_snapshot else None) == self.snapshot:
+                return
+
+    def sincronizar(self):
+        """
+        Garante que o cache reflita o disco (deve ser chamada com o lock).
+        Retorna "hit", "parcial" (só registros novos do journal) ou "miss".
+        """
+        stat_snapshot = _stat(self.caminho)
+        snapshot = _assinatura(stat_snapshot) if stat_snapshot else None
+
+        if not self.usa_journal:
+            if self.tabelas is not None and self.snapshot == snapshot:
+                return "hit"
+            self._recarregar()
+            return "miss"
+
+        stat_journal = _stat(self.caminho_journal)
+        journal = stat_journal.st_ino if stat_journal else None
+        tamanho_journal = stat_journal.st_size if stat_journal else 0
+
+        if (
+            self.tabelas is not None
+            and self.snapshot == snapshot
+            and self.journal == journal
+            and tamanho_journal >= self.offset
+        ):
+            if tamanho_journal == self.offset:
+                return "hit"
+            self.journal, operacoes, self.offset = self._ler_journal(self.offset)
+            self._aplicar_em_memoria(operacoes)
+            return "parcial"
+
+        self._recarregar()
+        return "miss"
+
+    def _sincronizar_contando(self):
+        resultado = self.sincronizar()
+        if resultado == "miss":
+            _cache_stats["misses"] += 1
+        else:
+            _cache_stats["hits"] += 1
+            if resultado == "parcial":
+                _cache_stats["recargas_parciais"] += 1
+
+    def documento(self):
+        """Retorna {tabela: linhas} da partição (somente leitura), atualizado com o disco."""
+        with self.lock:
+            self._sincronizar_contando()
+            return {nome: tabela.linhas() for nome, tabela in self.tabelas.items()}
+
+    def linhas(self, nome):
+        """Retorna as linhas de uma tabela (somente leitura)."""
+        with self.lock:
+            self._sincronizar_contando()
+            return self._tabela(nome).linhas()
+
+    def obter(self, nome, chave):
+        """Busca uma linha pela chave primária no índice (somente leitura)."""
+        with self.lock:
+            self._sincronizar_contando()
+            return self._tabela(nome).get(chave)
+
+    def buscar(self, nome, filtros):
+        """Busca linhas por igualdade de campos, usando os índices (somente leitura)."""
+        with self.lock:
+            self._sincronizar_contando()
+            return self._tabela(nome).buscar(filtros)
+
+    def buscar_texto(self, nome, consulta):
+        """Busca textual pelo índice de trigramas (somente leitura)."""
+        with self.lock:
+            self._sincronizar_contando()
+            return self._tabela(nome).buscar_texto(consulta)
+
+    def marca(self):
+        """
+        Identifica o estado em disco da partição: assinatura do snapshot e
+        posição no journal. É a mesma em todos os processos (e depois de um
+        reinício) enquanto os dados não mudam, e muda a cada gravação.
+        """
+        with self.lock:
+            self._sincronizar_contando()
+            return f"{self.snapshot}/{self.journal}/{self.offset}"
+
+    def versao(self, nome, filtros=None):
+        """Carimbo que muda sempre que a tabela muda (inclusive por outro worker)."""
+        with self.lock:
+            self._sincronizar_contando()
+            tabela = self._tabela(nome)
+            return tabela.versao_de(filtros) if filtros else tabela.versao
+
+    def persistir(self, operacoes):
+        """
+        Grava no disco operações já aplicadas em memória. Deve ser chamada com o
+        lock da partição e o lock do arquivo (ver JsonStorage._gravar_lotes).
+        Retorna True se o journal passou do limite e deve ser compactado.
+        """
+        if self.usa_journal:
+            self.journal, self.offset = self._anexar_journal(operacoes)
+            return self.offset > Config.JSON_JOURNAL_MAX_BYTES
+        self.snapshot = _gravar_json_atomico(self.caminho, self._conteudo_snapshot())
+        return False
+
+    def iniciar_compactacao(self):
+        with self.lock:
+            if self.compactando:
+                return
+            self.compactando = True
+        threading.Thread(target=self.compactar, daemon=True).start()
+
+    def compactar(self):
+        """
+        Consolida o journal no arquivo da partição (executado em segundo plano).
+        A serialização acontece fora do lock; registros anexados enquanto isso
+        são preservados em um novo journal.
+        """
+        caminho_tmp = _caminho_tmp(self.caminho)
+        try:
+            with self.lock:
+                self.sincronizar()
+                conteudo, offset_base = self._conteudo_snapshot(), self.offset
+                journal_base = self.journal
+
+            # As listas materializadas nunca são alteradas no lugar, então é
+            # seguro serializá-las sem segurar o lock.
+            with open(caminho_tmp, "w", encoding="utf-8") as f:
+                json.dump(conteudo, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+
+            # O lock do arquivo impede que outro worker anexe ao journal (ou o
+            # compacte) durante a troca.
+            with self.lock, _lock_arquivo(self.caminho_lock):
+                self.sincronizar()
+                if self.journal != journal_base or self.offset < offset_base:
+                    print("[INFO] Journal já compactado por outro processo.")
+                    os.remove(caminho_tmp)
+                    return
+                with open(self.caminho_journal, "rb") as f:
+                    f.seek(offset_base)
+                    restante = f.read()
+                journal_tmp = _caminho_tmp(self.caminho_journal)
+                with open(journal_tmp, "wb") as f:
+                    f.write(restante)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                # Se o processo cair entre as duas trocas, o journal antigo é
+                # reaplicado sobre o snapshot novo, o que é seguro porque as
+                # operações são idempotentes (put/del/replace por chave).
+                os.replace(caminho_tmp, self.caminho)
+                os.replace(journal_tmp, self.caminho_journal)
+
+                self.snapshot = _assinatura(os.stat(self.caminho))
+                self.journal = os.stat(self.caminho_journal).st_ino
+                self.offset -= offset_base
+            print(
+                f"[INFO] Journal de {os.path.basename(self.caminho)} compactado "
+                f"({offset_base} bytes consolidados)."
+            )
+        except Exception as e:
+            print(f"[ERRO] Falha ao compactar o journal: {e}")
+        finally:
+            self.compactando = False
+
+
+def _layout_por_tabela():
+    return Config.JSON_DB_LAYOUT == "por_tabela"
+
+
+def _garantir_pasta_tabelas():
+    """Cria a pasta de tabelas, migrando o dados.json se ele existir."""
+    pasta = Config.JSON_TABLES_DIR
+    if _migracao["verificada"] == pasta:
+        return
+    # O lock do arquivo garante que só um worker faça a migração.
+    with _particoes_lock, _lock_arquivo(f"{pasta}.lock"):
+        if not os.path.isdir(pasta):
+            if os.path.exists(Config.JSON_DB_PATH):
+                migrar_para_tabelas()
+            else:
+                os.makedirs(pasta, exist_ok=True)
+        _migracao["verificada"] = pasta
+
+
+def _particao(tabela):
+    """Retorna a partição que guarda `tabela`, criando-a na primeira vez."""
+    if _layout_por_tabela():
+        _garantir_pasta_tabelas()
+        caminho = os.path.join(Config.JSON_TABLES_DIR, f"{tabela}.json")
+        caminho_journal = os.path.join(Config.JSON_TABLES_DIR, f"{tabela}.journal")
+    else:
+        tabela = None
+        caminho, caminho_journal = Config.JSON_DB_PATH, Config.JSON_JOURNAL_PATH
+
+    with _particoes_lock:
+        particao = _particoes.get(caminho)
+        if particao is None:
+            particao = _particoes[caminho] = _Particao(caminho, caminho_journal, tabela)
+        return particao
+
+
+def migrar_para_tabelas():
+    """
+    Migração única do formato antigo (tudo no dados.json, mais o seu journal)
+    para um arquivo por tabela em Config.JSON_TABLES_DIR.
+    O dados.json original não é alterado. Retorna a lista de tabelas migradas.
+    """
+    destino = Config.JSON_TABLES_DIR
+    if os.path.isdir(destino):
+        print(f"[AVISO] A pasta {destino} já existe; nada foi migrado.")
+        return []
+
+    origem = _Particao(Config.JSON_DB_PATH, Config.JSON_JOURNAL_PATH, usa_journal=True)
+    dados = origem.documento()
+
+    # Gravamos tudo em uma pasta temporária e a renomeamos no final, para que
+    # uma migração interrompida nunca deixe uma pasta de tabelas incompleta.
+    pasta_tmp = _caminho_tmp(destino)
+    shutil.rmtree(pasta_tmp, ignore_errors=True)
+    os.makedirs(pasta_tmp)
+    for tabela, linhas in dados.items():
+        _gravar_json_atomico(os.path.join(pasta_tmp, f"{tabela}.json"), linhas)
+    os.replace(pasta_tmp, destino)
+
+    print(f"[INFO] Migração concluída: {len(dados)} tabelas gravadas em {destino}.")
+    return list(dados)
+
+
+class DocumentoView(dict):
+    """
+    Visão copy-on-write e preguiçosa do banco.
+
+    Uma "tabela" só é carregada (e copiada, lista e linhas) quando é acessada
+    pela primeira vez, de forma que as rotas podem alterar, ordenar ou substituir
+    listas livremente sem corromper o cache, e só pagam pelas tabelas que usam.
+    A visão guarda as listas originais para que write_data() grave só o que mudou.
+    """
+
+    def __init__(self, carregar, nomes):
+        super().__init__()
+        self._carregar = carregar
+        self._nomes = list(nomes)
+        self._base = {}
+
+    def _original(self, tabela):
+        if tabela not in self._base:
+            if tabela not in self._nomes:
+                raise KeyError(tabela)
+            self._base[tabela] = self._carregar(tabela)
+        return self._base[tabela]
+
+    def _tabela(self, tabela):
+        if dict.__contains__(self, tabela):
+            return dict.__getitem__(self, tabela)
+        # As linhas são dicionários "planos", então uma cópia rasa de cada uma basta.
+        copia = [
+            dict(linha) if isinstance(linha, dict) else linha
+            for linha in self._original(tabela)
+        ]
+        dict.__setitem__(self, tabela, copia)
+        return copia
+
+    def __getitem__(self, tabela):
+        return self._tabela(tabela)
+
+    def __setitem__(self, tabela, valor):
+        if tabela in self._nomes:
+            self._original(tabela)
+        else:
+            self._nomes.append(tabela)
+        dict.__setitem__(self, tabela, valor)
+
+    def __contains__(self, tabela):
+        return tabela in self._nomes
+
+    def __iter__(self):
+        return iter(list(self._nomes))
+
+    def __len__(self):
+        return len(self._nomes)
+
+    def __repr__(self):
+        return f"DocumentoView({self._nomes!r})"
+
+    def keys(self):
+        return list(self._nomes)
+
+    def get(self, tabela, default=None):
+        if tabela in self:
+            return self._tabela(tabela)
+        return default
+
+    def setdefault(self, tabela, default=None):
+        if tabela not in self:
+            self[tabela] = default
+        return self._tabela(tabela)
+
+    def pop(self, tabela, *default):
+        if tabela not in self:
+            if default:
+                return default[0]
+            raise KeyError(tabela)
+        valor = self._tabela(tabela)
+        self._nomes.remove(tabela)
+        dict.pop(self, tabela)
+        return valor
+
+    def values(self):
+        return [self._tabela(tabela) for tabela in self]
+
+    def items(self):
+        return [(tabela, self._tabela(tabela)) for tabela in self]
+
+    def copy(self):
+        return dict(self.items())
+
+    def tabelas_acessadas(self):
+        return list(dict.keys(self))
+
+    def materializar(self):
+        """Retorna um dict comum apenas com as tabelas acessadas pela rota."""
+        return {tabela: dict.__getitem__(self, tabela) for tabela in dict.keys(self)}
+
+
+# --- MOTORES DE ARMAZENAMENTO ---
+# As rotas conversam com o banco por uma interface comum (StorageBackend).
+# O motor é escolhido em Config.STORAGE_ENGINE: "json" (arquivos JSON, com
+# cache, journal e layout por tabela) ou "sqlite" (banco SQLite embutido).
+# As chaves são sempre tuplas na ordem de CHAVES_TABELAS; para chaves de um
+# único campo, o valor pode ser passado diretamente.
+
+
+def _normalizar_chave(chave):
+    return tuple(chave) if isinstance(chave, (tuple, list)) else (chave,)
+
+
+def _maior_valor(linhas, campo):
+    """Maior valor inteiro de `campo` nas linhas (0 se não houver)."""
+    maior = 0
+    for linha in linhas:
+        try:
+            maior = max(maior, int(linha.get(campo) or 0))
+        except (TypeError, ValueError):
+            continue
+    return maior
+
+
+def _campos_chave(tabela):
+    campos = CHAVES_TABELAS.get(tabela)
+    if not campos:
+        raise ValueError(f"A tabela '{tabela}' não possui chave primária.")
+    return campos
+
+
+def _filtrar(linhas, filtros):
+    return [
+        linha
+        for linha in linhas
+        if all(linha.get(campo) == valor for campo, valor in filtros.items())
+    ]
+
+
+class StorageBackend:
+    """Interface comum dos motores de armazenamento."""
+
+    def __init__(self):
+        # Blocos de sequência reservados por este processo: nome -> [próximo, limite).
+        self._blocos = {}
+        self._blocos_lock = threading.Lock()
+
+    def read_data(self, tables=None):
+        """Retorna uma DocumentoView com as tabelas (carregadas sob demanda)."""
+        raise NotImplementedError
+
+    def write_data(self, data, tables=None):
+        """Grava as alterações feitas em uma visão obtida com read_data()."""
+        raise NotImplementedError
+
+    def get(self, tabela, chave):
+        """Busca uma linha pela chave primária. Retorna uma cópia ou None."""
+        raise NotImplementedError
+
+    def find(self, tabela, **filtros):
+        """Busca as linhas cujos campos são iguais aos filtros (cópias)."""
+        raise NotImplementedError
+
+    def version(self, tabela, **filtros):
+        """
+        Carimbo de versão da tabela: muda a cada alteração, então serve de
+        chave para caches derivados dos dados (ex: índices de busca). Com um
+        filtro (ex: NumeroDaUcLead=uc), o motor pode devolver um carimbo que só
+        muda com as linhas filtradas.
+        """
+        raise NotImplementedError
+
+    def marca(self, tabela):
+        """
+        Versão persistida de `tabela`, para validação de caches HTTP (ETag): a
+        mesma em todos os processos enquanto a tabela não muda. O carimbo de
+        version() pode ser só do processo, então cada motor define a sua.
+        """
+        raise NotImplementedError
+
+    def _varrer(self, tabela):
+        """Itera as linhas da tabela sem copiá-las (somente leitura)."""
+        raise NotImplementedError
+
+    def _reservar_bloco(self, nome, tabela, campo, tamanho):
+        """
+        Reserva `tamanho` valores da sequência `nome` de forma atômica entre
+        processos e retorna o primeiro. Uma sequência nova começa depois do
+        maior valor de `campo` já gravado em `tabela`.
+        """
+        raise NotImplementedError
+
+    def next_id(self, tabela, campo):
+        """
+        Próximo valor da sequência de `campo` em `tabela` (ex: NProposta), em O(1).
+        Os valores são únicos entre threads e workers; cada processo reserva
+        Config.SEQUENCE_BLOCK_SIZE valores por vez no armazenamento.
+        """
+        nome = f"{tabela}.{campo}"
+        with self._blocos_lock:
+            bloco = self._blocos.get(nome)
+            if bloco is None or bloco[0] >= bloco[1]:
+                tamanho = max(1, Config.SEQUENCE_BLOCK_SIZE)
+                primeiro = self._reservar_bloco(nome, tabela, campo, tamanho)
+                bloco = self._blocos[nome] = [primeiro, primeiro + tamanho]
+            valor = bloco[0]
+            bloco[0] += 1
+            return valor
+
+    def _por_chaves(self, tabela, chaves):
+        linhas = (self.get(tabela, chave) for chave in chaves)
+        return [linha for linha in linhas if linha is not None]
+
+    def _buscar_texto(self, tabela, consulta):
+        """Linhas com `consulta` nos campos de INDICES_TEXTO (aqui, varrendo a tabela)."""
+        campos = INDICES_TEXTO.get(tabela)
+        if not campos:
+            raise ValueError(f"A tabela '{tabela}' não tem índice de texto.")
+        return [
+            linha
+            for linha in self._varrer(tabela)
+            if corresponde(consulta, textos_da_linha(linha, campos))
+        ]
+
+    def _buscar(self, tabela, filtros):
+        """Linhas com os campos iguais aos filtros, sem copiá-las (somente leitura)."""
+        return self.find(tabela, **filtros)
+
+    def _pagina(self, tabela, ordem, limite, antes, filtro, busca, chaves, filtros):
+        """Linhas originais (sem cópia) da página e se há mais depois dela."""
+        if chaves is not None:
+            linhas = self._por_chaves(tabela, chaves)
+        elif busca:
+            linhas = self._buscar_texto(tabela, busca)
+        elif filtros:
+            linhas = self._buscar(tabela, filtros)
+        else:
+            linhas = self._varrer(tabela)
+        candidatas = (
+            linha
+            for linha in linhas
+            if (antes is None or ordem(linha) < antes)
+            and (filtro is None or filtro(linha))
+        )
+        if limite is None:
+            pagina = sorted(candidatas, key=ordem, reverse=True)
+        else:
+            pagina = heapq.nlargest(limite + 1, candidatas, key=ordem)
+        tem_mais = limite is not None and len(pagina) > limite
+        return pagina[:limite], tem_mais
+
+    def find_page(
+        self,
+        tabela,
+        ordem,
+        limite=None,
+        antes=None,
+        filtro=None,
+        busca=None,
+        chaves=None,
+        filtros=None,
+    ):
+        """
+        Página de uma tabela em ordem decrescente de `ordem(linha)` (paginação
+        por keyset). `antes` é o valor de ordem da última linha da página
+        anterior; `filtro(linha)` descarta linhas; `busca` é uma busca textual
+        nos campos de INDICES_TEXTO; `chaves` restringe a página a essas chaves
+        primárias (ex: resultado de um índice de busca); `filtros` é um dict de
+        igualdades resolvido pelos índices (como em find). Retorna (cópias, tem_mais).
+        Só as linhas da página são copiadas, e sem ordenar a tabela inteira.
+        """
+        pagina, tem_mais = self._pagina(
+            tabela, ordem, limite, antes, filtro, busca, chaves, filtros
+        )
+        return [dict(linha) for linha in pagina], tem_mais
+
+    def iter_page(
+        self,
+        tabela,
+        ordem,
+        limite=None,
+        antes=None,
+        filtro=None,
+        busca=None,
+        chaves=None,
+        filtros=None,
+    ):
+        """
+        Como find_page, mas para respostas em streaming: retorna (gerador,
+        proxima_ordem). O gerador copia cada linha só quando ela é consumida;
+        proxima_ordem é o valor de ordem da última linha da página quando há
+        mais linhas depois dela (para o cursor), ou None.
+        """
+        pagina, tem_mais = self._pagina(
+            tabela, ordem, limite, antes, filtro, busca, chaves, filtros
+        )
+        proxima_ordem = ordem(pagina[-1]) if tem_mais else None
+        return (dict(linha) for linha in pagina), proxima_ordem
+
+    def transaction(self):
+        """
+        Context manager que retorna uma transação com insert/put/update/delete
+        (e get/find, que enxergam as alterações pendentes). As alterações são
+        gravadas juntas ao final do bloco, ou descartadas se ele levantar uma
+        exceção. Se linhas lidas com find mudarem antes do commit, ele levanta
+        ConflictError (só no motor JSON; no SQLite a transação já bloqueia a
+        escrita desde o início).
+        """
+        raise NotImplementedError
+
+
+class _Lote:
+    """Operações de uma gravação (write_data ou transação) à espera do commit."""
+
+    def __init__(self, operacoes, inseridas=(), lidas=()):
+        self.operacoes = operacoes
+        # (tabela, chave) que a transação criou e que não podem existir no commit.
+        self.inseridas = list(inseridas)
+        # (tabela, filtros, versão) lidos por tx.find, que não podem ter mudado.
+        self.lidas = list(lidas)
+        self.concluido = False
+        self.erro = None
+
+
+class _GroupCommit:
+    """
+    Junta as gravações que chegam ao mesmo tempo em um único commit: a primeira
+    thread vira "líder", espera Config.JSON_GROUP_COMMIT_MS pelas demais e grava
+    todos os lotes com um append e um fsync por partição. As outras threads só
+    esperam o resultado do seu lote.
+    """
+
+    def __init__(self, gravar_lotes):
+        self._gravar_lotes = gravar_lotes
+        self._cond = threading.Condition()
+        self._fila = []
+        self._lider = False
+
+    def submeter(self, lote):
+        with self._cond:
+            self._fila.append(lote)
+            while self._lider and not lote.concluido:
+                self._cond.wait()
+            if lote.concluido:
+                if lote.erro:
+                    raise lote.erro
+                return
+            self._lider = True
+
+        lotes = []
+        try:
+            if Config.JSON_GROUP_COMMIT_MS > 0:
+                time.sleep(Config.JSON_GROUP_COMMIT_MS / 1000)
+            with self._cond:
+                lotes, self._fila = self._fila, []
+            try:
+                self._gravar_lotes(lotes)
+            except Exception as e:
+                for item in lotes:
+                    item.erro = item.erro or e
+        finally:
+            with self._cond:
+                for item in lotes:
+                    item.concluido = True
+                self._lider = False
+                self._cond.notify_all()
+
+        if lote.erro:
+            raise lote.erro
+
+
+class _TransacaoJson:
+    """
+    Transação do motor JSON. As operações são acumuladas e aplicadas de uma
+    vez no commit; leituras dentro da transação enxergam as alterações pendentes.
+    As chaves inseridas, e as versões das linhas lidas com find, são conferidas
+    de novo no commit, com o lock do arquivo, porque outro worker pode tê-las
+    alterado nesse meio tempo.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._operacoes = []
+        self._pendentes = {}
+        self._substituidas = {}
+        self._inseridas = []
+        self._lidas = []
+
+    def _registrar(self, op):
+        self._operacoes.append(op)
+        tabela = op["tabela"]
+        if op["op"] == "replace":
+            self._substituidas[tabela] = op["linhas"]
+            self._pendentes = {
+                k: v for k, v in self._pendentes.items() if k[0] != tabela
+            }
+        else:
+            self._pendentes[(tabela, tuple(op["chave"]))] = op.get("linha")
+
+    def _linhas(self, tabela):
+        if tabela in self._substituidas:
+            return self._substituidas[tabela]
+        return self._storage._linhas(tabela)
+
+    def _atual(self, tabela, chave):
+        if (tabela, chave) in self._pendentes:
+            return self._pendentes[(tabela, chave)]
+        if tabela in self._substituidas:
+            campos = _campos_chave(tabela)
+            return next(
+                (l for l in self._substituidas[tabela] if _chave(l, campos) == chave),
+                None,
+            )
+        return self._storage._original(tabela, chave)
+
+    def get(self, tabela, chave):
+        linha = self._atual(tabela, _normalizar_chave(chave))
+        return dict(linha) if linha is not None else None
+
+    def find(self, tabela, **filtros):
+        """
+        Linhas cujos campos são iguais aos filtros, já com as alterações
+        pendentes. Se outra gravação mudar essas linhas antes do commit, ele
+        levanta ConflictError.
+        """
+        if tabela in self._substituidas:
+            return [dict(l) for l in _filtrar(self._substituidas[tabela], filtros)]
+        # A versão é tomada antes da leitura: uma mudança entre as duas também
+        # é detectada no commit.
+        self._lidas.append(
+            (tabela, filtros, self._storage.version(tabela, **filtros))
+        )
+        linhas = self._storage.find(tabela, **filtros)
+        campos = CHAVES_TABELAS.get(tabela)
+        if not campos:
+            return linhas
+        por_chave = {_chave(l, campos): l for l in linhas}
+        for (nome, chave), linha in self._pendentes.items():
+            if nome == tabela:
+                por_chave.pop(chave, None)
+                if linha is not None:
+                    por_chave[chave] = linha
+        return [dict(l) for l in _filtrar(por_chave.values(), filtros)]
+
+    def put(self, tabela, linha):
+        """Insere ou substitui a linha com a mesma chave."""
+        chave = _chave(linha, _campos_chave(tabela))
+        self._registrar(
+            {"tabela": tabela, "op": "put", "chave": list(chave), "linha": dict(linha)}
+        )
+
+    def _exigir_ausente(self, tabela, chave):
+        if self._atual(tabela, chave) is not None:
+            raise IntegrityError(f"Chave {chave} já existe em '{tabela}'.")
+        if (tabela, chave) not in self._pendentes and tabela not in self._substituidas:
+            self._inseridas.append((tabela, chave))
+
+    def insert(self, tabela, linha):
+        """Insere uma linha nova; levanta IntegrityError se a chave já existir."""
+        chave = _chave(linha, _campos_chave(tabela))
+        self._exigir_ausente(tabela, chave)
+        self.put(tabela, linha)
+
+    def update(self, tabela, chave, alteracoes):
+        """
+        Atualiza os campos de uma linha. Retorna a linha atualizada, ou None se
+        a chave não existir. Se as alterações mudarem a chave, a linha é movida.
+        """
+        campos = _campos_chave(tabela)
+        chave = _normalizar_chave(chave)
+        atual = self._atual(tabela, chave)
+        if atual is None:
+            return None
+
+        nova = {**atual, **alteracoes}
+        nova_chave = _chave(nova, campos)
+        if nova_chave != chave:
+            self._exigir_ausente(tabela, nova_chave)
+            self._registrar({"tabela": tabela, "op": "del", "chave": list(chave)})
+        self.put(tabela, nova)
+        return dict(nova)
+
+    def delete(self, tabela, chave):
+        """Remove a linha com a chave informada. Retorna quantas foram removidas."""
+        chave = _normalizar_chave(chave)
+        if self._atual(tabela, chave) is None:
+            return 0
+        self._registrar({"tabela": tabela, "op": "del", "chave": list(chave)})
+        return 1
+
+    def delete_where(self, tabela, **filtros):
+        """Remove as linhas cujos campos são iguais aos filtros."""
+        campos = CHAVES_TABELAS.get(tabela)
+        if not campos:
+            linhas = self._linhas(tabela)
+            restantes = [
+                l for l in linhas
+                if not all(l.get(c) == v for c, v in filtros.items())
+            ]
+            if len(restantes) != len(linhas):
+                self.replace(tabela, restantes)
+            return len(linhas) - len(restantes)
+
+        removidas = 0
+        for linha in self._storage.find(tabela, **filtros):
+            removidas += self.delete(tabela, _chave(linha, campos))
+        return removidas
+
+    def replace(self, tabela, linhas):
+        """Substitui todas as linhas da tabela."""
+        self._registrar(
+            {"tabela": tabela, "op": "replace", "linhas": [dict(l) for l in linhas]}
+        )
+
+    def commit(self):
+        if self._operacoes:
+            self._storage._commit(
+                _Lote(self._operacoes, self._inseridas, self._lidas)
+            )
+        self._operacoes, self._inseridas, self._lidas = [], [], []
+
+
+class JsonStorage(StorageBackend):
+    """Motor JSON: arquivos em instance/, com cache em memória e journal."""
+
+    def __init__(self):
+        super().__init__()
+        self._group_commit = _GroupCommit(self._gravar_lotes)
+
+    def _commit(self, lote):
+        self._group_commit.submeter(lote)
+
+    def _gravar_lotes(self, lotes):
+        """
+        Grava um grupo de lotes. Com o lock de cada partição envolvida (em
+        ordem de caminho, para não haver deadlock) e o lock do seu arquivo,
+        trazemos para a memória o que outros workers gravaram, conferimos as
+        chaves inseridas e as linhas lidas de cada lote e aplicamos os lotes
+        válidos em ordem. Cada partição recebe então um único append (ou
+        reescrita) no disco.
+        """
+        por_tabela = {}
+        for lote in lotes:
+            for op in lote.operacoes:
+                por_tabela.setdefault(op["tabela"], _particao(op["tabela"]))
+            for tabela, _, _ in lote.lidas:
+                por_tabela.setdefault(tabela, _particao(tabela))
+        particoes = sorted(set(por_tabela.values()), key=lambda p: p.caminho)
+        pendentes = {particao: [] for particao in particoes}
+
+        with ExitStack() as locks:
+            for particao in particoes:
+                locks.enter_context(particao.lock)
+                locks.enter_context(_lock_arquivo(particao.caminho_lock))
+                particao.sincronizar()
+            try:
+                for lote in lotes:
+                    conflito = next(
+                        (
+                            (tabela, chave)
+                            for tabela, chave in lote.inseridas
+                            if por_tabela[tabela]._tabela(tabela).get(chave) is not None
+                        ),
+                        None,
+                    )
+                    if conflito:
+                        lote.erro = IntegrityError(
+                            f"Chave {conflito[1]} já existe em '{conflito[0]}'."
+                        )
+                        continue
+                    alterada = next(
+                        (
+                            tabela
+                            for tabela, filtros, versao in lote.lidas
+                            if por_tabela[tabela]._tabela(tabela).versao_de(filtros)
+                            != versao
+                        ),
+                        None,
+                    )
+                    if alterada:
+                        lote.erro = ConflictError(
+                            f"Linhas lidas de '{alterada}' foram alteradas."
+                        )
+                        continue
+                    for op in lote.operacoes:
+                        particao = por_tabela[op["tabela"]]
+                        particao._aplicar_em_memoria([op])
+                        pendentes[particao].append(op)
+
+                compactar = [
+                    particao
+                    for particao, operacoes in pendentes.items()
+                    if operacoes and particao.persistir(operacoes)
+                ]
+            except Exception:
+                # A memória pode estar à frente do disco: forçamos uma releitura.
+                for particao in particoes:
+                    particao.tabelas = None
+                raise
+
+        _commit_stats["commits"] += 1
+        _commit_stats["lotes"] += len(lotes)
+        for particao in compactar:
+            particao.iniciar_compactacao()
+
+    def _linhas(self, tabela):
+        return _particao(tabela).linhas(tabela)
+
+    def _original(self, tabela, chave):
+        _campos_chave(tabela)
+        return _particao(tabela).obter(tabela, chave)
+
+    def read_data(self, tables=None):
+        if _layout_por_tabela():
+            view = DocumentoView(
+                lambda tabela: _particao(tabela).linhas(tabela), TABELAS
+            )
+        else:
+            # Um único arquivo: lemos o documento uma vez para a visão ser consistente.
+            dados = _particao(None).documento()
+            view = DocumentoView(dados.get, list(dados))
+
+        for tabela in tables or []:
+            view._original(tabela)
+        return view
+
+    def write_data(self, data, tables=None):
+        if isinstance(data, DocumentoView):
+            base = data._base
+            tabelas = data.tabelas_acessadas()
+            data = data.materializar()
+        else:
+            base, tabelas = None, list(data)
+
+        if tables is not None:
+            tabelas = [tabela for tabela in tabelas if tabela in tables]
+
+        # As diferenças entre o que a rota leu e o que ela devolveu são aplicadas
+        # sobre o estado mais recente, e não sobre o lido, para não desfazer
+        # alterações feitas por outras requisições nesse meio tempo.
+        por_particao = {}
+        for tabela in tabelas:
+            por_particao.setdefault(_particao(tabela), []).append(tabela)
+        operacoes = []
+        for particao, tabelas_da_particao in por_particao.items():
+            antigos = base if base is not None else particao.documento()
+            operacoes.extend(_diferencas(antigos, data, tabelas_da_particao))
+        if operacoes:
+            self._commit(_Lote(operacoes))
+
+    def get(self, tabela, chave):
+        linha = self._original(tabela, _normalizar_chave(chave))
+        return dict(linha) if linha is not None else None
+
+    def find(self, tabela, **filtros):
+        return [dict(linha) for linha in _particao(tabela).buscar(tabela, filtros)]
+
+    def _varrer(self, tabela):
+        return self._linhas(tabela)
+
+    def _buscar(self, tabela, filtros):
+        return _particao(tabela).buscar(tabela, filtros)
+
+    def _buscar_texto(self, tabela, consulta):
+        return _particao(tabela).buscar_texto(tabela, consulta)
+
+    def _por_chaves(self, tabela, chaves):
+        linhas = (self._original(tabela, _normalizar_chave(c)) for c in chaves)
+        return [linha for linha in linhas if linha is not None]
+
+    def version(self, tabela, **filtros):
+        return _particao(tabela).versao(tabela, filtros)
+
+    def marca(self, tabela):
+        # No layout "por_tabela" cada tabela tem o seu arquivo e journal; no
+        # "arquivo_unico", qualquer gravação muda a marca de todas.
+        return _particao(tabela).marca()
+
+    def _reservar_bloco(self, nome, tabela, campo, tamanho):
+        caminho = Config.JSON_SEQUENCES_PATH
+        with _lock_arquivo(f"{caminho}.lock"):
+            try:
+                with open(caminho, "r", encoding="utf-8") as f:
+                    sequencias = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                sequencias = {}
+
+            primeiro = sequencias.get(nome)
+            if primeiro is None:
+                primeiro = _maior_valor(self._varrer(tabela), campo) + 1
+            sequencias[nome] = primeiro + tamanho
+            _gravar_json_atomico(caminho, sequencias)
+        return primeiro
+
+    @contextmanager
+    def transaction(self):
+        transacao = _TransacaoJson(self)
+        yield transacao
+        transacao.commit()
+
+
+def _quote(identificador):
+    return '"' + identificador.replace('"', '""') + '"'
+
+
+class _TransacaoSqlite:
+    """Transação do motor SQLite (um BEGIN IMMEDIATE ... COMMIT)."""
+
+    def __init__(self, storage, conexao):
+        self._storage = storage
+        self._conexao = conexao
+
+    def _executar(self, sql, parametros=()):
+        try:
+            return self._conexao.execute(sql, parametros)
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+
+    def get(self, tabela, chave):
+        return self._storage._get(self._conexao, tabela, chave)
+
+    def find(self, tabela, **filtros):
+        """Linhas cujos campos são iguais aos filtros, vistas pela transação."""
+        return self._storage._find(self._conexao, tabela, filtros)
+
+    def put(self, tabela, linha):
+        """Insere ou substitui a linha com a mesma chave."""
+        colunas = self._storage._colunas(tabela)
+        chave = ", ".join(_quote(c) for c in _campos_chave(tabela))
+        atualizar = ", ".join(
+            f"{_quote(c)} = excluded.{_quote(c)}" for c in colunas + ["dados"]
+        )
+        sql, valores = self._storage._sql_insert(tabela, linha)
+        self._executar(f"{sql} ON CONFLICT ({chave}) DO UPDATE SET {atualizar}", valores)
+
+    def insert(self, tabela, linha):
+        """Insere uma linha nova; levanta IntegrityError se a chave já existir."""
+        self._executar(*self._storage._sql_insert(tabela, linha))
+
+    def update(self, tabela, chave, alteracoes):
+        """Atualiza os campos de uma linha. Retorna a linha atualizada ou None."""
+        atual = self.get(tabela, chave)
+        if atual is None:
+            return None
+        nova = {**atual, **alteracoes}
+        colunas = self._storage._colunas(tabela)
+        onde, parametros = self._storage._where_chave(tabela, chave)
+        atribuicoes = ", ".join(f"{_quote(c)} = ?" for c in colunas + ["dados"])
+        valores = [nova.get(c) for c in colunas] + [json.dumps(nova, ensure_ascii=False)]
+        self._executar(
+            f"UPDATE {_quote(tabela)} SET {atribuicoes} WHERE {onde}",
+            valores + parametros,
+        )
+        return nova
+
+    def delete(self, tabela, chave):
+        """Remove a linha com a chave informada. Retorna quantas foram removidas."""
+        onde, parametros = self._storage._where_chave(tabela, chave)
+        return self._executar(
+            f"DELETE FROM {_quote(tabela)} WHERE {onde}", parametros
+        ).rowcount
+
+    def delete_where(self, tabela, **filtros):
+        """Remove as linhas cujos campos são iguais aos filtros."""
+        onde, parametros = self._storage._where(tabela, filtros)
+        return self._executar(
+            f"DELETE FROM {_quote(tabela)} WHERE {onde}", parametros
+        ).rowcount
+
+    def replace(self, tabela, linhas):
+        """Substitui todas as linhas da tabela."""
+        self._executar(f"DELETE FROM {_quote(tabela)}")
+        for linha in linhas:
+            if CHAVES_TABELAS.get(tabela):
+                self.put(tabela, linha)
+            else:
+                self.insert(tabela, linha)
+
+
+class SqliteStorage(StorageBackend):
+    """
+    Motor SQLite embutido. Cada tabela do Config vira uma tabela real, com as
+    colunas da chave primária e de INDICES_TABELAS; a linha completa fica em
+    JSON na coluna `dados`, pois os registros não têm um esquema fixo.
+    """
+
+    def __init__(self, caminho):
+        super().__init__()
+        self.caminho = caminho
+        self._local = threading.local()
+        self._criar_esquema()
+
+    def _conexao(self):
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None:
+            os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+            # isolation_level=None: as transações são abertas explicitamente.
+            conexao = sqlite3.connect(self.caminho, isolation_level=None, timeout=30)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexao = conexao
+        return conexao
+
+    def _colunas(self, tabela):
+        colunas = list(CHAVES_TABELAS.get(tabela, ()))
+        for campo in INDICES_TABELAS.get(tabela, ()):
+            if campo not in colunas:
+                colunas.append(campo)
+        return colunas
+
+    def _criar_esquema(self):
+        conexao = self._conexao()
+        # Contador de alterações por tabela, mantido por triggers (ver version()).
+        conexao.execute(
+            "CREATE TABLE IF NOT EXISTS _versoes "
+            "(tabela TEXT PRIMARY KEY, versao INTEGER NOT NULL)"
+        )
+        conexao.execute(
+            "CREATE TABLE IF NOT EXISTS _sequencias "
+            "(nome TEXT PRIMARY KEY, proximo INTEGER NOT NULL)"
+        )
+        for tabela in TABELAS:
+            chave = CHAVES_TABELAS.get(tabela)
+            colunas = [_quote(c) for c in self._colunas(tabela)]
+            if chave:
+                pk = ", ".join(_quote(c) for c in chave)
+                definicao = ", ".join(colunas + ["dados TEXT NOT NULL", f"PRIMARY KEY ({pk})"])
+            else:
+                definicao = ", ".join(
+                    ["id INTEGER PRIMARY KEY AUTOINCREMENT"] + colunas + ["dados TEXT NOT NULL"]
+                )
+            conexao.execute(f"CREATE TABLE IF NOT EXISTS {_quote(tabela)} ({definicao})")
+
+            for campo in INDICES_TABELAS.get(tabela, ()):
+                if chave and chave[0] == campo:
+                    continue  # Já coberto pelo índice da chave primária.
+                conexao.execute(
+                    f"CREATE INDEX IF NOT EXISTS {_quote(f'ix_{tabela}_{campo}')} "
+                    f"ON {_quote(tabela)} ({_quote(campo)})"
+                )
+
+            conexao.execute(
+                "INSERT OR IGNORE INTO _versoes (tabela, versao) VALUES (?, 0)",
+                (tabela,),
+            )
+            nome_literal = "'" + tabela.replace("'", "''") + "'"
+            for evento in ("INSERT", "UPDATE", "DELETE"):
+                conexao.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS "
+                    f"{_quote(f'tr_{tabela}_{evento.lower()}')} "
+                    f"AFTER {evento} ON {_quote(tabela)} BEGIN "
+                    f"UPDATE _versoes SET versao = versao + 1 "
+                    f"WHERE tabela = {nome_literal}; END"
+                )
+
+    def _sql_insert(self, tabela, linha):
+        colunas = self._colunas(tabela)
+        nomes = ", ".join(_quote(c) for c in colunas + ["dados"])
+        marcadores = ", ".join("?" for _ in range(len(colunas) + 1))
+        valores = [linha.get(c) for c in colunas] + [json.dumps(linha, ensure_ascii=False)]
+        return f"INSERT INTO {_quote(tabela)} ({nomes}) VALUES ({marcadores})", valores
+
+    def _where(self, tabela, filtros):
+        colunas = self._colunas(tabela)
+        condicoes, parametros = [], []
+        for campo, valor in filtros.items():
+            expressao = (
+                _quote(campo)
+                if campo in colunas
+                else f"json_extract(dados, '$.\"{campo}\"')"
+            )
+            if valor is None:
+                condicoes.append(f"{expressao} IS NULL")
+            else:
+                condicoes.append(f"{expressao} = ?")
+                parametros.append(valor)
+        return " AND ".join(condicoes) or "1", parametros
+
+    def _where_chave(self, tabela, chave):
+        campos = _campos_chave(tabela)
+        return self._where(tabela, dict(zip(campos, _normalizar_chave(chave))))
+
+    def _get(self, conexao, tabela, chave):
+        onde, parametros = self._where_chave(tabela, chave)
+        registro = conexao.execute(
+            f"SELECT dados FROM {_quote(tabela)} WHERE {onde}", parametros
+        ).fetchone()
+        return json.loads(registro[0]) if registro else None
+
+    def _find(self, conexao, tabela, filtros):
+        onde, parametros = self._where(tabela, filtros)
+        return [
+            json.loads(dados)
+            for (dados,) in conexao.execute(
+                f"SELECT dados FROM {_quote(tabela)} WHERE {onde} ORDER BY rowid",
+                parametros,
+            )
+        ]
+
+    def _todas(self, tabela):
+        return list(self._varrer(tabela))
+
+    def _varrer(self, tabela):
+        # Lê o cursor aos poucos: com limite, a página é escolhida sem carregar
+        # a tabela inteira em memória.
+        return (
+            json.loads(dados)
+            for (dados,) in self._conexao().execute(
+                f"SELECT dados FROM {_quote(tabela)} ORDER BY rowid"
+            )
+        )
+
+    def marca(self, tabela):
+        # O contador dos triggers já é persistido; o inode distingue um banco
+        # recriado (ex: nova importação), em que os contadores recomeçam.
+        return f"{os.stat(self.caminho).st_ino}/{self.version(tabela)}"
+
+    def version(self, tabela, **filtros):
+        # O contador dos triggers é por tabela, então os filtros são ignorados.
+        registro = self._conexao().execute(
+            "SELECT versao FROM _versoes WHERE tabela = ?", (tabela,)
+        ).fetchone()
+        return registro[0] if registro else 0
+
+    def _reservar_bloco(self, nome, tabela, campo, tamanho):
+        conexao = self._conexao()
+        # Dentro de uma transação já aberta nesta conexão, a reserva faz parte dela.
+        propria = not conexao.in_transaction
+        if propria:
+            conexao.execute("BEGIN IMMEDIATE")
+        try:
+            registro = conexao.execute(
+                "SELECT proximo FROM _sequencias WHERE nome = ?", (nome,)
+            ).fetchone()
+            primeiro = (
+                registro[0] if registro else _maior_valor(self._todas(tabela), campo) + 1
+            )
+            conexao.execute(
+                "INSERT INTO _sequencias (nome, proximo) VALUES (?, ?) "
+                "ON CONFLICT(nome) DO UPDATE SET proximo = excluded.proximo",
+                (nome, primeiro + tamanho),
+            )
+        except BaseException:
+            if propria:
+                conexao.execute("ROLLBACK")
+            raise
+        if propria:
+            conexao.execute("COMMIT")
+        return primeiro
+
+    def read_data(self, tables=None):
+        view = DocumentoView(self._todas, TABELAS)
+        for tabela in tables or []:
+            view._original(tabela)
+        return view
+
+    def write_data(self, data, tables=None):
+        if isinstance(data, DocumentoView):
+            base = data._base
+            tabelas = data.tabelas_acessadas()
+            data = data.materializar()
+        else:
+            base, tabelas = None, list(data)
+        if tables is not None:
+            tabelas = [tabela for tabela in tabelas if tabela in tables]
+        tabelas = [tabela for tabela in tabelas if tabela in TABELAS]
+
+        if base is None:
+            base = {tabela: self._todas(tabela) for tabela in tabelas}
+
+        with self.transaction() as transacao:
+            for op in _diferencas(base, data, tabelas):
+                if op["op"] == "put":
+                    transacao.put(op["tabela"], op["linha"])
+                elif op["op"] == "del":
+                    transacao.delete(op["tabela"], op["chave"])
+                else:
+                    transacao.replace(op["tabela"], op["linhas"])
+
+    def get(self, tabela, chave):
+        return self._get(self._conexao(), tabela, chave)
+
+    def find(self, tabela, **filtros):
+        return self._find(self._conexao(), tabela, filtros)
+
+    @contextmanager
+    def transaction(self):
+        conexao = self._conexao()
+        # IMMEDIATE reserva a escrita já no início, inclusive entre processos.
+        conexao.execute("BEGIN IMMEDIATE")
+        try:
+            yield _TransacaoSqlite(self, conexao)
+        except BaseException:
+            conexao.execute("ROLLBACK")
+            raise
+        conexao.execute("COMMIT")
+
+
+_motor = {"chave": None, "instancia": None}
+_motor_lock = threading.Lock()
+
+
+def get_storage():
+    """Retorna o motor de armazenamento configurado em Config.STORAGE_ENGINE."""
+    chave = (Config.STORAGE_ENGINE, Config.SQLITE_DB_PATH)
+    with _motor_lock:
+        if _motor["chave"] != chave:
+            if Config.STORAGE_ENGINE == "sqlite":
+                _motor["instancia"] = SqliteStorage(Config.SQLITE_DB_PATH)
+            elif Config.STORAGE_ENGINE == "json":
+                _motor["instancia"] = JsonStorage()
+            else:
+                raise ValueError(
+                    f"Motor de armazenamento desconhecido: {Config.STORAGE_ENGINE}"
+                )
+            _motor["chave"] = chave
+        return _motor["instancia"]
+
+
+def read_data(tables=None):
+    """
+    Lê os dados do banco.
+    Retorna uma visão copy-on-write, que pode ser alterada sem afetar o cache;
+    cada tabela só é carregada quando a rota a acessa pela primeira vez.
+    `tables` (opcional) lista as tabelas que devem ser carregadas já na chamada.
+    Se o arquivo não existir ou estiver vazio, as tabelas vêm vazias.
+    """
+    return get_storage().read_data(tables)
+
+
+def write_data(data, tables=None):
+    """
+    Grava as alterações feitas em `data` (normalmente obtido com read_data()).
+
+    Apenas as tabelas acessadas pela rota (ou as listadas em `tables`) e, dentro
+    delas, apenas as linhas que mudaram são consideradas. No motor JSON com
+    journal (Config.JSON_DB_JOURNAL) elas são anexadas ao log, e o custo da
+    escrita depende do tamanho da alteração.
+    """
+    get_storage().write_data(data, tables)
+
+
+def get_row(tabela, chave):
+    """Busca uma linha pela chave primária (ex: get_row(LEADS_TABLE, cpf))."""
+    return get_storage().get(tabela, chave)
+
+
+def find_rows(tabela, **filtros):
+    """Busca as linhas de uma tabela cujos campos são iguais aos filtros."""
+    return get_storage().find(tabela, **filtros)
+
+
+def find_page(
+    tabela,
+    ordem,
+    limite=None,
+    antes=None,
+    filtro=None,
+    busca=None,
+    chaves=None,
+    filtros=None,
+):
+    """
+    Página de `tabela` em ordem decrescente de `ordem(linha)`, começando depois
+    do valor `antes` (cursor). `busca` filtra pelo índice de texto da tabela
+    (ver INDICES_TEXTO), `chaves` restringe às chaves primárias informadas e
+    `filtros` a campos iguais (ex: {"NumeroDaUcLead": uc}).
+    Retorna (linhas, tem_mais).
+    """
+    return get_storage().find_page(
+        tabela, ordem, limite, antes, filtro, busca, chaves, filtros
+    )
+
+
+def iter_page(
+    tabela,
+    ordem,
+    limite=None,
+    antes=None,
+    filtro=None,
+    busca=None,
+    chaves=None,
+    filtros=None,
+):
+    """
+    Como find_page, para respostas em streaming: retorna (gerador de cópias,
+    proxima_ordem), com proxima_ordem = ordem da última linha se houver mais.
+    """
+    return get_storage().iter_page(
+        tabela, ordem, limite, antes, filtro, busca, chaves, filtros
+    )
+
+
+def next_id(tabela, campo):
+    """Próximo valor da sequência persistida de `campo` (ex: NProposta)."""
+    return get_storage().next_id(tabela, campo)
+
+
+def table_version(tabela, **filtros):
+    """
+    Carimbo de versão de `tabela` (ou só das linhas de `filtros`, ex:
+    table_version(HISTORICO_TABLE, NumeroDaUcLead=uc)); muda a cada alteração.
+    """
+    return get_storage().version(tabela, **filtros)
+
+
+def tables_mark(*tabelas):
+    """
+    Marca do estado persistido de várias tabelas (ex: para um ETag): muda
+    quando qualquer uma delas muda e é igual em todos os workers.
+    """
+    motor = get_storage()
+    return "|".join(
+        [Config.STORAGE_ENGINE] + [f"{t}={motor.marca(t)}" for t in tabelas]
+    )
+
+
+def transaction():
+    """Abre uma transação no motor configurado (use com `with`)."""
+    return get_storage().transaction()
+
+
+def importar_json_para_sqlite(caminho_json=None, caminho_sqlite=None):
+    """
+    Importa um dados.json existente (e o seu journal, se houver) para o banco
+    SQLite. Sem `caminho_json`, importa os dados atuais do motor JSON.
+    Linhas com a chave repetida ficam com a última ocorrência.
+    Retorna um dict tabela -> quantidade de linhas importadas.
+    """
+    if caminho_json:
+        origem = _Particao(
+            caminho_json,
+            caminho_json.rsplit(".", 1)[0] + ".journal",
+            usa_journal=True,
+        )
+        dados = origem.documento()
+    else:
+        view = JsonStorage().read_data()
+        dados = {tabela: view[tabela] for tabela in TABELAS}
+
+    destino = SqliteStorage(caminho_sqlite or Config.SQLITE_DB_PATH)
+    contagem = {}
+    with destino.transaction() as transacao:
+        for tabela in TABELAS:
+            linhas = dados.get(tabela, [])
+            transacao.replace(tabela, linhas)
+            contagem[tabela] = len(linhas)
+    print(f"[INFO] Importação para SQLite concluída: {sum(contagem.values())} linhas.")
+    return contagem
+
+
+def get_cache_stats():
+    """Retorna os contadores de acertos (hits) e faltas (misses) do cache JSON."""
+    with _particoes_lock:
+        particoes = list(_particoes.values())
+    total = _cache_stats["hits"] + _cache_stats["misses"]
+    return {
+        "hits": _cache_stats["hits"],
+        "misses": _cache_stats["misses"],
+        "recargas_parciais": _cache_stats["recargas_parciais"],
+        "taxa_acerto": (_cache_stats["hits"] / total) if total else 0.0,
+        "particoes": len(particoes),
+        "journal_bytes": sum(particao.offset for particao in particoes),
+        "group_commit": dict(_commit_stats),
+    }
+
+
+def invalidate_cache():
+    """Descarta os dados em cache, forçando uma releitura na próxima chamada."""
+    with _particoes_lock:
+        _particoes.clear()
+        _migracao["verificada"] = None
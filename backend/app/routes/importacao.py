@@ -0,0 +1,67 @@
+# backend/app/routes/importacao.py
+
+import csv
+import io
+
+import pandas as pd
+from flask import Blueprint, jsonify, request
+from ..database import IntegrityError
+from ..services.import_service import (
+    formato_do_arquivo,
+    importar_historico,
+    importar_leads,
+)
+
+bp = Blueprint("importacao", __name__, url_prefix="/api/import")
+
+
+@bp.route("/historico", methods=["POST"])
+def importar_historico_arquivo():
+    """
+    Importa o histórico de consumo de várias UCs a partir de um CSV ou XLSX,
+    enviado no campo `arquivo` (multipart) ou no próprio corpo da requisição
+    (com ?formato=csv|xlsx). Retorna o relatório com os erros por linha.
+    """
+    arquivo = request.files.get("arquivo")
+    try:
+        formato = formato_do_arquivo(
+            arquivo.filename if arquivo else None, request.args.get("formato")
+        )
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    if arquivo is not None:
+        conteudo = arquivo.stream
+    elif formato == "csv":
+        conteudo = io.BufferedReader(request.stream, 64 * 1024)
+    else:
+        # O leitor de Excel precisa de um arquivo com acesso aleatório.
+        conteudo = io.BytesIO(request.get_data())
+
+    try:
+        relatorio = importar_historico(conteudo, formato)
+    except (ValueError, csv.Error, pd.errors.ParserError) as e:
+        # csv.Error: o separador não pôde ser detectado (ex: arquivo vazio ou
+        # com uma só coluna).
+        return jsonify({"erro": f"Não foi possível importar o arquivo: {e}"}), 400
+
+    return jsonify(relatorio)
+
+
+@bp.route("/leads", methods=["POST"])
+def importar_leads_ndjson():
+    """
+    Cadastra leads em lote a partir de um NDJSON no corpo da requisição: uma
+    linha por lead, com `vendedor`, `contato` e a lista `unidades` aninhados.
+    O corpo é lido linha a linha e tudo é gravado em uma única transação.
+    """
+    try:
+        # Leitura bufferizada: iterar o stream cru lê um byte por vez.
+        relatorio = importar_leads(io.BufferedReader(request.stream, 64 * 1024))
+    except IntegrityError:
+        # Outro processo cadastrou um dos CPFs/CNPJs durante a importação.
+        return (
+            jsonify({"erro": "Um dos CPF/CNPJ foi cadastrado durante a importação."}),
+            409,
+        )
+    return jsonify(relatorio)
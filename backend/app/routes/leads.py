@@ -1,68 +1,108 @@
 # backend/app/routes/leads.py (VERSÃO FINAL CORRIGIDA PARA JSON)
 
 from flask import Blueprint, jsonify, request, current_app
-from ..database import read_data, write_data  # <-- Importa as novas funções!
+from ..database import get_row, iter_page, transaction, IntegrityError
+from ..services.import_service import novo_contato, novo_vendedor
+from ..services.locality_service import indice_localidades, versao_localidades
+from ..utils import (
+    conditional_get,
+    encode_cursor,
+    parse_fields,
+    parse_page_args,
+    select_fields,
+    stream_mode,
+    stream_rows,
+)
 from datetime import datetime
 
 # Cria o Blueprint para as rotas de leads
 bp = Blueprint("leads", __name__, url_prefix="/api/leads")
 
 
+def _versao_cidades():
+    """Marca das localidades no ETag só quando a resposta as usa (?cidade_nome=1)."""
+    if request.args.get("cidade_nome") == "1":
+        return versao_localidades()
+    return ""
+
+
 @bp.route("", methods=["GET", "POST"])
+@conditional_get(
+    "LEADS_TABLE", "VENDEDORES_TABLE", "CONTATOS_TABLE", versao=_versao_cidades
+)
 def handle_leads():
-    # Para operações com JSON, lemos o "banco de dados" no início de cada requisição
-    db_data = read_data()
-
     if request.method == "GET":
-        filtro = request.args.get("filtro", "").lower()
+        filtro = request.args.get("filtro", "")
+        campos = parse_fields(request.args)
+        try:
+            limite, cursor = parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify({"erro": str(e)}), 400
 
         # Pega os nomes das "tabelas" do app config
         leads_table = current_app.config["LEADS_TABLE"]
         vendedores_table = current_app.config["VENDEDORES_TABLE"]
         contatos_table = current_app.config["CONTATOS_TABLE"]
 
-        # Pega as listas de dados do nosso "banco" JSON
-        leads = db_data.get(leads_table, [])
-        vendedores = db_data.get(vendedores_table, [])
-        contatos = db_data.get(contatos_table, [])
+        # --- SIMULAÇÃO DE 'ORDER BY' (e cursor por keyset) ---
+        # O CPF/CNPJ desempata leads registrados no mesmo instante.
+        def ordem(lead):
+            return (
+                str(lead.get("DataResgistroLead") or "1900-01-01"),
+                str(lead.get("Cpf_CnpjLead", "")),
+            )
+
+        try:
+            # As linhas da página são copiadas uma a uma, conforme são usadas.
+            linhas, proxima_ordem = iter_page(
+                leads_table,
+                ordem,
+                limite,
+                antes=cursor,
+                # --- SIMULAÇÃO DE FILTRO 'LIKE' ---
+                # Busca pelo índice de trigramas em RazaoSocialLead, Cpf_CnpjLead e
+                # NomeFantasia (ver INDICES_TEXTO), ignorando acentos e pontuação.
+                busca=filtro,
+            )
+        except TypeError:
+            return jsonify({"erro": "Cursor inválido."}), 400
+        proximo_cursor = None if proxima_ordem is None else encode_cursor(proxima_ordem)
+
+        # Com ?cidade_nome=1, o código em Cidade é resolvido para CidadeNome/Uf
+        # pelo índice de localidades (se os campos pedidos precisarem dele).
+        localidades = None
+        if request.args.get("cidade_nome") == "1" and (
+            campos is None or "CidadeNome" in campos or "Uf" in campos
+        ):
+            localidades = indice_localidades()
 
         # --- SIMULAÇÃO DE 'LEFT JOIN' ---
-        # Cria dicionários para busca rápida, evitando loops aninhados
-        vendedores_map = {v["Cpf_CnpjLead"]: v for v in vendedores}
-        contatos_map = {c["Cpf_CnpjLead"]: c for c in contatos}
-
-        resultados = []
-        for lead in leads:
-            # Cria uma cópia para não modificar a "tabela" original em memória
-            lead_copy = lead.copy()
-
-            vendedor_info = vendedores_map.get(lead_copy.get("Cpf_CnpjLead"))
-            if vendedor_info:
-                lead_copy["Vendedor"] = vendedor_info.get("Vendedor")
-
-            contato_info = contatos_map.get(lead_copy.get("Cpf_CnpjLead"))
-            if contato_info:
-                lead_copy["Contato"] = contato_info.get("NomeContato")
-
-            resultados.append(lead_copy)
-
-        # --- SIMULAÇÃO DE FILTRO 'LIKE' ---
-        if filtro:
-            resultados_filtrados = [
-                lead
-                for lead in resultados
-                if filtro in str(lead.get("RazaoSocialLead", "")).lower()
-                or filtro in str(lead.get("Cpf_CnpjLead", "")).lower()
-                or filtro in str(lead.get("NomeFantasia", "")).lower()
-            ]
-            resultados = resultados_filtrados
-
-        # --- SIMULAÇÃO DE 'ORDER BY' ---
-        resultados.sort(
-            key=lambda x: x.get("DataResgistroLead", "1900-01-01"), reverse=True
-        )
-
-        return jsonify(resultados)
+        # Só para as linhas da página, e só se os campos pedidos precisarem dele.
+        def completar(lead):
+            cpf_cnpj = lead.get("Cpf_CnpjLead")
+
+            if localidades is not None:
+                localidades.resolver_cidade(lead)
+
+            if campos is None or "Vendedor" in campos:
+                vendedor_info = get_row(vendedores_table, cpf_cnpj)
+                if vendedor_info:
+                    lead["Vendedor"] = vendedor_info.get("Vendedor")
+
+            if campos is None or "Contato" in campos:
+                contato_info = get_row(contatos_table, cpf_cnpj)
+                if contato_info:
+                    lead["Contato"] = contato_info.get("NomeContato")
+
+            return select_fields(lead, campos)
+
+        resultados = (completar(lead) for lead in linhas)
+        modo = stream_mode(request)
+        if modo:
+            return stream_rows(resultados, modo, limite is not None, proximo_cursor)
+        if limite is None:
+            return jsonify(list(resultados))
+        return jsonify({"dados": list(resultados), "proximo_cursor": proximo_cursor})
 
     if request.method == "POST":
         novo_lead = request.json
@@ -75,89 +115,60 @@ def handle_leads():
 
         leads_table = current_app.config["LEADS_TABLE"]
 
-        # Verifica se o lead já existe (simulação de 'IntegrityError')
-        if any(
-            lead.get("Cpf_CnpjLead") == novo_lead.get("Cpf_CnpjLead")
-            for lead in db_data[leads_table]
-        ):
-            return jsonify({"erro": "Este CPF/CNPJ já existe na base de dados."}), 409
-
         # Adiciona dados automáticos
         novo_lead["DataResgistroLead"] = datetime.now().isoformat()
 
-        db_data[leads_table].append(novo_lead)
-        write_data(db_data)
+        # O insert recusa chaves repetidas (IntegrityError)
+        try:
+            with transaction() as tx:
+                tx.insert(leads_table, novo_lead)
+        except IntegrityError:
+            return jsonify({"erro": "Este CPF/CNPJ já existe na base de dados."}), 409
 
         return jsonify({"sucesso": "Lead criado com sucesso"}), 201
 
 
 @bp.route("/<path:lead_id>", methods=["GET", "PUT"])
 def handle_lead_by_id(lead_id):
-    db_data = read_data()
     leads_table = current_app.config["LEADS_TABLE"]
-    leads = db_data.get(leads_table, [])
-
-    # Encontra o lead e seu índice na lista
-    lead_encontrado = None
-    indice_lead = -1
-    for i, lead in enumerate(leads):
-        if lead.get("Cpf_CnpjLead") == lead_id:
-            lead_encontrado = lead
-            indice_lead = i
-            break
-
-    if not lead_encontrado:
-        return jsonify({"erro": "Lead não encontrado"}), 404
 
     if request.method == "GET":
+        lead_encontrado = get_row(leads_table, lead_id)
+        if not lead_encontrado:
+            return jsonify({"erro": "Lead não encontrado"}), 404
         return jsonify(lead_encontrado)
 
     if request.method == "PUT":
         dados_atualizacao = request.json
-        lead_encontrado.update(dados_atualizacao)
-
-        # Atualiza o lead na lista original
-        db_data[leads_table][indice_lead] = lead_encontrado
+        try:
+            with transaction() as tx:
+                lead_atualizado = tx.update(leads_table, lead_id, dados_atualizacao)
+        except IntegrityError:
+            return jsonify({"erro": "Este CPF/CNPJ já existe na base de dados."}), 409
 
-        write_data(db_data)
+        if not lead_atualizado:
+            return jsonify({"erro": "Lead não encontrado"}), 404
         return jsonify({"sucesso": "Lead atualizado com sucesso"})
 
 
 @bp.route("/<path:lead_id>/vendedor-contato", methods=["POST"])
 def add_vendedor_contato(lead_id):
     data = request.json
-    db_data = read_data()
 
     vendedores_table = current_app.config["VENDEDORES_TABLE"]
     contatos_table = current_app.config["CONTATOS_TABLE"]
 
-    # Filtra as listas, mantendo apenas os registros que NÃO são do lead_id atual
-    db_data[vendedores_table] = [
-        v for v in db_data.get(vendedores_table, []) if v.get("Cpf_CnpjLead") != lead_id
-    ]
-    db_data[contatos_table] = [
-        c for c in db_data.get(contatos_table, []) if c.get("Cpf_CnpjLead") != lead_id
-    ]
-
-    if data.get("Vendedor"):
-        novo_vendedor = {
-            "Cpf_CnpjLead": lead_id,
-            "Vendedor": data.get("Vendedor"),
-            "DataDeEnvioLead": data.get("DataEnvio"),  # Armazena como string
-            "ValidadeLead": data.get("DataValidade"),  # Armazena como string
-        }
-        db_data[vendedores_table].append(novo_vendedor)
-
-    if data.get("NomeContato"):
-        novo_contato = {
-            "Cpf_CnpjLead": lead_id,
-            "NomeContato": data.get("NomeContato"),
-            "e-mail": data.get("Email"),
-            "Telefone": data.get("Telefone"),
-        }
-        db_data[contatos_table].append(novo_contato)
-
-    write_data(db_data)
+    with transaction() as tx:
+        # Remove os registros atuais do lead antes de gravar os novos
+        tx.delete(vendedores_table, lead_id)
+        tx.delete(contatos_table, lead_id)
+
+        if data.get("Vendedor"):
+            tx.put(vendedores_table, novo_vendedor(lead_id, data))
+
+        if data.get("NomeContato"):
+            tx.put(contatos_table, novo_contato(lead_id, data))
+
     return (
         jsonify({"sucesso": "Informações de Vendedor/Contato salvas com sucesso!"}),
         201,
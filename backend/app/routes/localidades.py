@@ -1,68 +1,56 @@
-from flask import Blueprint, jsonify, current_app
-import pandas as pd
-import os
+from flask import Blueprint, Response, current_app, jsonify, request
 
-bp = Blueprint("localidades", __name__, url_prefix="/api/localidades")
-
-# Variável para servir como cache em memória para o DataFrame do Excel.
-_localidades_df = None
+from ..services.locality_service import indice_localidades, versao_localidades
+from ..utils import conditional_get, to_int
 
+bp = Blueprint("localidades", __name__, url_prefix="/api/localidades")
 
-def get_localidades_df():
-    """
-    Carrega o DataFrame de localidades a partir do arquivo Excel na primeira vez
-    e o reutiliza (cacheia) nas chamadas subsequentes.
-    """
-    global _localidades_df
+# As listas vêm do índice compilado de ListaDeMunicipios.xls (ver
+# locality_service e o comando `flask compilar-localidades`), já ordenadas e
+# serializadas: as rotas só devolvem os bytes prontos.
 
-    # Se o DataFrame ainda não foi carregado, lê o arquivo
-    if _localidades_df is None:
-        excel_path = current_app.config["EXCEL_LOCATIONS_PATH"]
-        if not os.path.exists(excel_path):
-            print(f"[AVISO] Arquivo de localidades não encontrado: {excel_path}")
-            _localidades_df = (
-                pd.DataFrame()
-            )  # Cria um DataFrame vazio para evitar novos erros
-        else:
-            try:
-                df = pd.read_excel(excel_path, sheet_name="Municípios")
-                _localidades_df = df
-                print(f"[INFO] Carregadas {len(df)} localidades do arquivo Excel.")
-            except Exception as e:
-                print(f"[ERRO] Falha ao carregar o arquivo de localidades: {e}")
-                _localidades_df = pd.DataFrame()
 
-    return _localidades_df
+def _resposta_json(corpo):
+    return Response(corpo, mimetype="application/json")
 
 
 @bp.route("/estados", methods=["GET"])
+@conditional_get(versao=versao_localidades)
 def get_estados():
     try:
-        df = get_localidades_df()
-        if not df.empty:
-            estados = sorted(df["Uf"].unique().tolist())
-            return jsonify(estados)
-        return jsonify([])
+        return _resposta_json(indice_localidades().estados_json)
     except Exception as e:
         print(f"[ERRO] ao buscar estados: {e}")
         return jsonify({"erro": "Erro interno ao processar a lista de estados"}), 500
 
 
 @bp.route("/cidades/<string:uf>", methods=["GET"])
+@conditional_get(versao=versao_localidades)
 def get_cidades_por_uf(uf):
     try:
-        df = get_localidades_df()
-        if not df.empty and uf:
-            cidades_df = df[df["Uf"] == uf][["Cidade", "Codigo"]]
-            cidades_list = [
-                {
-                    "Cidade": row["Cidade"],
-                    "Codigo": int(row["Codigo"]) if pd.notna(row["Codigo"]) else None,
-                }
-                for _, row in cidades_df.sort_values(by="Cidade").iterrows()
-            ]
-            return jsonify(cidades_list)
-        return jsonify([])
+        return _resposta_json(indice_localidades().cidades_da_uf(uf))
     except Exception as e:
         print(f"[ERRO] ao buscar cidades para a UF {uf}: {e}")
         return jsonify({"erro": "Erro interno ao processar a lista de cidades"}), 500
+
+
+@bp.route("/busca", methods=["GET"])
+@conditional_get(versao=versao_localidades)
+def buscar_cidades():
+    """Autocompletar de cidades: ?q=<início do nome>&uf=<UF opcional>&limit=<N>."""
+    consulta = request.args.get("q", "").strip()
+    if not consulta:
+        return jsonify({"erro": "O parâmetro 'q' é obrigatório."}), 400
+
+    limite = current_app.config["LOCALIDADES_BUSCA_LIMITE"]
+    if request.args.get("limit"):
+        limite = to_int(request.args.get("limit"))
+        if limite is None or limite <= 0:
+            return (
+                jsonify({"erro": "O parâmetro 'limit' deve ser um número inteiro positivo."}),
+                400,
+            )
+    limite = min(limite, current_app.config["LOCALIDADES_BUSCA_LIMITE_MAX"])
+
+    uf = request.args.get("uf", "").strip().upper() or None
+    return jsonify(indice_localidades().buscar_cidades(consulta, uf, limite))
@@ -1,4 +1,6 @@
-from flask import Blueprint, redirect
+from flask import Blueprint, redirect, jsonify
+from ..database import get_cache_stats
+from ..services.simulation_service import cache_simulacoes
 import os
 
 bp = Blueprint("main", __name__)
@@ -13,3 +15,14 @@ def index():
 @bp.route("/favicon.ico")
 def favicon():
     return "", 204
+
+
+@bp.route("/api/status", methods=["GET"])
+def status():
+    """Expõe métricas internas da aplicação (ex: uso do cache do banco JSON)."""
+    return jsonify(
+        {
+            "cache_documento": get_cache_stats(),
+            "cache_simulacao": cache_simulacoes.estatisticas(),
+        }
+    )
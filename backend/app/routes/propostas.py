@@ -1,7 +1,16 @@
 # backend/app/routes/propostas.py (VERSÃO REFATORADA PARA JSON)
 
 from flask import Blueprint, jsonify, request, current_app
-from ..database import read_data, write_data
+from ..database import find_rows, get_row, iter_page, next_id, transaction
+from ..services.search_service import indice_propostas
+from ..utils import (
+    encode_cursor,
+    parse_fields,
+    parse_page_args,
+    select_fields,
+    stream_mode,
+    stream_rows,
+)
 from datetime import datetime
 
 bp = Blueprint("propostas", __name__, url_prefix="/api/propostas")
@@ -9,58 +18,74 @@ bp = Blueprint("propostas", __name__, url_prefix="/api/propostas")
 
 @bp.route("", methods=["GET", "POST"])
 def handle_propostas():
-    db_data = read_data()
-
     if request.method == "GET":
         filtro = request.args.get("filtro", "").lower()
+        campos = parse_fields(request.args)
+        try:
+            limite, cursor = parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify({"erro": str(e)}), 400
 
         # Pega os nomes das "tabelas" do config
         propostas_table = current_app.config["PROPOSTA_TABLE"]
         obs_table = current_app.config["OBSERVACOES_TABLE"]
         contato_proposta_table = current_app.config["CONTATO_PROPOSTA_TABLE"]
 
-        # Pega as listas de dados
-        propostas = db_data.get(propostas_table, [])
-        observacoes = db_data.get(obs_table, [])
-        contatos_proposta = db_data.get(contato_proposta_table, [])
-
-        # --- SIMULAÇÃO DE 'LEFT JOIN' ---
-        # Cria mapas para busca rápida
-        obs_map = {o["IdProposta"]: o for o in observacoes}
-        contatos_map = {cp["IdProposta"]: cp for cp in contatos_proposta}
-
-        resultados = []
-        for proposta in propostas:
-            proposta_copy = proposta.copy()
-            n_proposta = proposta_copy.get("NProposta")
-
-            obs_info = obs_map.get(n_proposta)
-            if obs_info:
-                proposta_copy["Usuario"] = obs_info.get("Usuario")
-
-            contato_info = contatos_map.get(n_proposta)
-            if contato_info:
-                proposta_copy["NomeContato"] = contato_info.get("NomeContato")
-
-            resultados.append(proposta_copy)
+        # Busca pelo índice de IdProposta; como no mapa antigo, vale a última linha.
+        def ultima(tabela, n_proposta):
+            linhas = find_rows(tabela, IdProposta=n_proposta)
+            return linhas[-1] if linhas else None
 
         # --- SIMULAÇÃO DE FILTRO 'LIKE' ---
-        if filtro:
-            resultados_filtrados = [
-                p
-                for p in resultados
-                if filtro in str(p.get("RazaoSocialLead", "")).lower()
-                or filtro in str(p.get("AgenteDeVenda", "")).lower()
-                or filtro in str(p.get("StatusNegociacao", "")).lower()
-                or filtro in str(p.get("NomeContato", "")).lower()
-                or str(p.get("NProposta", "")).startswith(filtro)
-            ]
-            resultados = resultados_filtrados
-
-        # --- SIMULAÇÃO DE 'ORDER BY' ---
-        resultados.sort(key=lambda x: int(x.get("NProposta", 0)), reverse=True)
-
-        return jsonify(resultados)
+        # O índice de propostas resolve o texto livre, o prefixo do NProposta e
+        # as facetas exatas (status/agente), devolvendo só os NProposta encontrados.
+        status = request.args.get("status")
+        agente = request.args.get("agente")
+        numeros = None
+        if filtro or status is not None or agente is not None:
+            numeros = indice_propostas().buscar(filtro, status, agente)
+
+        # --- SIMULAÇÃO DE 'ORDER BY' (e cursor por keyset) ---
+        def ordem(p):
+            return (int(p.get("NProposta", 0)),)
+
+        try:
+            # As linhas da página são copiadas uma a uma, conforme são usadas.
+            linhas, proxima_ordem = iter_page(
+                propostas_table,
+                ordem,
+                limite,
+                antes=cursor,
+                chaves=numeros,
+            )
+        except TypeError:
+            return jsonify({"erro": "Cursor inválido."}), 400
+        proximo_cursor = None if proxima_ordem is None else encode_cursor(proxima_ordem)
+
+        # --- SIMULAÇÃO DE 'LEFT JOIN' ---
+        # Só para as linhas da página, e só se os campos pedidos precisarem dele.
+        def completar(proposta):
+            n_proposta = proposta.get("NProposta")
+
+            if campos is None or "Usuario" in campos:
+                obs_info = ultima(obs_table, n_proposta)
+                if obs_info:
+                    proposta["Usuario"] = obs_info.get("Usuario")
+
+            if campos is None or "NomeContato" in campos:
+                contato_info = ultima(contato_proposta_table, n_proposta)
+                if contato_info:
+                    proposta["NomeContato"] = contato_info.get("NomeContato")
+
+            return select_fields(proposta, campos)
+
+        resultados = (completar(p) for p in linhas)
+        modo = stream_mode(request)
+        if modo:
+            return stream_rows(resultados, modo, limite is not None, proximo_cursor)
+        if limite is None:
+            return jsonify(list(resultados))
+        return jsonify({"dados": list(resultados), "proximo_cursor": proximo_cursor})
 
     if request.method == "POST":
         data = request.json
@@ -73,29 +98,12 @@ def handle_propostas():
                 400,
             )
 
-        # --- LÓGICA PARA GERAR NOVO ID DA PROPOSTA ---
         propostas_table = current_app.config["PROPOSTA_TABLE"]
-        propostas = db_data.get(propostas_table, [])
-        if not propostas:
-            next_n_proposta = 1
-        else:
-            # Simula 'SELECT MAX(NProposta)'
-            max_n_proposta = max(int(p.get("NProposta", 0)) for p in propostas)
-            next_n_proposta = max_n_proposta + 1
-
-        id_proposta_texto = f"DPL_{datetime.now().year}_{next_n_proposta}"
 
         # --- BUSCA INFORMAÇÕES DO LEAD ---
         lead_id = data.get("Cpf_CnpjLead")
         leads_table = current_app.config["LEADS_TABLE"]
-        lead_info = next(
-            (
-                lead
-                for lead in db_data.get(leads_table, [])
-                if lead.get("Cpf_CnpjLead") == lead_id
-            ),
-            None,
-        )
+        lead_info = get_row(leads_table, lead_id)
 
         if not lead_info:
             return (
@@ -103,6 +111,12 @@ def handle_propostas():
                 404,
             )
 
+        # --- LÓGICA PARA GERAR NOVO ID DA PROPOSTA ---
+        # Sequência persistida no armazenamento: O(1) e sem números repetidos
+        # mesmo com vários workers criando propostas ao mesmo tempo.
+        next_n_proposta = next_id(propostas_table, "NProposta")
+        id_proposta_texto = f"DPL_{datetime.now().year}_{next_n_proposta}"
+
         # --- CRIA OS NOVOS REGISTROS ---
         nova_proposta = {
             "IdProposta": id_proposta_texto,
@@ -126,9 +140,9 @@ def handle_propostas():
         }
 
         # --- SALVA OS DADOS ---
-        db_data[propostas_table].append(nova_proposta)
-        db_data.get(uc_proposta_table, []).append(nova_uc_proposta)
-        write_data(db_data)
+        with transaction() as tx:
+            tx.insert(propostas_table, nova_proposta)
+            tx.put(uc_proposta_table, nova_uc_proposta)
 
         return (
             jsonify({"sucesso": f"Proposta {id_proposta_texto} salva com sucesso!"}),
@@ -138,39 +152,31 @@ def handle_propostas():
 
 @bp.route("/<int:n_proposta>", methods=["GET", "PUT", "DELETE"])
 def handle_proposta_by_id(n_proposta):
-    db_data = read_data()
     propostas_table = current_app.config["PROPOSTA_TABLE"]
-    propostas = db_data.get(propostas_table, [])
-
-    # Encontra a proposta e seu índice
-    proposta_encontrada = None
-    indice_proposta = -1
-    for i, p in enumerate(propostas):
-        if p.get("NProposta") == n_proposta:
-            proposta_encontrada = p
-            indice_proposta = i
-            break
-
-    if not proposta_encontrada:
-        return jsonify({"erro": "Proposta não encontrada"}), 404
 
     if request.method == "GET":
+        proposta_encontrada = get_row(propostas_table, n_proposta)
+        if not proposta_encontrada:
+            return jsonify({"erro": "Proposta não encontrada"}), 404
         return jsonify(proposta_encontrada)
 
     if request.method == "PUT":
         data = request.json
-        proposta_encontrada.update(
-            {
-                "AgenteDeVenda": data.get("AgenteDeVenda"),
-                "StatusNegociacao": data.get("StatusNegociacao"),
-                "DataStatusNegociacao": data.get("DataStatusNegociacao"),
-                "DataDeEnvio": data.get("DataDeEnvio"),
-                "DataValidade": data.get("DataValidade"),
-            }
-        )
+        with transaction() as tx:
+            proposta_atualizada = tx.update(
+                propostas_table,
+                n_proposta,
+                {
+                    "AgenteDeVenda": data.get("AgenteDeVenda"),
+                    "StatusNegociacao": data.get("StatusNegociacao"),
+                    "DataStatusNegociacao": data.get("DataStatusNegociacao"),
+                    "DataDeEnvio": data.get("DataDeEnvio"),
+                    "DataValidade": data.get("DataValidade"),
+                },
+            )
 
-        db_data[propostas_table][indice_proposta] = proposta_encontrada
-        write_data(db_data)
+        if not proposta_atualizada:
+            return jsonify({"erro": "Proposta não encontrada"}), 404
         return jsonify({"sucesso": "Proposta atualizada com sucesso!"})
 
     if request.method == "DELETE":
@@ -179,23 +185,14 @@ def handle_proposta_by_id(n_proposta):
         obs_table = current_app.config["OBSERVACOES_TABLE"]
         contato_table = current_app.config["CONTATO_PROPOSTA_TABLE"]
 
-        # Recria as listas, excluindo os registros relacionados
-        db_data[propostas_table] = [
-            p for p in propostas if p.get("NProposta") != n_proposta
-        ]
-        db_data[uc_table] = [
-            uc for uc in db_data.get(uc_table, []) if uc.get("IdProposta") != n_proposta
-        ]
-        db_data[obs_table] = [
-            o for o in db_data.get(obs_table, []) if o.get("IdProposta") != n_proposta
-        ]
-        db_data[contato_table] = [
-            c
-            for c in db_data.get(contato_table, [])
-            if c.get("IdProposta") != n_proposta
-        ]
-
-        write_data(db_data)
+        # Exclui a proposta pela chave e os registros relacionados
+        with transaction() as tx:
+            if not tx.delete(propostas_table, n_proposta):
+                return jsonify({"erro": "Proposta não encontrada"}), 404
+            tx.delete_where(uc_table, IdProposta=n_proposta)
+            tx.delete_where(obs_table, IdProposta=n_proposta)
+            tx.delete_where(contato_table, IdProposta=n_proposta)
+
         return jsonify(
             {"sucesso": "Proposta e registros relacionados foram excluídos!"}
         )
@@ -1,28 +1,142 @@
 # backend/app/routes/simulacao.py (VERSÃO REFATORADA PARA JSON)
 
-from flask import Blueprint, jsonify, request, current_app
-from ..database import read_data  # <-- IMPORTA A NOVA FUNÇÃO!
-from ..services.simulation_service import realizar_calculo_simulacao
+import json
+
+import numpy as np
+from flask import Blueprint, Response, jsonify, request, current_app
+from ..database import find_rows, table_version, transaction
+from ..services.aggregate_service import custos_perfil, gravar_agregados
+from ..services.simulation_service import (
+    cache_simulacoes,
+    calcular_cenarios,
+    fator_ipca,
+    horizonte,
+    perfil_mensal,
+    realizar_calculo_simulacao,
+    simular_lote,
+    simular_risco,
+)
+from ..utils import to_float, to_int
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 bp = Blueprint("simulacao", __name__, url_prefix="/api")
 
+# Tabelas de parâmetros cujas versões fazem parte da chave do cache.
+TABELAS_PARAMETROS = (
+    "PARAM_CLIENTES_TABLE",
+    "PARAM_SIMULACAO_TABLE",
+    "PARAM_PRECOS_ANO_TABLE",
+    "PARAM_CUSTOS_MES_TABLE",
+    "AJUSTE_IPCA_TABLE",
+    "AJUSTE_TARIFA_TABLE",
+    "DADOS_GERACAO_TABLE",
+    "CURVA_GERACAO_TABLE",
+)
+
+
+def _periodo(data):
+    """
+    Lê data_inicio e data_fim (dd/mm/yyyy) da requisição.
+    Retorna (data_inicio_obj, duracao_meses); levanta TypeError/ValueError se inválidas.
+    """
+    data_inicio_obj = datetime.strptime(data.get("data_inicio"), "%d/%m/%Y")
+    data_fim_obj = datetime.strptime(data.get("data_fim"), "%d/%m/%Y")
+    delta = relativedelta(data_fim_obj, data_inicio_obj)
+    return data_inicio_obj, delta.years * 12 + delta.months + 1
+
+
+def _linha_ndjson(objeto):
+    return json.dumps(objeto, ensure_ascii=False) + "\n"
+
+
+def _chave_cache(uc_id, data_inicio_obj, duracao_meses):
+    """
+    Chave do cache de simulações de uma UC: o período e as versões do
+    histórico e da unidade dessa UC e das tabelas de parâmetros. As versões
+    são lidas antes dos dados, então uma escrita no meio só gera uma falta.
+    """
+    config = current_app.config
+    return (
+        uc_id,
+        data_inicio_obj.date(),
+        duracao_meses,
+        config["STORAGE_ENGINE"],
+        table_version(config["HISTORICO_TABLE"], NumeroDaUcLead=uc_id),
+        table_version(config["UNIDADES_TABLE"], NumeroDaUcLead=uc_id),
+        tuple(table_version(config[nome]) for nome in TABELAS_PARAMETROS),
+    )
+
+
+def _faixa(valor):
+    """
+    Valores de um eixo da grade de cenários: uma lista, um número ou
+    {"inicio", "fim", "passos"}. Levanta KeyError/TypeError/ValueError, inclusive
+    se o eixo passar de SIMULACAO_CENARIOS_MAX valores (antes de montá-lo).
+    """
+    maximo = current_app.config["SIMULACAO_CENARIOS_MAX"]
+    if isinstance(valor, dict):
+        passos = int(valor.get("passos", 10))
+        if not 1 <= passos <= maximo:
+            raise ValueError("número de passos inválido")
+        faixa = np.linspace(float(valor["inicio"]), float(valor["fim"]), passos)
+    elif isinstance(valor, (list, tuple)):
+        if len(valor) > maximo:
+            raise ValueError("faixa grande demais")
+        faixa = np.array([float(v) for v in valor])
+    else:
+        faixa = np.array([float(valor)])
+    if not len(faixa):
+        raise ValueError("faixa vazia")
+    return faixa
+
+
+def _precos_mwh():
+    """{Fonte: {Ano: PrecoRS_MWh}} da tabela de preços por ano."""
+    precos = {}
+    for linha in find_rows(current_app.config["PARAM_PRECOS_ANO_TABLE"]):
+        preco = to_float(linha.get("PrecoRS_MWh"))
+        if preco is not None and linha.get("Ano") is not None:
+            precos.setdefault(linha.get("Fonte"), {})[int(linha["Ano"])] = preco
+    return precos
+
+
+def _preco_do_ano(precos_fonte, ano):
+    """Preço de `ano`, ou do ano cadastrado mais próximo (anterior, se houver)."""
+    anteriores = [a for a in precos_fonte if a <= ano]
+    ano_ref = max(anteriores) if anteriores else min(precos_fonte)
+    return precos_fonte[ano_ref]
+
+
+def _ipca_por_ano(anos):
+    """PctIPCA de cada ano do período (0 para anos sem ajuste cadastrado)."""
+    ipca = {
+        int(linha["Ano"]): to_float(linha.get("PctIPCA")) or 0.0
+        for linha in find_rows(current_app.config["AJUSTE_IPCA_TABLE"])
+        if linha.get("Ano") is not None
+    }
+    return np.array([ipca.get(ano, 0.0) for ano in range(anos[0], anos[-1] + 1)])
+
+
+def _dados_cliente(unidade_info, historico, data_inicio_obj, duracao_meses):
+    """Monta a entrada de realizar_calculo_simulacao para uma unidade."""
+    return {
+        "tipo": "cliente",
+        "data_inicio_obj": data_inicio_obj,
+        "duracao_meses": duracao_meses,
+        "aliquota_icms": unidade_info.get("AliquotaICMS"),
+        "historico": historico,
+    }
+
 
 @bp.route("/simulacao/calcular", methods=["POST"])
 def calcular_simulacao_acr():
     data = request.json
     try:
-        data_inicio_obj = datetime.strptime(data.get("data_inicio"), "%d/%m/%Y")
-        data_fim_obj = datetime.strptime(data.get("data_fim"), "%d/%m/%Y")
-        delta = relativedelta(data_fim_obj, data_inicio_obj)
-        duracao_meses = delta.years * 12 + delta.months + 1
+        data_inicio_obj, duracao_meses = _periodo(data)
     except (TypeError, ValueError):
         return jsonify({"erro": "Formato de data inválido. Use dd/mm/yyyy."}), 400
 
-    # Lê todos os dados do nosso "banco" JSON
-    db_data = read_data()
-
     try:
         dados_para_calculo = {
             "tipo": data.get("tipo", "cliente"),
@@ -35,17 +149,17 @@ def calcular_simulacao_acr():
             if not uc_id:
                 return jsonify({"erro": "ID da Unidade é obrigatório."}), 400
 
+            chave_cache = _chave_cache(uc_id, data_inicio_obj, duracao_meses)
+            resultados = cache_simulacoes.obter(chave_cache)
+            if resultados is not None:
+                return jsonify(resultados)
+
             unidades_table = current_app.config["UNIDADES_TABLE"]
             historico_table = current_app.config["HISTORICO_TABLE"]
 
-            # Simula 'SELECT * FROM Unidades WHERE NumeroDaUcLead = ?'
+            # 'SELECT * FROM Unidades WHERE NumeroDaUcLead = ?'
             unidade_info = next(
-                (
-                    unidade
-                    for unidade in db_data.get(unidades_table, [])
-                    if unidade.get("NumeroDaUcLead") == uc_id
-                ),
-                None,
+                iter(find_rows(unidades_table, NumeroDaUcLead=uc_id)), None
             )
 
             if not unidade_info:
@@ -53,12 +167,8 @@ def calcular_simulacao_acr():
 
             dados_para_calculo["aliquota_icms"] = unidade_info.get("AliquotaICMS")
 
-            # Simula 'SELECT * FROM Historico WHERE NumeroDaUcLead = ?'
-            historico = [
-                h
-                for h in db_data.get(historico_table, [])
-                if h.get("NumeroDaUcLead") == uc_id
-            ]
+            # 'SELECT * FROM Historico WHERE NumeroDaUcLead = ?'
+            historico = find_rows(historico_table, NumeroDaUcLead=uc_id)
 
             if not historico:
                 return (
@@ -68,6 +178,7 @@ def calcular_simulacao_acr():
 
             dados_para_calculo["historico"] = historico
         else:  # tipo 'lead'
+            chave_cache = None
             dados_para_calculo["consumo_estimado"] = data.get("consumo_estimado")
             dados_para_calculo["demanda_estimada"] = data.get("demanda_estimada")
             dados_para_calculo["aliquota_icms"] = 17.0  # Valor padrão para leads
@@ -77,6 +188,8 @@ def calcular_simulacao_acr():
 
         if resultados is None:
             return jsonify({"erro": "Não foi possível calcular a simulação."}), 400
+        if chave_cache is not None:
+            cache_simulacoes.guardar(chave_cache, resultados)
 
         return jsonify(resultados)
 
@@ -88,14 +201,15 @@ def calcular_simulacao_acr():
 def get_dashboard_data():
     data_req = request.json
     try:
-        data_inicio_obj = datetime.strptime(data_req.get("data_inicio"), "%d/%m/%Y")
-        data_fim_obj = datetime.strptime(data_req.get("data_fim"), "%d/%m/%Y")
-        delta = relativedelta(data_fim_obj, data_inicio_obj)
-        duracao_meses = delta.years * 12 + delta.months + 1
+        data_inicio_obj, duracao_meses = _periodo(data_req)
     except (TypeError, ValueError):
         return jsonify({"erro": "Formato de data inválido."}), 400
-
-    db_data = read_data()
+    # Validado antes de tudo: a rota pode gravar os agregados que faltarem.
+    if duracao_meses <= 0:
+        return (
+            jsonify({"erro": "Não foi possível calcular os dados para o dashboard."}),
+            400,
+        )
 
     try:
         uc_id = data_req.get("uc_id")
@@ -103,50 +217,36 @@ def get_dashboard_data():
         unidades_table = current_app.config["UNIDADES_TABLE"]
         historico_table = current_app.config["HISTORICO_TABLE"]
 
-        # Simula 'SELECT * FROM Unidades WHERE NumeroDaUcLead = ?'
+        # 'SELECT * FROM Unidades WHERE NumeroDaUcLead = ?'
         unidade_info = next(
-            (
-                unidade
-                for unidade in db_data.get(unidades_table, [])
-                if unidade.get("NumeroDaUcLead") == uc_id
-            ),
-            None,
+            iter(find_rows(unidades_table, NumeroDaUcLead=uc_id)), None
         )
 
         if not unidade_info:
             return jsonify({"erro": "Unidade não encontrada."}), 404
 
-        # Simula 'SELECT * FROM Historico WHERE NumeroDaUcLead = ?'
-        historico = [
-            h
-            for h in db_data.get(historico_table, [])
-            if h.get("NumeroDaUcLead") == uc_id
-        ]
-
-        if not historico:
-            return jsonify({"erro": "Nenhum histórico encontrado."}), 404
+        # Custo cativo de cada mês do calendário, já materializado por UC: o
+        # tempo de resposta não depende do tamanho do histórico.
+        perfil = custos_perfil(uc_id)
+        if perfil is None:
+            # UC sem agregados (dados anteriores a eles): calcula a partir do
+            # histórico e grava, para as próximas consultas.
+            historico = find_rows(historico_table, NumeroDaUcLead=uc_id)
 
-        dados_cativo = {
-            "tipo": "cliente",
-            "data_inicio_obj": data_inicio_obj,
-            "duracao_meses": duracao_meses,
-            "aliquota_icms": unidade_info.get("AliquotaICMS"),
-            "historico": historico,
-        }
+            if not historico:
+                return jsonify({"erro": "Nenhum histórico encontrado."}), 404
 
-        cativo_results = realizar_calculo_simulacao(dados_cativo)
+            with transaction() as tx:
+                gravar_agregados(tx, uc_id, historico, unidade_info)
+            perfil = custos_perfil(uc_id)
 
-        if cativo_results is None:
-            return (
-                jsonify(
-                    {"erro": "Não foi possível calcular os dados para o dashboard."}
-                ),
-                400,
-            )
+        anos, meses = horizonte(data_inicio_obj, duracao_meses)
+        custos_mensais = perfil[meses - 1]
+        rotulos = [f"{m:02d}/{a}" for m, a in zip(meses.tolist(), anos.tolist())]
 
         # A lógica de cálculo do dashboard permanece a mesma
         desconto_livre = 0.85
-        custo_total_cativo = cativo_results["totais"]["custo_total_periodo"]
+        custo_total_cativo = float(custos_mensais.sum())
         custo_total_livre = custo_total_cativo * desconto_livre
 
         dashboard_data = {
@@ -156,16 +256,356 @@ def get_dashboard_data():
             "economia_percentual": (1 - desconto_livre) * 100,
             "detalhes_mensais": [
                 {
-                    "mes": mes["mes"],
-                    "custoAtual": mes["custo_total_mes"],
-                    "custoSimulado": mes["custo_total_mes"] * desconto_livre,
-                    "economia": mes["custo_total_mes"]
-                    - (mes["custo_total_mes"] * desconto_livre),
+                    "mes": rotulo,
+                    "custoAtual": custo_mes,
+                    "custoSimulado": custo_mes * desconto_livre,
+                    "economia": custo_mes - (custo_mes * desconto_livre),
                 }
-                for mes in cativo_results["detalhes_mensais"]
+                for rotulo, custo_mes in zip(
+                    rotulos, np.round(custos_mensais, 2).tolist()
+                )
             ],
         }
         return jsonify(dashboard_data)
 
     except Exception as e:
         return jsonify({"erro": f"Ocorreu um erro interno no dashboard: {e}"}), 500
+
+
+@bp.route("/simulacao/lote", methods=["POST"])
+def calcular_simulacao_lote():
+    """
+    Simula várias UCs de uma vez: recebe `uc_ids` (lista) ou `Cpf_CnpjLead`
+    (todas as UCs do lead) e o período. Responde em NDJSON, uma linha por UC
+    assim que ela fica pronta e, por fim, uma linha com o total da carteira.
+    """
+    data = request.json or {}
+    try:
+        data_inicio_obj, duracao_meses = _periodo(data)
+    except (TypeError, ValueError):
+        return jsonify({"erro": "Formato de data inválido. Use dd/mm/yyyy."}), 400
+
+    unidades_table = current_app.config["UNIDADES_TABLE"]
+    historico_table = current_app.config["HISTORICO_TABLE"]
+
+    # Os dados de todas as UCs são carregados aqui, uma única vez, pelos índices.
+    if data.get("uc_ids"):
+        uc_ids = [str(uc_id) for uc_id in data["uc_ids"]]
+        unidades = {}
+        for uc_id in uc_ids:
+            unidade_info = next(
+                iter(find_rows(unidades_table, NumeroDaUcLead=uc_id)), None
+            )
+            if unidade_info:
+                unidades[uc_id] = unidade_info
+    elif data.get("Cpf_CnpjLead"):
+        unidades = {
+            u["NumeroDaUcLead"]: u
+            for u in find_rows(unidades_table, Cpf_CnpjLead=data["Cpf_CnpjLead"])
+        }
+        uc_ids = list(unidades)
+    else:
+        return jsonify({"erro": "Informe a lista uc_ids ou o Cpf_CnpjLead."}), 400
+
+    tarefas, erros, prontas, chaves_cache = [], [], [], {}
+    for uc_id in uc_ids:
+        if uc_id not in unidades:
+            erros.append({"uc_id": uc_id, "erro": "Unidade não encontrada."})
+            continue
+        chaves_cache[uc_id] = _chave_cache(uc_id, data_inicio_obj, duracao_meses)
+        resultado = cache_simulacoes.obter(chaves_cache[uc_id])
+        if resultado is not None:
+            # Já calculada com os mesmos dados: não vai para o pool.
+            prontas.append((uc_id, resultado, None))
+            continue
+        historico = find_rows(historico_table, NumeroDaUcLead=uc_id)
+        if not historico:
+            erros.append(
+                {"uc_id": uc_id, "erro": "Nenhum histórico de consumo para esta unidade."}
+            )
+            continue
+        tarefas.append(
+            (
+                uc_id,
+                _dados_cliente(
+                    unidades[uc_id], historico, data_inicio_obj, duracao_meses
+                ),
+            )
+        )
+
+    processos = current_app.config["SIMULACAO_PROCESSOS"]
+    min_paralelo = current_app.config["SIMULACAO_LOTE_MIN_PARALELO"]
+
+    def calcular():
+        yield from prontas
+        for uc_id, resultado, erro in simular_lote(tarefas, processos, min_paralelo):
+            if resultado is not None:
+                cache_simulacoes.guardar(chaves_cache[uc_id], resultado)
+            yield uc_id, resultado, erro
+
+    def gerar():
+        for erro in erros:
+            yield _linha_ndjson(erro)
+
+        custo_total = consumo_total = 0.0
+        custo_mensal = np.zeros(max(duracao_meses, 0))
+        meses = []
+        calculadas = 0
+        try:
+            for uc_id, resultado, erro in calcular():
+                if resultado is None:
+                    erro = erro or "Não foi possível calcular a simulação."
+                    yield _linha_ndjson({"uc_id": uc_id, "erro": erro})
+                    continue
+                calculadas += 1
+                custo_total += resultado["totais"]["custo_total_periodo"]
+                consumo_total += resultado["totais"]["consumo_total_periodo"]
+                detalhes = resultado["detalhes_mensais"]
+                custo_mensal += [mes["custo_total_mes"] for mes in detalhes]
+                meses = meses or [mes["mes"] for mes in detalhes]
+                yield _linha_ndjson({"uc_id": uc_id, "resultado": resultado})
+        except Exception as e:
+            yield _linha_ndjson({"erro": f"Ocorreu um erro interno no lote: {e}"})
+            return
+
+        yield _linha_ndjson(
+            {
+                "total_portfolio": {
+                    "ucs_calculadas": calculadas,
+                    "ucs_com_erro": len(uc_ids) - calculadas,
+                    "custo_total_periodo": custo_total,
+                    "consumo_total_periodo": consumo_total,
+                    "detalhes_mensais": [
+                        {"mes": mes, "custo_total_mes": custo}
+                        for mes, custo in zip(meses, np.round(custo_mensal, 2).tolist())
+                    ],
+                }
+            }
+        )
+
+    return Response(gerar(), mimetype="application/x-ndjson")
+
+
+@bp.route("/simulacao/cenarios", methods=["POST"])
+def simular_cenarios():
+    """
+    Grade de cenários de mercado livre para uma UC. Cada eixo aceita uma lista,
+    um número ou {"inicio", "fim", "passos"}:
+    - `descontos`: desconto na demanda (fração, padrão 0);
+    - `precos`: {Fonte: faixa de R$/MWh}; sem faixa, vale o PrecoMWhAno da
+      Fonte no primeiro ano (sem `precos`, todas as Fontes cadastradas);
+    - `ipca`: IPCA anual (%) no lugar da tabela AjusteIPCA.
+    Retorna, por Fonte, a economia total no formato [ipca][desconto][preco].
+    """
+    data = request.json or {}
+    try:
+        data_inicio_obj, duracao_meses = _periodo(data)
+    except (TypeError, ValueError):
+        return jsonify({"erro": "Formato de data inválido. Use dd/mm/yyyy."}), 400
+    if not 0 < duracao_meses <= current_app.config["SIMULACAO_MAX_MESES"]:
+        return jsonify({"erro": "Não foi possível calcular a simulação."}), 400
+
+    uc_id = data.get("uc_id")
+    if not uc_id:
+        return jsonify({"erro": "ID da Unidade é obrigatório."}), 400
+
+    unidades_table = current_app.config["UNIDADES_TABLE"]
+    historico_table = current_app.config["HISTORICO_TABLE"]
+
+    unidade_info = next(iter(find_rows(unidades_table, NumeroDaUcLead=uc_id)), None)
+    if not unidade_info:
+        return jsonify({"erro": "Unidade não encontrada."}), 404
+    historico = find_rows(historico_table, NumeroDaUcLead=uc_id)
+    if not historico:
+        return jsonify({"erro": "Nenhum histórico de consumo para esta unidade."}), 404
+
+    anos, meses = horizonte(data_inicio_obj, duracao_meses)
+    precos_cadastrados = _precos_mwh()
+    try:
+        descontos = _faixa(data.get("descontos", 0.0))
+        if np.any((descontos < 0) | (descontos > 1)):
+            raise ValueError("desconto fora de 0..1")
+
+        faixa_ipca = None if data.get("ipca") is None else _faixa(data["ipca"])
+
+        pedidos = data.get("precos") or dict.fromkeys(precos_cadastrados)
+        if not isinstance(pedidos, dict):
+            raise TypeError("precos deve ser {Fonte: faixa}")
+        precos = {}
+        for fonte, faixa in pedidos.items():
+            if faixa is not None:
+                precos[fonte] = _faixa(faixa)
+            elif fonte in precos_cadastrados:
+                precos[fonte] = np.array(
+                    [_preco_do_ano(precos_cadastrados[fonte], int(anos[0]))]
+                )
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"erro": "Faixa de parâmetros inválida."}), 400
+
+    if not precos:
+        return jsonify({"erro": "Nenhum preço de MWh informado ou cadastrado."}), 400
+    # Os limites são conferidos pelos tamanhos dos eixos, antes de montar as
+    # matrizes do cálculo (cenários de IPCA x meses e a grade de economia).
+    n_ipca = 1 if faixa_ipca is None else len(faixa_ipca)
+    total_cenarios = n_ipca * len(descontos) * sum(map(len, precos.values()))
+    if (
+        total_cenarios > current_app.config["SIMULACAO_CENARIOS_MAX"]
+        or total_cenarios * duracao_meses
+        > current_app.config["SIMULACAO_CENARIOS_MAX_VALORES"]
+    ):
+        return jsonify({"erro": "Número de cenários acima do limite."}), 400
+
+    if faixa_ipca is None:
+        ipcas = ["tabela"]
+        ipca_anual = _ipca_por_ano(anos)[None, :]
+    else:
+        ipcas = faixa_ipca.tolist()
+        ipca_anual = np.repeat(faixa_ipca[:, None], anos[-1] - anos[0] + 1, axis=1)
+
+    try:
+        # A série projetada e os fatores de IPCA são montados uma vez e servem
+        # para todas as Fontes.
+        valores = perfil_mensal(historico)[meses - 1]
+        fatores = fator_ipca(anos, ipca_anual)
+        aliquota_icms = to_float(unidade_info.get("AliquotaICMS")) or 0.0
+
+        fontes = {}
+        for fonte, faixa_precos in precos.items():
+            custo_cativo, economia = calcular_cenarios(
+                valores, aliquota_icms, fatores, descontos, faixa_precos
+            )
+            fontes[fonte] = {
+                "precos": faixa_precos.tolist(),
+                "economia": np.round(economia, 2).tolist(),
+            }
+    except ValueError as e:
+        return jsonify({"erro": f"Não foi possível calcular os cenários: {e}"}), 400
+
+    return jsonify(
+        {
+            "uc_id": uc_id,
+            "custo_cativo": custo_cativo,
+            "descontos": descontos.tolist(),
+            "ipca": ipcas,
+            "fontes": fontes,
+        }
+    )
+
+
+@bp.route("/simulacao/risco", methods=["POST"])
+def simular_risco_preco():
+    """
+    Distribuição da economia no mercado livre para uma UC (Monte Carlo).
+    Recebe `fonte` (preço base do PrecoMWhAno no primeiro ano) ou `preco`,
+    e opcionalmente `desconto`, `caminhos`, `volatilidade_preco` (fração ao
+    ano), `volatilidade_ipca` (pontos percentuais) e `semente`. Retorna os
+    percentis P5/P50/P95 da economia total e de cada mês.
+    """
+    data = request.json or {}
+    try:
+        data_inicio_obj, duracao_meses = _periodo(data)
+    except (TypeError, ValueError):
+        return jsonify({"erro": "Formato de data inválido. Use dd/mm/yyyy."}), 400
+    if duracao_meses <= 0:
+        return jsonify({"erro": "Não foi possível calcular a simulação."}), 400
+
+    uc_id = data.get("uc_id")
+    if not uc_id:
+        return jsonify({"erro": "ID da Unidade é obrigatório."}), 400
+
+    unidades_table = current_app.config["UNIDADES_TABLE"]
+    historico_table = current_app.config["HISTORICO_TABLE"]
+
+    unidade_info = next(iter(find_rows(unidades_table, NumeroDaUcLead=uc_id)), None)
+    if not unidade_info:
+        return jsonify({"erro": "Unidade não encontrada."}), 404
+    historico = find_rows(historico_table, NumeroDaUcLead=uc_id)
+    if not historico:
+        return jsonify({"erro": "Nenhum histórico de consumo para esta unidade."}), 404
+
+    anos, meses = horizonte(data_inicio_obj, duracao_meses)
+    fonte = data.get("fonte")
+    preco_base = to_float(data.get("preco"))
+    if preco_base is None:
+        precos_fonte = _precos_mwh().get(fonte)
+        if not precos_fonte:
+            return (
+                jsonify({"erro": "Informe o preço ou uma Fonte com preço cadastrado."}),
+                400,
+            )
+        preco_base = _preco_do_ano(precos_fonte, int(anos[0]))
+
+    config = current_app.config
+    parametros = {
+        "desconto": to_float(data.get("desconto")),
+        "caminhos": to_int(data.get("caminhos")),
+        "volatilidade_preco": to_float(data.get("volatilidade_preco")),
+        "volatilidade_ipca": to_float(data.get("volatilidade_ipca")),
+    }
+    parametros = {nome: v for nome, v in parametros.items() if v is not None}
+    parametros.setdefault("caminhos", config["SIMULACAO_RISCO_CAMINHOS"])
+    # to_int truncaria 1.5 para 1 (e aceitaria true): o número de caminhos,
+    # se informado, precisa ser um inteiro.
+    caminhos = data.get("caminhos")
+    caminhos_inteiro = caminhos in (None, "") or (
+        not isinstance(caminhos, bool)
+        and to_int(caminhos) is not None
+        and to_float(caminhos) == to_int(caminhos)
+    )
+    semente = data.get("semente", config["SIMULACAO_RISCO_SEMENTE"])
+    if (
+        not caminhos_inteiro
+        or not 1 <= parametros["caminhos"] <= config["SIMULACAO_RISCO_MAX_CAMINHOS"]
+        or duracao_meses > config["SIMULACAO_MAX_MESES"]
+        or parametros["caminhos"] * duracao_meses > config["SIMULACAO_RISCO_MAX_VALORES"]
+        or not 0 <= parametros.get("desconto", 0.0) <= 1
+        or min(parametros.values()) < 0
+        or isinstance(semente, bool)
+        or not isinstance(semente, int)
+    ):
+        return jsonify({"erro": "Parâmetros da simulação de risco inválidos."}), 400
+
+    try:
+        custo_cativo, economia_total, economia_mensal = simular_risco(
+            perfil_mensal(historico)[meses - 1],
+            to_float(unidade_info.get("AliquotaICMS")) or 0.0,
+            anos,
+            preco_base,
+            _ipca_por_ano(anos),
+            semente=semente,
+            **parametros,
+        )
+    except ValueError as e:
+        return jsonify({"erro": f"Não foi possível calcular o risco: {e}"}), 400
+
+    percentis_total = np.percentile(economia_total, [5, 50, 95])
+    percentis_mensais = np.round(
+        np.percentile(economia_mensal, [5, 50, 95], axis=0), 2
+    ).tolist()
+    rotulos = [f"{m:02d}/{a}" for m, a in zip(meses.tolist(), anos.tolist())]
+
+    return jsonify(
+        {
+            "uc_id": uc_id,
+            "fonte": fonte,
+            "preco_base": preco_base,
+            "caminhos": len(economia_total),
+            "semente": semente,
+            "custo_cativo": custo_cativo,
+            "totais": {
+                "P5": float(percentis_total[0]),
+                "P50": float(percentis_total[1]),
+                "P95": float(percentis_total[2]),
+                "probabilidade_prejuizo": float(np.mean(economia_total < 0)),
+            },
+            "detalhes_mensais": [
+                {
+                    "mes": rotulo,
+                    "P5": percentis_mensais[0][i],
+                    "P50": percentis_mensais[1][i],
+                    "P95": percentis_mensais[2][i],
+                }
+                for i, rotulo in enumerate(rotulos)
+            ],
+        }
+    )
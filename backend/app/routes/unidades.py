@@ -1,33 +1,81 @@
 # backend/app/routes/unidades.py (VERSÃO REFATORADA PARA JSON)
 
 from flask import Blueprint, jsonify, request, current_app
-from ..database import read_data, write_data
-from ..services.validation_service import validar_regras_tarifacao
+from ..database import (
+    ConflictError,
+    IntegrityError,
+    find_rows,
+    get_row,
+    iter_page,
+    transaction,
+)
+from ..services.aggregate_service import gravar_agregados
+from ..services.import_service import nova_unidade
+from ..services.locality_service import indice_localidades
+from ..services.simulation_service import cache_simulacoes
+from ..services.validation_service import revalidar_historico, validar_historico
+from ..utils import stream_mode, stream_rows
 from datetime import datetime
+import random
+import time
 
 bp = Blueprint("unidades", __name__, url_prefix="/api")
 
+# Vezes que uma gravação é refeita se o histórico lido mudar antes do commit
+_TENTATIVAS_CONFLITO = 8
+
+
+def _com_tentativas(gravar):
+    """
+    Executa gravar() de novo enquanto a transação levantar ConflictError, com
+    uma espera aleatória crescente para as gravações concorrentes se afastarem.
+    """
+    for tentativa in range(_TENTATIVAS_CONFLITO):
+        try:
+            return gravar()
+        except ConflictError:
+            if tentativa == _TENTATIVAS_CONFLITO - 1:
+                raise
+            time.sleep(random.uniform(0, 0.01 * 2**tentativa))
+
+
+def _resposta_conflito():
+    return (
+        jsonify(
+            {
+                "erro": "O histórico da unidade foi alterado por outra requisição. "
+                "Tente novamente."
+            }
+        ),
+        409,
+    )
 
-# Funções de utilidade (podem ser movidas para utils.py se preferir)
-def to_float(value):
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return None
+
+def _resposta_violacoes(violacoes):
+    """400 com a primeira violação na mensagem e a lista completa em 'violacoes'."""
+    return (
+        jsonify(
+            {
+                "erro": f"Regra de negócio violada: {violacoes[0]['erro']}",
+                "violacoes": violacoes,
+            }
+        ),
+        400,
+    )
 
 
 @bp.route("/leads/<path:lead_id>/unidades", methods=["GET", "POST"])
 def handle_unidades_by_lead(lead_id):
-    db_data = read_data()
     unidades_table = current_app.config["UNIDADES_TABLE"]
 
     if request.method == "GET":
-        # Filtra a lista de unidades para retornar apenas as do lead_id especificado
-        unidades_do_lead = [
-            unidade
-            for unidade in db_data.get(unidades_table, [])
-            if unidade.get("Cpf_CnpjLead") == lead_id
-        ]
+        # Busca apenas as unidades do lead_id especificado
+        unidades_do_lead = find_rows(unidades_table, Cpf_CnpjLead=lead_id)
+        # Com ?cidade_nome=1, acrescenta CidadeNome/Uf a partir do código em Cidade
+        if request.args.get("cidade_nome") == "1":
+            localidades = indice_localidades()
+            for unidade in unidades_do_lead:
+                localidades.resolver_cidade(unidade)
         return jsonify(unidades_do_lead)
 
     if request.method == "POST":
@@ -35,17 +83,15 @@ def handle_unidades_by_lead(lead_id):
         if not data.get("NumeroDaUcLead"):
             return jsonify({"erro": "O Nº da UC é obrigatório"}), 400
 
-        try:
-            validar_regras_tarifacao(data, data)
-        except ValueError as e:
-            return jsonify({"erro": f"Regra de negócio violada: {e}"}), 400
+        violacoes = validar_historico(data, [data])
+        if violacoes:
+            return _resposta_violacoes(violacoes)
 
-        # Simula 'IntegrityError' verificando se a unidade já existe para este lead
-        if any(
-            u.get("NumeroDaUcLead") == data.get("NumeroDaUcLead")
-            and u.get("Cpf_CnpjLead") == lead_id
-            for u in db_data.get(unidades_table, [])
-        ):
+        # O insert recusa uma unidade com o mesmo número para este lead
+        try:
+            with transaction() as tx:
+                tx.insert(unidades_table, nova_unidade(lead_id, data))
+        except IntegrityError:
             return (
                 jsonify(
                     {"erro": "Já existe uma unidade com este número para este lead."}
@@ -53,42 +99,16 @@ def handle_unidades_by_lead(lead_id):
                 409,
             )
 
-        nova_unidade = (
-            data.copy()
-        )  # Cria uma cópia para não modificar o objeto da requisição
-        nova_unidade["Cpf_CnpjLead"] = lead_id
-        nova_unidade["DataRegistroUC"] = datetime.now().isoformat()
-
-        # Converte os tipos de dados conforme o código original
-        nova_unidade["Cidade"] = to_float(data.get("Cidade"))
-        nova_unidade["AliquotaICMS"] = to_float(data.get("AliquotaICMS"))
-        nova_unidade["BeneficioRuralIrrigacao"] = to_float(
-            data.get("BeneficioRuralIrrigacao")
-        )
-        nova_unidade["SaldoMaisRecenteSCEE"] = to_float(
-            data.get("SaldoMaisRecenteSCEE")
-        )
-        nova_unidade["PossuiUsina"] = bool(data.get("PossuiUsina"))
-
-        db_data.get(unidades_table, []).append(nova_unidade)
-        write_data(db_data)
-
         return jsonify({"sucesso": "Unidade criada com sucesso!"}), 201
 
 
 @bp.route("/unidade/<path:uc_id>", methods=["GET"])
 def get_unidade_by_id(uc_id):
-    db_data = read_data()
     unidades_table = current_app.config["UNIDADES_TABLE"]
 
     # Encontra a primeira unidade que corresponde ao uc_id
     unidade_encontrada = next(
-        (
-            unidade
-            for unidade in db_data.get(unidades_table, [])
-            if unidade.get("NumeroDaUcLead") == uc_id
-        ),
-        None,
+        iter(find_rows(unidades_table, NumeroDaUcLead=uc_id)), None
     )
 
     if not unidade_encontrada:
@@ -99,30 +119,89 @@ def get_unidade_by_id(uc_id):
 
 @bp.route("/unidades/<path:uc_id_original>", methods=["PUT", "DELETE"])
 def update_or_delete_unidade(uc_id_original):
-    db_data = read_data()
     unidades_table = current_app.config["UNIDADES_TABLE"]
-    unidades = db_data.get(unidades_table, [])
 
     if request.method == "PUT":
         data = request.json
+        violacoes = validar_historico(data, [data])
+        if violacoes:
+            return _resposta_violacoes(violacoes)
+
+        historico_table = current_app.config["HISTORICO_TABLE"]
+        agregados_table = current_app.config["AGREGADOS_UC_TABLE"]
+
+        # O histórico já gravado também precisa respeitar as novas regras da
+        # unidade. Por padrão a alteração é recusada; com ?forcar=1 ela é
+        # gravada e os meses afetados são devolvidos para correção.
+        meses_afetados = []
+        unidade_atual = get_row(
+            unidades_table, (data.get("Cpf_CnpjLead"), uc_id_original)
+        )
+        if unidade_atual:
+            violacoes = revalidar_historico(
+                unidade_atual,
+                {**unidade_atual, **data},
+                find_rows(historico_table, NumeroDaUcLead=uc_id_original),
+            )
+            meses_afetados = sorted({v["IDMes"] for v in violacoes}, key=str)
+            if violacoes and request.args.get("forcar") != "1":
+                return (
+                    jsonify(
+                        {
+                            "erro": "A alteração torna inválidos meses do histórico já gravado.",
+                            "meses_afetados": meses_afetados,
+                            "violacoes": violacoes,
+                        }
+                    ),
+                    409,
+                )
+
+        def gravar():
+            with transaction() as tx:
+                # Atualiza a unidade pela chave (lead, UC) com os novos dados
+                atualizada = tx.update(
+                    unidades_table, (data.get("Cpf_CnpjLead"), uc_id_original), data
+                )
+                if atualizada:
+                    # A alíquota da unidade entra no custo dos agregados
+                    uc_id = atualizada.get("NumeroDaUcLead")
+                    if uc_id != uc_id_original:
+                        tx.delete_where(agregados_table, NumeroDaUcLead=uc_id_original)
+                    gravar_agregados(
+                        tx,
+                        uc_id,
+                        tx.find(historico_table, NumeroDaUcLead=uc_id),
+                        atualizada,
+                    )
+            return atualizada
+
         try:
-            validar_regras_tarifacao(data, data)
+            unidade_atualizada = _com_tentativas(gravar)
+        except ConflictError:
+            return _resposta_conflito()
         except ValueError as e:
             return jsonify({"erro": f"Regra de negócio violada: {e}"}), 400
-
-        unidade_atualizada = False
-        for unidade in unidades:
-            if unidade.get("NumeroDaUcLead") == uc_id_original and unidade.get(
-                "Cpf_CnpjLead"
-            ) == data.get("Cpf_CnpjLead"):
-                unidade.update(data)  # Atualiza o dicionário com os novos dados
-                unidade_atualizada = True
-                break
+        except IntegrityError:
+            return (
+                jsonify(
+                    {"erro": "Já existe uma unidade com este número para este lead."}
+                ),
+                409,
+            )
 
         if not unidade_atualizada:
             return jsonify({"erro": "Nenhuma unidade encontrada para atualizar."}), 404
 
-        write_data(db_data)
+        # A alíquota da unidade entra na simulação (a UC pode ter sido renomeada)
+        cache_simulacoes.invalidar(uc_id_original)
+        cache_simulacoes.invalidar(unidade_atualizada.get("NumeroDaUcLead"))
+        if meses_afetados:
+            return jsonify(
+                {
+                    "sucesso": "Unidade atualizada com sucesso!",
+                    "meses_afetados": meses_afetados,
+                }
+            )
         return jsonify({"sucesso": "Unidade atualizada com sucesso!"})
 
     if request.method == "DELETE":
@@ -134,25 +213,18 @@ def update_or_delete_unidade(uc_id_original):
                 400,
             )
 
-        unidades_antes = len(unidades)
         historico_table = current_app.config["HISTORICO_TABLE"]
+        agregados_table = current_app.config["AGREGADOS_UC_TABLE"]
 
-        # Recria as listas, excluindo os registros a serem deletados
-        db_data[unidades_table] = [
-            u
-            for u in unidades
-            if not (
-                u.get("NumeroDaUcLead") == uc_id_original
-                and u.get("Cpf_CnpjLead") == lead_id
-            )
-        ]
-        db_data[historico_table] = [
-            h
-            for h in db_data.get(historico_table, [])
-            if h.get("NumeroDaUcLead") != uc_id_original
-        ]
-
-        if len(db_data[unidades_table]) == unidades_antes:
+        # Exclui a unidade e, em cascata, o seu histórico e os agregados
+        with transaction() as tx:
+            removidas = tx.delete(unidades_table, (lead_id, uc_id_original))
+            if removidas:
+                tx.delete_where(historico_table, NumeroDaUcLead=uc_id_original)
+                tx.delete_where(agregados_table, NumeroDaUcLead=uc_id_original)
+        cache_simulacoes.invalidar(uc_id_original)
+
+        if not removidas:
             return (
                 jsonify(
                     {
@@ -162,30 +234,34 @@ def update_or_delete_unidade(uc_id_original):
                 404,
             )
 
-        write_data(db_data)
         return jsonify({"sucesso": "Unidade e seu histórico foram excluídos."})
 
 
 @bp.route("/unidades/<path:uc_id>/historico", methods=["GET"])
 def get_all_historico(uc_id):
-    db_data = read_data()
     historico_table = current_app.config["HISTORICO_TABLE"]
 
-    historico_filtrado = [
-        h
-        for h in db_data.get(historico_table, [])
-        if str(h.get("NumeroDaUcLead")).strip() == uc_id
-    ]
-    historico_filtrado.sort(key=lambda x: x.get("IDMes", 0), reverse=True)
+    # Ordenado por IDMes (mais recente primeiro), com cada linha copiada só
+    # quando é usada.
+    linhas, _ = iter_page(
+        historico_table,
+        lambda x: x.get("IDMes", 0),
+        filtros={"NumeroDaUcLead": uc_id},
+    )
 
     # Formata o campo IDMes
-    for item in historico_filtrado:
+    def formatar(item):
         if item.get("IDMes"):
             id_mes_str = str(item["IDMes"])
             if len(id_mes_str) == 6:
                 item["IDMes"] = f"{id_mes_str[:4]}-{id_mes_str[4:]}"
+        return item
 
-    return jsonify(historico_filtrado)
+    historico_filtrado = (formatar(item) for item in linhas)
+    modo = stream_mode(request)
+    if modo:
+        return stream_rows(historico_filtrado, modo)
+    return jsonify(list(historico_filtrado))
 
 
 @bp.route("/unidades/<path:uc_id>/historico/batch", methods=["POST"])
@@ -196,42 +272,18 @@ def batch_update_historico(uc_id):
     if not ano or dados_meses is None:
         return jsonify({"erro": "Ano e dados do histórico são obrigatórios."}), 400
 
-    db_data = read_data()
     unidades_table = current_app.config["UNIDADES_TABLE"]
     historico_table = current_app.config["HISTORICO_TABLE"]
 
-    unidade_info = next(
-        (
-            u
-            for u in db_data.get(unidades_table, [])
-            if u.get("NumeroDaUcLead") == uc_id
-        ),
-        None,
-    )
+    unidade_info = next(iter(find_rows(unidades_table, NumeroDaUcLead=uc_id)), None)
     if not unidade_info:
         return jsonify({"erro": "Unidade não encontrada para validação."}), 404
 
-    try:
-        for mes_data in dados_meses:
-            validar_regras_tarifacao(unidade_info, mes_data)
-    except ValueError as e:
-        return jsonify({"erro": f"Regra de negócio violada: {e}"}), 400
-
-    # Simula a transação DELETE + INSERT
-    start_id, end_id = int(ano) * 100 + 1, int(ano) * 100 + 12
-    historico_atual = db_data.get(historico_table, [])
-
-    # Mantém apenas os registros que NÃO estão no intervalo a ser atualizado
-    historico_atualizado = [
-        h
-        for h in historico_atual
-        if not (
-            h.get("NumeroDaUcLead") == uc_id
-            and start_id <= int(str(h.get("IDMes")).replace("-", "")) <= end_id
-        )
-    ]
+    # Todos os meses são validados de uma vez, e todas as violações retornadas
+    violacoes = validar_historico(unidade_info, dados_meses)
+    if violacoes:
+        return _resposta_violacoes(violacoes)
 
-    # Adiciona os novos registros
     novos_registros = []
     for mes_data in dados_meses:
         novo_registro = mes_data.copy()
@@ -240,8 +292,33 @@ def batch_update_historico(uc_id):
         novo_registro["DataRegistroHistorico"] = datetime.now().isoformat()
         novos_registros.append(novo_registro)
 
-    historico_atualizado.extend(novos_registros)
-    db_data[historico_table] = historico_atualizado
+    start_id, end_id = int(ano) * 100 + 1, int(ano) * 100 + 12
+    meses_do_ano = range(start_id, end_id + 1)
+
+    # Transação DELETE + INSERT: remove os 12 meses do ano pela chave
+    # (UC, IDMes), grava os novos registros e atualiza os agregados do ano
+    def gravar():
+        with transaction() as tx:
+            for id_mes in meses_do_ano:
+                tx.delete(historico_table, (uc_id, id_mes))
+
+            for novo_registro in novos_registros:
+                tx.put(historico_table, novo_registro)
+
+            # Histórico da UC como a transação o deixa (inclusive o perfil,
+            # que depende de todos os anos); se outra gravação o mudar antes do
+            # commit, a transação é refeita.
+            historico_final = tx.find(historico_table, NumeroDaUcLead=uc_id)
+            gravar_agregados(
+                tx, uc_id, historico_final, unidade_info, anos=[int(ano)]
+            )
+
+    try:
+        _com_tentativas(gravar)
+    except ConflictError:
+        return _resposta_conflito()
+    except ValueError as e:
+        return jsonify({"erro": f"Regra de negócio violada: {e}"}), 400
+    cache_simulacoes.invalidar(uc_id)
 
-    write_data(db_data)
     return jsonify({"sucesso": f"Histórico para o ano {ano} salvo com sucesso!"})
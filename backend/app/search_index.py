@@ -0,0 +1,128 @@
+# backend/app/search_index.py
+import unicodedata
+from bisect import bisect_left
+
+
+def normalizar(texto):
+    """
+    Forma usada nas buscas: minúsculas, sem acentos e só com letras e dígitos.
+    Ex: "Açaí Ltda." -> "acailtda", "12.345.678/0001-90" -> "12345678000190".
+    """
+    decomposto = unicodedata.normalize("NFKD", str(texto).lower())
+    return "".join(c for c in decomposto if c.isalnum())
+
+
+def trigramas(texto):
+    """Conjunto de trigramas (pedaços de 3 caracteres) de um texto já normalizado."""
+    return {texto[i : i + 3] for i in range(len(texto) - 2)}
+
+
+def textos_da_linha(linha, campos):
+    return [str(linha.get(campo, "")) for campo in campos]
+
+
+def corresponde(consulta, textos):
+    """
+    Critério da busca: a consulta aparece em algum dos textos depois de
+    normalizados. Quem achava com o "in" antigo (minúsculas) continua achando,
+    já que a normalização só remove caracteres. Uma consulta sem letras nem
+    dígitos (ex: "-") usa a comparação antiga.
+    """
+    termo = normalizar(consulta)
+    if not termo:
+        consulta = consulta.lower()
+        return any(consulta in texto.lower() for texto in textos)
+    return any(termo in normalizar(texto) for texto in textos)
+
+
+class IndiceTrigramas:
+    """
+    Índice invertido trigrama -> chaves das linhas, sobre alguns campos de texto.
+    Uma busca por substring intersecta as listas dos trigramas da consulta
+    (começando pela menor) e só confere o texto dos candidatos, sem percorrer
+    a tabela. É atualizado linha a linha com adicionar/remover.
+    """
+
+    def __init__(self, campos):
+        self.campos = campos
+        self._postings = {}
+        # chave -> (trigramas, textos normalizados), para remover e conferir.
+        self._entradas = {}
+
+    def adicionar(self, chave, linha):
+        self.remover(chave)
+        textos = tuple(normalizar(t) for t in textos_da_linha(linha, self.campos))
+        grams = set()
+        for texto in textos:
+            grams |= trigramas(texto)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(chave)
+        self._entradas[chave] = (grams, textos)
+
+    def remover(self, chave):
+        entrada = self._entradas.pop(chave, None)
+        if entrada is None:
+            return
+        for gram in entrada[0]:
+            chaves = self._postings.get(gram)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._postings[gram]
+
+    def buscar(self, consulta):
+        """
+        Chaves das linhas que contêm a consulta (ver `corresponde`), ou None se
+        a consulta não tiver letras nem dígitos e precisar da comparação antiga.
+        """
+        termo = normalizar(consulta)
+        if not termo:
+            return None
+        if len(termo) < 3:
+            # Curta demais para trigramas: conferimos os textos já normalizados.
+            candidatas = self._entradas
+        else:
+            listas = sorted(
+                (self._postings.get(gram, ()) for gram in trigramas(termo)), key=len
+            )
+            candidatas = set(listas[0]).intersection(*listas[1:])
+        return [
+            chave
+            for chave in candidatas
+            if any(termo in texto for texto in self._entradas[chave][1])
+        ]
+
+
+class IndicePrefixo:
+    """
+    Textos ordenados para buscas por prefixo com bisect: O(log n + resultados).
+    Recebe pares (texto, chave) e é reconstruído quando os dados mudam.
+    """
+
+    def __init__(self, pares):
+        self._itens = sorted(pares, key=lambda par: par[0])
+        self._textos = [texto for texto, _ in self._itens]
+
+    def buscar(self, prefixo, limite=None):
+        """Chaves cujo texto começa com `prefixo` (as `limite` primeiras, na ordem dos textos)."""
+        chaves = []
+        for i in range(bisect_left(self._textos, prefixo), len(self._itens)):
+            texto, chave = self._itens[i]
+            if not texto.startswith(prefixo) or len(chaves) == limite:
+                break
+            chaves.append(chave)
+        return chaves
+
+
+class IndiceFacetas:
+    """Valor exato -> chaves, para cada campo de faceta (ex: StatusNegociacao)."""
+
+    def __init__(self, campos):
+        self._indices = {campo: {} for campo in campos}
+
+    def adicionar(self, chave, linha):
+        for campo, indice in self._indices.items():
+            indice.setdefault(linha.get(campo), set()).add(chave)
+
+    def buscar(self, campo, valor):
+        return self._indices[campo].get(valor, set())
@@ -0,0 +1,114 @@
+import numpy as np
+
+from ...config import Config
+from ..database import get_row
+from ..utils import to_float
+from .simulation_service import calcular_custos, carregar_colunas, perfil_mensal
+
+# Linhas da tabela de agregados, identificadas por (NumeroDaUcLead, Tipo, Periodo):
+# - "mes": um registro do histórico (Periodo = IDMes, AAAAMM);
+# - "ano": soma dos meses de um ano (Periodo = AAAA);
+# - "perfil": mês típico do calendário usado nas projeções (Periodo = 1..12).
+TIPO_MES, TIPO_ANO, TIPO_PERFIL = "mes", "ano", "perfil"
+
+
+def _aliquota(unidade_info):
+    return to_float(unidade_info.get("AliquotaICMS")) or 0.0
+
+
+def calcular_agregados(uc_id, historico, unidade_info, anos=None):
+    """
+    Linhas agregadas de uma UC a partir do seu histórico completo: meses e anos
+    (apenas os de `anos`, ou todos se None) e o perfil de 12 meses. O custo é o
+    custo cativo de calcular_custos com a alíquota de ICMS da unidade.
+    """
+    aliquota_icms = _aliquota(unidade_info)
+    linhas = []
+    if not historico:
+        return linhas
+
+    id_meses, valores = carregar_colunas(historico)
+    custos = calcular_custos(valores, aliquota_icms)
+
+    # Um registro por IDMes (vale o último, como nas buscas por chave).
+    por_mes = {}
+    for i, id_mes in enumerate(id_meses.tolist()):
+        if anos is None or id_mes // 100 in anos:
+            por_mes[id_mes] = i
+
+    por_ano = {}
+    for id_mes, i in sorted(por_mes.items()):
+        linha = {
+            "NumeroDaUcLead": uc_id,
+            "Tipo": TIPO_MES,
+            "Periodo": id_mes,
+            "ConsumoKwh": float(custos["consumo_total_kwh"][i]),
+            "DemandaKw": float(custos["demanda_total_kw"][i]),
+            "CustoTotal": float(custos["custo_total_mes"][i]),
+        }
+        linhas.append(linha)
+        por_ano.setdefault(id_mes // 100, []).append(linha)
+
+    for ano, meses in por_ano.items():
+        linhas.append(
+            {
+                "NumeroDaUcLead": uc_id,
+                "Tipo": TIPO_ANO,
+                "Periodo": ano,
+                "ConsumoKwh": sum(m["ConsumoKwh"] for m in meses),
+                "DemandaMediaKw": sum(m["DemandaKw"] for m in meses) / len(meses),
+                "CustoTotal": sum(m["CustoTotal"] for m in meses),
+                "Meses": len(meses),
+            }
+        )
+
+    perfil = calcular_custos(perfil_mensal(historico), aliquota_icms)
+    for mes in range(12):
+        linhas.append(
+            {
+                "NumeroDaUcLead": uc_id,
+                "Tipo": TIPO_PERFIL,
+                "Periodo": mes + 1,
+                "ConsumoKwh": float(perfil["consumo_total_kwh"][mes]),
+                "DemandaKw": float(perfil["demanda_total_kw"][mes]),
+                "CustoTotal": float(perfil["custo_total_mes"][mes]),
+            }
+        )
+    return linhas
+
+
+def gravar_agregados(tx, uc_id, historico, unidade_info, anos=None):
+    """
+    Atualiza, dentro da transação `tx`, os agregados da UC: apenas os meses e
+    anos de `anos` (ou todos, se None) e o perfil. `historico` é o histórico
+    completo da UC já com as alterações da transação.
+    """
+    tabela = Config.AGREGADOS_UC_TABLE
+    linhas = calcular_agregados(uc_id, historico, unidade_info, anos)
+
+    if anos is None:
+        tx.delete_where(tabela, NumeroDaUcLead=uc_id)
+    else:
+        for ano in anos:
+            tx.delete(tabela, (uc_id, TIPO_ANO, ano))
+            for id_mes in range(ano * 100 + 1, ano * 100 + 13):
+                tx.delete(tabela, (uc_id, TIPO_MES, id_mes))
+        for mes in range(1, 13):
+            tx.delete(tabela, (uc_id, TIPO_PERFIL, mes))
+
+    for linha in linhas:
+        tx.put(tabela, linha)
+
+
+def custos_perfil(uc_id):
+    """
+    Custo cativo de cada mês do calendário (array de 12) já materializado para
+    a UC, com 12 buscas por chave. Retorna None se a UC não tiver agregados.
+    """
+    custos = []
+    for mes in range(1, 13):
+        linha = get_row(Config.AGREGADOS_UC_TABLE, (uc_id, TIPO_PERFIL, mes))
+        if linha is None:
+            return None
+        custos.append(linha["CustoTotal"])
+    return np.array(custos)
@@ -0,0 +1,327 @@
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from ...config import Config
+from ..database import find_rows, get_row, transaction
+from ..utils import to_float
+from .aggregate_service import gravar_agregados
+from .simulation_service import CAMPOS_HISTORICO, cache_simulacoes
+from .validation_service import CAMPOS_REGRAS, validar_historico
+
+# Colunas numéricas do histórico; as demais são gravadas como texto.
+CAMPOS_NUMERICOS = tuple(dict.fromkeys(CAMPOS_REGRAS + CAMPOS_HISTORICO))
+
+
+def formato_do_arquivo(nome, formato=None):
+    """'csv' ou 'xlsx', pelo parâmetro informado ou pela extensão do arquivo."""
+    formato = (formato or os.path.splitext(nome or "")[1].lstrip(".")).lower()
+    if formato in ("xls", "xlsx"):
+        return "xlsx"
+    if formato in ("csv", "txt"):
+        return "csv"
+    raise ValueError("Formato de arquivo não suportado. Use CSV ou XLSX.")
+
+
+def ler_blocos(arquivo, formato, tamanho_bloco):
+    """
+    Gera blocos (DataFrames de texto) do arquivo. O CSV é lido aos poucos,
+    `tamanho_bloco` linhas por vez, e o separador (vírgula ou ponto e vírgula)
+    é detectado. O Excel não tem leitura incremental no pandas: a planilha é
+    lida de uma vez e entregue nos mesmos blocos.
+    """
+    opcoes = {"dtype": str, "keep_default_na": False}
+    if formato == "csv":
+        # utf-8-sig aceita o BOM que o Excel grava ao exportar CSV.
+        yield from pd.read_csv(
+            arquivo,
+            sep=None,
+            engine="python",
+            encoding="utf-8-sig",
+            chunksize=tamanho_bloco,
+            **opcoes,
+        )
+        return
+    planilha = pd.read_excel(arquivo, **opcoes)
+    for inicio in range(0, len(planilha), tamanho_bloco):
+        yield planilha.iloc[inicio : inicio + tamanho_bloco]
+
+
+def _id_mes(valor):
+    """IDMes (AAAAMM) a partir de 'AAAAMM', 'AAAA-MM', 'AAAA-MM-DD' ou 'MM/AAAA'."""
+    texto = str(valor).strip()
+    if "/" in texto:
+        mes, ano = texto.split("/")[-2:]
+        texto = f"{ano}{int(mes):02d}"
+    digitos = texto.replace("-", "")[:6]
+    id_mes = int(digitos)
+    if len(digitos) != 6 or not 1 <= id_mes % 100 <= 12:
+        raise ValueError
+    return id_mes
+
+
+def _converter_linha(linha):
+    """Registro do histórico a partir de uma linha do arquivo (textos)."""
+    registro = {}
+    for campo, valor in linha.items():
+        valor = str(valor).strip()
+        if not valor:
+            continue
+        if campo in CAMPOS_NUMERICOS:
+            numero = to_float(valor)
+            if numero is None:
+                raise ValueError(f"Valor inválido no campo '{campo}': {valor}")
+            registro[campo] = numero
+        else:
+            registro[campo] = valor
+
+    if not registro.get("NumeroDaUcLead"):
+        raise ValueError("O Nº da UC é obrigatório.")
+    try:
+        registro["IDMes"] = _id_mes(registro.get("IDMes", ""))
+    except (ValueError, IndexError):
+        raise ValueError(f"IDMes inválido: {registro.get('IDMes', '')}")
+    return registro
+
+
+def importar_historico(arquivo, formato, tamanho_bloco=None):
+    """
+    Importa um arquivo de histórico de consumo (uma linha por UC e mês).
+    As linhas são convertidas e validadas por blocos contra as regras da
+    unidade; as válidas entram por upsert na chave (NumeroDaUcLead, IDMes) e
+    tudo é gravado em uma única transação, junto com os agregados das UCs.
+    Retorna o relatório: linhas lidas, importadas e os erros por linha
+    (numeradas como no arquivo, com o cabeçalho na linha 1).
+    """
+    tamanho_bloco = tamanho_bloco or Config.IMPORTACAO_BLOCO_LINHAS
+    unidades_table = Config.UNIDADES_TABLE
+    historico_table = Config.HISTORICO_TABLE
+
+    unidades = {}  # NumeroDaUcLead -> unidade (ou None se não existir)
+    registros = {}  # (NumeroDaUcLead, IDMes) -> registro; a última linha vale
+    erros = []
+    linhas_lidas = 0
+
+    for bloco in ler_blocos(arquivo, formato, tamanho_bloco):
+        por_uc = {}
+        for posicao, linha in enumerate(bloco.to_dict("records")):
+            numero_linha = linhas_lidas + posicao + 2
+            try:
+                registro = _converter_linha(linha)
+            except ValueError as e:
+                erros.append({"linha": numero_linha, "erro": str(e)})
+                continue
+            por_uc.setdefault(registro["NumeroDaUcLead"], []).append(
+                (numero_linha, registro)
+            )
+        linhas_lidas += len(bloco)
+
+        # Cada UC do bloco é validada de uma vez contra o perfil da unidade.
+        for uc_id, linhas in por_uc.items():
+            if uc_id not in unidades:
+                unidades[uc_id] = next(
+                    iter(find_rows(unidades_table, NumeroDaUcLead=uc_id)), None
+                )
+            if unidades[uc_id] is None:
+                erros.extend(
+                    {"linha": n, "erro": f"Unidade {uc_id} não encontrada."}
+                    for n, _ in linhas
+                )
+                continue
+
+            violacoes = {}
+            for violacao in validar_historico(
+                unidades[uc_id], [registro for _, registro in linhas]
+            ):
+                violacoes.setdefault(violacao["linha"], []).append(violacao["erro"])
+            for posicao, (numero_linha, registro) in enumerate(linhas):
+                if posicao in violacoes:
+                    erros.append(
+                        {
+                            "linha": numero_linha,
+                            "erro": "Regra de negócio violada: "
+                            + " ".join(violacoes[posicao]),
+                        }
+                    )
+                    continue
+                registros[(uc_id, registro["IDMes"])] = registro
+
+    agora = datetime.now().isoformat()
+    ucs = {}
+    for (uc_id, id_mes), registro in registros.items():
+        registro["DataRegistroHistorico"] = agora
+        ucs.setdefault(uc_id, {})[id_mes] = registro
+
+    with transaction() as tx:
+        for uc_id, novos in ucs.items():
+            for registro in novos.values():
+                tx.put(historico_table, registro)
+
+            # Agregados dos anos importados, com o histórico já atualizado.
+            historico_final = {
+                h.get("IDMes"): h
+                for h in find_rows(historico_table, NumeroDaUcLead=uc_id)
+            }
+            historico_final.update(novos)
+            gravar_agregados(
+                tx,
+                uc_id,
+                list(historico_final.values()),
+                unidades[uc_id],
+                anos=sorted({id_mes // 100 for id_mes in novos}),
+            )
+
+    for uc_id in ucs:
+        cache_simulacoes.invalidar(uc_id)
+
+    erros.sort(key=lambda e: e["linha"])
+    return {
+        "linhas_lidas": linhas_lidas,
+        "importadas": len(registros),
+        "ucs": len(ucs),
+        "erros": erros,
+    }
+
+
+# --- Cadastro de leads ---
+# Montagem dos registros, compartilhada com as rotas de cadastro individual.
+
+
+def novo_vendedor(lead_id, dados):
+    return {
+        "Cpf_CnpjLead": lead_id,
+        "Vendedor": dados.get("Vendedor"),
+        "DataDeEnvioLead": dados.get("DataEnvio"),  # Armazena como string
+        "ValidadeLead": dados.get("DataValidade"),  # Armazena como string
+    }
+
+
+def novo_contato(lead_id, dados):
+    return {
+        "Cpf_CnpjLead": lead_id,
+        "NomeContato": dados.get("NomeContato"),
+        "e-mail": dados.get("Email"),
+        "Telefone": dados.get("Telefone"),
+    }
+
+
+def nova_unidade(lead_id, dados):
+    unidade = dados.copy()  # Cópia para não modificar o objeto recebido
+    unidade["Cpf_CnpjLead"] = lead_id
+    unidade["DataRegistroUC"] = datetime.now().isoformat()
+
+    # Converte os tipos de dados conforme o código original
+    unidade["Cidade"] = to_float(dados.get("Cidade"))
+    unidade["AliquotaICMS"] = to_float(dados.get("AliquotaICMS"))
+    unidade["BeneficioRuralIrrigacao"] = to_float(dados.get("BeneficioRuralIrrigacao"))
+    unidade["SaldoMaisRecenteSCEE"] = to_float(dados.get("SaldoMaisRecenteSCEE"))
+    unidade["PossuiUsina"] = bool(dados.get("PossuiUsina"))
+    return unidade
+
+
+def _registros_do_lead(dados):
+    """
+    Registros (tabela, linha) de uma linha do NDJSON de leads: o lead, o
+    vendedor, o contato e as unidades. Levanta ValueError se algo for inválido.
+    """
+    if not isinstance(dados, dict):
+        raise ValueError("Cada linha deve ser um objeto JSON.")
+    lead_id = dados.get("Cpf_CnpjLead")
+    if not lead_id or not dados.get("RazaoSocialLead"):
+        raise ValueError("CPF/CNPJ e Razão Social são obrigatórios")
+    if not isinstance(lead_id, str):
+        raise ValueError("O CPF/CNPJ deve ser um texto.")
+    for campo in ("vendedor", "contato"):
+        if not isinstance(dados.get(campo) or {}, dict):
+            raise ValueError(f"O campo '{campo}' deve ser um objeto JSON.")
+    unidades = dados.get("unidades") or []
+    if not isinstance(unidades, list) or not all(
+        isinstance(unidade, dict) for unidade in unidades
+    ):
+        raise ValueError("O campo 'unidades' deve ser uma lista de objetos JSON.")
+
+    lead = {
+        campo: valor
+        for campo, valor in dados.items()
+        if campo not in ("vendedor", "contato", "unidades")
+    }
+    lead["DataResgistroLead"] = datetime.now().isoformat()
+    registros = [(Config.LEADS_TABLE, lead)]
+
+    vendedor = dados.get("vendedor") or {}
+    if vendedor.get("Vendedor"):
+        registros.append((Config.VENDEDORES_TABLE, novo_vendedor(lead_id, vendedor)))
+    contato = dados.get("contato") or {}
+    if contato.get("NomeContato"):
+        registros.append((Config.CONTATOS_TABLE, novo_contato(lead_id, contato)))
+
+    numeros = set()
+    for unidade in unidades:
+        numero = unidade.get("NumeroDaUcLead")
+        if not numero:
+            raise ValueError("O Nº da UC é obrigatório")
+        if not isinstance(numero, (str, int)) or isinstance(numero, bool):
+            raise ValueError("O Nº da UC deve ser um texto ou número.")
+        if numero in numeros:
+            raise ValueError(f"A UC {numero} aparece mais de uma vez no lead.")
+        numeros.add(numero)
+        violacoes = validar_historico(unidade, [unidade])
+        if violacoes:
+            raise ValueError(
+                f"UC {numero}: Regra de negócio violada: {violacoes[0]['erro']}"
+            )
+        registros.append((Config.UNIDADES_TABLE, nova_unidade(lead_id, unidade)))
+    return registros
+
+
+def importar_leads(linhas):
+    """
+    Importa leads de um NDJSON (um lead por linha, com `vendedor`, `contato` e
+    `unidades` aninhados), lido linha a linha. Leads que já existem (pela
+    chave) ou repetidos no arquivo são recusados; uma linha com erro não é
+    importada. Tudo é gravado em uma única transação. Retorna o relatório.
+    """
+    leads_table = Config.LEADS_TABLE
+    vistos = set()
+    erros = []
+    leads = unidades = linhas_lidas = 0
+
+    with transaction() as tx:
+        for numero_linha, linha in enumerate(linhas, start=1):
+            if not linha.strip():
+                continue
+            linhas_lidas += 1
+            lead_id = None
+            try:
+                dados = json.loads(linha)
+                if isinstance(dados, dict):
+                    lead_id = dados.get("Cpf_CnpjLead")
+                registros = _registros_do_lead(dados)
+                if lead_id in vistos or get_row(leads_table, lead_id):
+                    raise ValueError("Este CPF/CNPJ já existe na base de dados.")
+            except ValueError as e:
+                erros.append(
+                    {"linha": numero_linha, "Cpf_CnpjLead": lead_id, "erro": str(e)}
+                )
+                continue
+
+            vistos.add(lead_id)
+            # O insert do lead confere a chave de novo no commit; os demais
+            # registros substituem eventuais sobras de um lead excluído.
+            (tabela_lead, lead), *dependentes = registros
+            tx.insert(tabela_lead, lead)
+            for tabela, registro in dependentes:
+                tx.put(tabela, registro)
+            leads += 1
+            unidades += sum(
+                tabela == Config.UNIDADES_TABLE for tabela, _ in dependentes
+            )
+
+    return {
+        "linhas_lidas": linhas_lidas,
+        "leads_importados": leads,
+        "unidades_importadas": unidades,
+        "erros": erros,
+    }
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from ...config import Config
+from ..database import _caminho_tmp, _lock_arquivo
+from ..search_index import IndicePrefixo, normalizar
+from ..utils import to_int
+
+# Formato do arquivo do índice; um índice gravado em outro formato é recompilado.
+FORMATO_INDICE = 1
+
+_indice_lock = threading.Lock()
+_indice = {"instancia": None, "ok": False, "carregado_em": 0.0}
+
+
+def _hash_arquivo(caminho):
+    with open(caminho, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _json_bytes(valor):
+    return json.dumps(valor, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def compilar_indice_localidades(origem=None, destino=None):
+    """
+    Etapa de build: lê a aba "Municípios" da planilha de localidades e grava o
+    índice compacto em JSON: as cidades de cada UF já ordenadas por nome, como
+    pares [Cidade, Codigo], e o hash da planilha de origem. Só esta etapa
+    precisa do pandas (e do xlrd, para o .xls). Retorna o índice gravado.
+    """
+    import pandas as pd
+
+    origem = origem or Config.EXCEL_LOCATIONS_PATH
+    destino = destino or Config.LOCALIDADES_INDEX_PATH
+
+    df = pd.read_excel(origem, sheet_name="Municípios")
+    cidades = {}
+    for codigo, uf, cidade in zip(df["Codigo"], df["Uf"], df["Cidade"]):
+        if pd.isna(uf) or pd.isna(cidade):
+            continue
+        cidades.setdefault(str(uf), []).append(
+            [str(cidade), int(codigo) if pd.notna(codigo) else None]
+        )
+    for lista in cidades.values():
+        lista.sort(key=lambda par: par[0])
+
+    dados = {
+        "formato": FORMATO_INDICE,
+        "origem": _hash_arquivo(origem),
+        "cidades": dict(sorted(cidades.items())),
+    }
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    # Temporário único por processo: vários workers podem compilar ao mesmo tempo.
+    temporario = _caminho_tmp(destino)
+    with open(temporario, "wb") as f:
+        f.write(_json_bytes(dados))
+    os.replace(temporario, destino)
+    print(
+        f"[INFO] Índice de localidades gravado em {destino}: "
+        f"{sum(len(l) for l in cidades.values())} cidades, {len(cidades)} UFs."
+    )
+    return dados
+
+
+class IndiceLocalidades:
+    """
+    Localidades prontas para as rotas, montadas uma vez a partir do índice
+    compilado: a lista de UFs e as cidades de cada UF já serializadas em JSON
+    (bytes), o mapa Codigo -> (Cidade, Uf) e os índices de prefixo (geral e por
+    UF) dos nomes normalizados, sem acentos, para o autocompletar.
+    """
+
+    def __init__(self, dados):
+        cidades = dados.get("cidades", {})
+        self.versao = dados.get("origem") or "vazio"
+        self.estados = sorted(cidades)
+        self.estados_json = _json_bytes(self.estados)
+        self.cidades_json = {
+            uf: _json_bytes([{"Cidade": nome, "Codigo": codigo} for nome, codigo in lista])
+            for uf, lista in cidades.items()
+        }
+        self.por_codigo = {
+            codigo: (nome, uf)
+            for uf, lista in cidades.items()
+            for nome, codigo in lista
+            if codigo is not None
+        }
+
+        self.prefixos_uf = {}
+        todos = []
+        for uf, lista in cidades.items():
+            pares = [
+                (normalizar(nome), {"Cidade": nome, "Codigo": codigo, "Uf": uf})
+                for nome, codigo in lista
+            ]
+            self.prefixos_uf[uf] = IndicePrefixo(pares)
+            todos.extend(pares)
+        self.prefixos = IndicePrefixo(todos)
+
+    def cidades_da_uf(self, uf):
+        """JSON (bytes) da lista de cidades da UF, ordenada por nome."""
+        return self.cidades_json.get(uf, b"[]")
+
+    def buscar_cidades(self, consulta, uf=None, limite=10):
+        """
+        Até `limite` cidades cujo nome começa com `consulta`, ignorando acentos,
+        maiúsculas e pontuação ("sao jo" acha "SÃO JOSÉ..."), em ordem
+        alfabética. Com `uf`, só as cidades dessa UF.
+        """
+        prefixo = normalizar(consulta)
+        if not prefixo:
+            return []
+        indice = self.prefixos if uf is None else self.prefixos_uf.get(uf)
+        if indice is None:
+            return []
+        return indice.buscar(prefixo, limite)
+
+    def resolver_cidade(self, linha):
+        """
+        Acrescenta à linha (unidade ou lead) o CidadeNome e a Uf do código
+        gravado em Cidade, por busca no mapa de códigos. Códigos vazios ou
+        desconhecidos deixam a linha como está.
+        """
+        encontrada = self.por_codigo.get(to_int(linha.get("Cidade")))
+        if encontrada:
+            linha["CidadeNome"], linha["Uf"] = encontrada
+        return linha
+
+
+def _ler_indice(caminho, origem):
+    """
+    Lê o índice compilado. Retorna (dados, atualizado): dados é None se o
+    arquivo não existe ou é inválido; atualizado diz se ele é do formato atual
+    e foi gerado da planilha atual (sem a planilha, vale o que estiver gravado).
+    """
+    dados = None
+    try:
+        with open(caminho, "rb") as f:
+            dados = json.loads(f.read())
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        print(f"[AVISO] Índice de localidades inválido ({caminho}): {e}")
+
+    atualizado = dados is not None and dados.get("formato") == FORMATO_INDICE
+    if atualizado and os.path.exists(origem):
+        atualizado = dados.get("origem") == _hash_arquivo(origem)
+    return dados, atualizado
+
+
+def _carregar(compilar=True):
+    """
+    Lê o índice compilado. Se ele não existe, é de outro formato ou foi gerado
+    de uma planilha diferente da atual, é recompilado antes (se possível e se
+    `compilar`). Retorna (dados, ok); com ok False, dados é o que foi possível
+    ler (ou {}).
+    """
+    caminho = Config.LOCALIDADES_INDEX_PATH
+    origem = Config.EXCEL_LOCATIONS_PATH
+    dados, atualizado = _ler_indice(caminho, origem)
+    if atualizado:
+        return dados, True
+    if not os.path.exists(origem):
+        if dados is None:
+            print(f"[AVISO] Arquivo de localidades não encontrado: {origem}")
+        return dados or {}, dados is not None
+    if not compilar:
+        return dados or {}, False
+
+    # Um worker compila por vez; os outros esperam e leem o que ele gravou.
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with _lock_arquivo(f"{caminho}.lock"):
+        dados, atualizado = _ler_indice(caminho, origem)
+        if atualizado:
+            return dados, True
+        try:
+            return compilar_indice_localidades(origem, caminho), True
+        except Exception as e:
+            print(f"[ERRO] Falha ao compilar o índice de localidades: {e}")
+            return dados or {}, False
+
+
+def _guardar(dados, ok):
+    indice = IndiceLocalidades(dados)
+    _indice.update(instancia=indice, ok=ok, carregado_em=time.monotonic())
+    return indice
+
+
+def carregar_indice_localidades():
+    """
+    Carrega o índice de localidades do processo, compilando-o se preciso. É
+    chamada na criação da aplicação; as rotas só usam indice_localidades().
+    """
+    with _indice_lock:
+        return _guardar(*_carregar())
+
+
+def versao_localidades():
+    """Marca do índice de localidades (hash da planilha de origem), para o ETag."""
+    return indice_localidades().versao
+
+
+def indice_localidades():
+    """
+    IndiceLocalidades do processo. Nunca compila: o resultado de uma carga que
+    falhou (ou de um índice desatualizado) também é guardado, e só depois de
+    LOCALIDADES_RECARGA_SEGUNDOS o arquivo compilado é lido de novo, para
+    pegar um índice gerado por `flask compilar-localidades`.
+    """
+    with _indice_lock:
+        indice = _indice["instancia"]
+        if indice is not None and (
+            _indice["ok"]
+            or time.monotonic() - _indice["carregado_em"]
+            < Config.LOCALIDADES_RECARGA_SEGUNDOS
+        ):
+            return indice
+        return _guardar(*_carregar(compilar=False))
@@ -0,0 +1,103 @@
+import threading
+
+from ...config import Config
+from ..database import find_rows, table_version
+from ..search_index import (
+    IndiceFacetas,
+    IndicePrefixo,
+    IndiceTrigramas,
+    corresponde,
+    textos_da_linha,
+)
+
+# Campos da busca livre (`filtro`) e das facetas de igualdade exata.
+CAMPOS_TEXTO_PROPOSTA = (
+    "RazaoSocialLead",
+    "AgenteDeVenda",
+    "StatusNegociacao",
+    "NomeContato",
+)
+FACETAS_PROPOSTA = ("StatusNegociacao", "AgenteDeVenda")
+
+_cache_lock = threading.Lock()
+_cache = {"versoes": None, "indice": None}
+
+
+class IndicePropostas:
+    """
+    Estrutura de busca das propostas, montada a partir das tabelas Proposta e
+    ContatoProposta (de onde vem o NomeContato):
+    - índice de trigramas nos campos de texto, para a busca por substring;
+    - índice de prefixo (lista ordenada + bisect) no NProposta;
+    - facetas de igualdade exata em StatusNegociacao e AgenteDeVenda.
+    As buscas devolvem apenas os NProposta encontrados, com custo proporcional
+    ao número de resultados.
+    """
+
+    def __init__(self, propostas, contatos_proposta):
+        # Como no mapa antigo da rota, vale o último contato de cada proposta.
+        contatos_map = {cp.get("IdProposta"): cp for cp in contatos_proposta}
+
+        self.texto = IndiceTrigramas(CAMPOS_TEXTO_PROPOSTA)
+        self.facetas = IndiceFacetas(FACETAS_PROPOSTA)
+        self._linhas = {}
+        pares = []
+        for proposta in propostas:
+            n_proposta = proposta.get("NProposta")
+            contato_info = contatos_map.get(n_proposta)
+            linha = proposta
+            if contato_info:
+                linha = {**proposta, "NomeContato": contato_info.get("NomeContato")}
+
+            self.texto.adicionar(n_proposta, linha)
+            self.facetas.adicionar(n_proposta, proposta)
+            self._linhas[n_proposta] = linha
+            pares.append((str(n_proposta), n_proposta))
+        self.prefixo = IndicePrefixo(pares)
+
+    def buscar(self, filtro="", status=None, agente=None):
+        """
+        Retorna o conjunto de NProposta que atendem à busca, ou None se nenhum
+        critério foi informado. `filtro` procura nos campos de texto ou no
+        início do NProposta; `status` e `agente` são comparações exatas.
+        """
+        resultado = None
+        if filtro:
+            chaves = self.texto.buscar(filtro)
+            if chaves is None:
+                # Consulta sem letras nem dígitos: comparação antiga, linha a linha.
+                chaves = [
+                    n_proposta
+                    for n_proposta, linha in self._linhas.items()
+                    if corresponde(filtro, textos_da_linha(linha, CAMPOS_TEXTO_PROPOSTA))
+                ]
+            resultado = set(chaves).union(self.prefixo.buscar(filtro.lower()))
+
+        for campo, valor in (("StatusNegociacao", status), ("AgenteDeVenda", agente)):
+            if valor is None:
+                continue
+            chaves = self.facetas.buscar(campo, valor)
+            resultado = set(chaves) if resultado is None else resultado & chaves
+        return resultado
+
+
+def indice_propostas():
+    """
+    Retorna o IndicePropostas atual. Ele é reconstruído apenas quando as
+    tabelas Proposta ou ContatoProposta mudam (ver table_version).
+    """
+    # As versões são lidas antes das linhas: se uma escrita acontecer no meio,
+    # a próxima chamada apenas reconstrói o índice de novo.
+    versoes = (
+        Config.STORAGE_ENGINE,
+        table_version(Config.PROPOSTA_TABLE),
+        table_version(Config.CONTATO_PROPOSTA_TABLE),
+    )
+    with _cache_lock:
+        if _cache["versoes"] != versoes:
+            _cache["indice"] = IndicePropostas(
+                find_rows(Config.PROPOSTA_TABLE),
+                find_rows(Config.CONTATO_PROPOSTA_TABLE),
+            )
+            _cache["versoes"] = versoes
+        return _cache["indice"]
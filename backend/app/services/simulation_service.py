@@ -1,25 +1,408 @@
-from dateutil.relativedelta import relativedelta
+import atexit
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from ...config import Config
 from ..utils import to_float
 
+# --- TARIFAS SIMPLIFICADAS PARA O PORTFÓLIO ---
+# A lógica de negócio original e proprietária foi removida; os valores abaixo
+# são fictícios e servem apenas para o motor produzir resultados coerentes.
+TARIFA_KWH_PONTA = 0.85  # R$/kWh
+TARIFA_KWH_FORA_PONTA = 0.45  # R$/kWh
+TARIFA_KW_DEMANDA_PONTA = 45.0  # R$/kW
+TARIFA_KW_DEMANDA_FORA_PONTA = 18.0  # R$/kW
+TARIFA_KW_DEMANDA_GERACAO = 9.0  # R$/kW
+PIS_PADRAO = 1.65  # %
+COFINS_PADRAO = 7.6  # %
+
+# Campos do histórico usados no cálculo, na ordem das colunas da matriz de valores.
+CAMPOS_HISTORICO = (
+    "kWhProjPonta",
+    "kWhProjForaPonta",
+    "kWhProjHRes",
+    "kWhProjDieselP",
+    "kWhCompensadoP",
+    "kWhCompensadoFP",
+    "DemandaCP",
+    "DemandaCFP",
+    "DemandaCG",
+)
+COLUNA = {campo: i for i, campo in enumerate(CAMPOS_HISTORICO)}
+
+# Pool de processos da simulação em lote, criado no primeiro uso.
+_pool_lock = threading.Lock()
+_pool = {"executor": None}
+
+
+def carregar_colunas(historico):
+    """
+    Converte os registros do histórico em arrays: (id_meses, valores), em que
+    id_meses tem o IDMes (AAAAMM) de cada registro e valores é uma matriz
+    registros x CAMPOS_HISTORICO (campos vazios viram 0).
+    """
+    id_meses = np.array(
+        [int(str(r.get("IDMes", 0)).replace("-", "") or 0) for r in historico],
+        dtype=np.int64,
+    )
+    valores = np.array(
+        [
+            [to_float(r.get(campo)) or 0.0 for campo in CAMPOS_HISTORICO]
+            for r in historico
+        ],
+        dtype=np.float64,
+    ).reshape(len(historico), len(CAMPOS_HISTORICO))
+    return id_meses, valores
+
+
+def perfil_mensal(historico):
+    """
+    Perfil típico da unidade: matriz 12 x CAMPOS_HISTORICO com o registro mais
+    recente de cada mês do calendário. Meses sem histórico recebem a média dos
+    meses que têm.
+    """
+    id_meses, valores = carregar_colunas(historico)
+    mes_calendario = id_meses % 100 - 1
+    validos = (mes_calendario >= 0) & (mes_calendario < 12)
+    id_meses, valores, mes_calendario = (
+        id_meses[validos],
+        valores[validos],
+        mes_calendario[validos],
+    )
+
+    perfil = np.zeros((12, len(CAMPOS_HISTORICO)))
+    if not len(id_meses):
+        return perfil
+
+    # Ordem decrescente de IDMes: a primeira ocorrência de cada mês é a mais recente.
+    ordem = np.argsort(-id_meses, kind="stable")
+    meses_presentes, primeiros = np.unique(mes_calendario[ordem], return_index=True)
+    perfil[meses_presentes] = valores[ordem][primeiros]
+
+    ausentes = np.setdiff1d(np.arange(12), meses_presentes)
+    perfil[ausentes] = perfil[meses_presentes].mean(axis=0)
+    return perfil
+
+
+def horizonte(data_inicio_obj, duracao_meses):
+    """Arrays (anos, meses) de cada mês do período, a partir de data_inicio_obj."""
+    indices = data_inicio_obj.month - 1 + np.arange(duracao_meses)
+    return data_inicio_obj.year + indices // 12, indices % 12 + 1
+
+
+def calcular_custos(
+    valores, aliquota_icms, pis=PIS_PADRAO, cofins=COFINS_PADRAO, fator=1.0
+):
+    """
+    Componentes de custo de cada mês, como operações sobre arrays inteiros.
+    `valores` tem CAMPOS_HISTORICO no último eixo (ex: meses x campos, ou
+    cenários x meses x campos); `fator` multiplica as tarifas (reajustes) e é
+    combinado com os outros eixos por broadcasting.
+    """
+
+    def coluna(campo):
+        return valores[..., COLUNA[campo]]
+
+    consumo_ponta = coluna("kWhProjPonta")
+    consumo_fora_ponta = (
+        coluna("kWhProjForaPonta") + coluna("kWhProjHRes") + coluna("kWhProjDieselP")
+    )
+    # A energia compensada (geração distribuída) abate o consumo do mesmo posto.
+    faturado_ponta = np.maximum(consumo_ponta - coluna("kWhCompensadoP"), 0.0)
+    faturado_fora_ponta = np.maximum(
+        consumo_fora_ponta - coluna("kWhCompensadoFP"), 0.0
+    )
+
+    custo_consumo = (
+        faturado_ponta * TARIFA_KWH_PONTA
+        + faturado_fora_ponta * TARIFA_KWH_FORA_PONTA
+    ) * fator
+    custo_demanda = (
+        coluna("DemandaCP") * TARIFA_KW_DEMANDA_PONTA
+        + coluna("DemandaCFP") * TARIFA_KW_DEMANDA_FORA_PONTA
+        + coluna("DemandaCG") * TARIFA_KW_DEMANDA_GERACAO
+    ) * fator
+
+    # ICMS, PIS e COFINS são cobrados "por dentro": fazem parte do próprio total.
+    tributos = (aliquota_icms + pis + cofins) / 100
+    if np.any(np.asarray(tributos) >= 1):
+        raise ValueError(
+            "A soma das alíquotas de ICMS, PIS e COFINS deve ser menor que 100%."
+        )
+    base = custo_consumo + custo_demanda
+    custo_total = base / (1 - tributos)
+
+    return {
+        "consumo_total_kwh": consumo_ponta + consumo_fora_ponta,
+        "demanda_total_kw": (
+            coluna("DemandaCP") + coluna("DemandaCFP") + coluna("DemandaCG")
+        ),
+        "custo_consumo": custo_consumo,
+        "custo_demanda": custo_demanda,
+        "custo_impostos": custo_total - base,
+        "custo_total_mes": custo_total,
+    }
+
+
+def _parametro(dados, chave, padrao):
+    valor = to_float(dados.get(chave))
+    return padrao if valor is None else valor
+
 
 def realizar_calculo_simulacao(dados):
     """
     SIMULAÇÃO SIMPLIFICADA PARA O PORTFÓLIO.
-    A lógica de negócio original e proprietária foi removida.
-    Esta função demonstra a estrutura de entrada e saída do cálculo.
+    Projeta o perfil mensal da unidade (ou o consumo estimado de um lead) por
+    `duracao_meses` a partir de `data_inicio_obj` e calcula os custos de todos
+    os meses de uma vez com NumPy. Retorna None se o período for inválido.
     """
-    # Exemplo de como acessar os dados que chegam
-    consumo_total = 0
-    for registro in dados.get("historico", []):
-        consumo_total += registro.get("kWhProjPonta", 0)
+    duracao_meses = int(dados.get("duracao_meses") or 0)
+    if duracao_meses <= 0:
+        return None
+    anos, meses = horizonte(dados["data_inicio_obj"], duracao_meses)
+
+    if dados.get("tipo", "cliente") == "cliente":
+        # Cada mês do período recebe o valor do mesmo mês no perfil da unidade.
+        valores = perfil_mensal(dados.get("historico", []))[meses - 1]
+    else:
+        valores = np.zeros((duracao_meses, len(CAMPOS_HISTORICO)))
+        valores[:, COLUNA["kWhProjForaPonta"]] = _parametro(
+            dados, "consumo_estimado", 0.0
+        )
+        valores[:, COLUNA["DemandaCFP"]] = _parametro(dados, "demanda_estimada", 0.0)
+
+    # Reajuste anual opcional das tarifas (ex: 0.04 = 4% ao ano).
+    reajuste = _parametro(dados, "reajuste_anual", 0.0)
+    fator = (1 + reajuste) ** (np.arange(duracao_meses) // 12)
+
+    custos = calcular_custos(
+        valores,
+        _parametro(dados, "aliquota_icms", 0.0),
+        pis=_parametro(dados, "pis", PIS_PADRAO),
+        cofins=_parametro(dados, "cofins", COFINS_PADRAO),
+        fator=fator,
+    )
 
-    # Lógica de cálculo fictícia e simplificada
-    custo_simulado_cativo = consumo_total * 0.85  # Ex: R$ 0,85 por kWh
-    economia_simulada = custo_simulado_cativo * 0.15 # Ex: Economia de 15%
+    colunas = {nome: np.round(serie, 2).tolist() for nome, serie in custos.items()}
+    rotulos = [f"{mes:02d}/{ano}" for mes, ano in zip(meses.tolist(), anos.tolist())]
+    detalhes_mensais = [
+        {"mes": rotulo, **{nome: colunas[nome][i] for nome in colunas}}
+        for i, rotulo in enumerate(rotulos)
+    ]
 
-    # Monta um dicionário de resultados com a mesma estrutura que sua interface espera
+    custo_total = float(custos["custo_total_mes"].sum())
     resultado_final = {
-        "totais": { "custo_total_periodo": custo_simulado_cativo },
-        "detalhes_mensais": [] # Pode gerar dados mensais fictícios aqui se precisar
+        "totais": {
+            "custo_total_periodo": custo_total,
+            "custo_medio_mensal": custo_total / duracao_meses,
+            "consumo_total_periodo": float(custos["consumo_total_kwh"].sum()),
+            "demanda_media": float(custos["demanda_total_kw"].mean()),
+            "duracao_meses": duracao_meses,
+        },
+        "detalhes_mensais": detalhes_mensais,
     }
-    return resultado_final
\ No newline at end of file
+    return resultado_final
+
+
+def fator_ipca(anos, ipca_anual):
+    """
+    Fator de correção acumulado de cada mês do período. `ipca_anual` é uma
+    matriz cenários x anos do período (do primeiro ao último ano de `anos`),
+    em % ao ano; o preço de cada ano é corrigido pelo IPCA dos anos anteriores.
+    Retorna uma matriz cenários x meses.
+    """
+    ipca_anual = np.atleast_2d(np.asarray(ipca_anual, dtype=np.float64))
+    acumulado = np.cumprod(1 + ipca_anual / 100, axis=1)
+    fator_ano = np.hstack([np.ones((len(ipca_anual), 1)), acumulado[:, :-1]])
+    return fator_ano[:, anos - anos[0]]
+
+
+def calcular_cenarios(valores, aliquota_icms, fatores_ipca, descontos, precos):
+    """
+    Economia no mercado livre para uma grade de cenários, de uma só vez.
+    MODELO SIMPLIFICADO: no mercado livre a energia consumida é paga ao preço
+    do MWh corrigido pelo IPCA, e a parcela de demanda (fio) recebe o desconto.
+
+    :param valores: série projetada da UC (meses x CAMPOS_HISTORICO).
+    :param fatores_ipca: cenários de IPCA x meses (ver fator_ipca).
+    :param descontos: array de descontos na demanda (fração, ex: 0.5).
+    :param precos: array de preços do MWh (R$) no primeiro ano.
+    Retorna (custo_cativo, economia), com economia em IPCA x descontos x preços.
+    """
+    custos = calcular_custos(valores, aliquota_icms)
+    custo_cativo = float(custos["custo_total_mes"].sum())
+    fracao_liquida = 1 - (aliquota_icms + PIS_PADRAO + COFINS_PADRAO) / 100
+
+    # Energia (MWh) corrigida de cada cenário de IPCA: um produto matriz x vetor.
+    energia = np.asarray(fatores_ipca) @ (custos["consumo_total_kwh"] / 1000)
+    fio = custos["custo_demanda"].sum()
+
+    custo_livre = (
+        energia[:, None, None] * np.asarray(precos)[None, None, :]
+        + (1 - np.asarray(descontos))[None, :, None] * fio
+    ) / fracao_liquida
+    return custo_cativo, custo_cativo - custo_livre
+
+
+def simular_risco(
+    valores,
+    aliquota_icms,
+    anos,
+    preco_base,
+    ipca_anual,
+    desconto=0.0,
+    caminhos=10000,
+    volatilidade_preco=0.2,
+    volatilidade_ipca=1.5,
+    semente=None,
+):
+    """
+    Monte Carlo do risco de preço no mercado livre, com o mesmo modelo de
+    calcular_cenarios. Sorteia `caminhos` trajetórias de uma vez, como
+    matrizes caminhos x meses:
+    - IPCA anual normal em torno de `ipca_anual` (desvio `volatilidade_ipca`,
+      em pontos percentuais);
+    - choque lognormal de preço, um passeio aleatório mensal com volatilidade
+      anual `volatilidade_preco` e média 1, sobre `preco_base` (R$/MWh).
+    A mesma `semente` reproduz os mesmos resultados. Retorna (custo_cativo,
+    economia_total, economia_mensal): economia_total tem um valor por caminho e
+    economia_mensal é caminhos x meses.
+    """
+    rng = np.random.default_rng(semente)
+    caminhos, meses = int(caminhos), len(anos)
+
+    custos = calcular_custos(valores, aliquota_icms)
+    fracao_liquida = 1 - (aliquota_icms + PIS_PADRAO + COFINS_PADRAO) / 100
+
+    ipca_sorteado = np.asarray(ipca_anual)[None, :] + volatilidade_ipca * (
+        rng.standard_normal((caminhos, len(ipca_anual)))
+    )
+    fatores = fator_ipca(anos, ipca_sorteado)
+
+    sigma = volatilidade_preco / np.sqrt(12)
+    passos = sigma * rng.standard_normal((caminhos, meses)) - sigma**2 / 2
+    precos = preco_base * np.exp(np.cumsum(passos, axis=1)) * fatores
+
+    custo_livre = (
+        (custos["consumo_total_kwh"] / 1000) * precos
+        + (1 - desconto) * custos["custo_demanda"]
+    ) / fracao_liquida
+    economia_mensal = custos["custo_total_mes"] - custo_livre
+    return (
+        float(custos["custo_total_mes"].sum()),
+        economia_mensal.sum(axis=1),
+        economia_mensal,
+    )
+
+
+def _simular_tarefa(tarefa):
+    """Executada nos processos do pool: (uc_id, dados) -> (uc_id, resultado, erro)."""
+    uc_id, dados = tarefa
+    try:
+        return uc_id, realizar_calculo_simulacao(dados), None
+    except Exception as e:
+        return uc_id, None, str(e)
+
+
+def _executor(processos):
+    with _pool_lock:
+        if _pool["executor"] is None:
+            # "spawn" em vez de fork: o servidor tem várias threads, e um fork
+            # poderia copiar locks travados por elas.
+            _pool["executor"] = ProcessPoolExecutor(
+                max_workers=processos, mp_context=multiprocessing.get_context("spawn")
+            )
+            atexit.register(_pool["executor"].shutdown, wait=False)
+        return _pool["executor"]
+
+
+def simular_lote(tarefas, processos=None, min_paralelo=1):
+    """
+    Calcula várias simulações. `tarefas` é uma lista de (uc_id, dados), com os
+    mesmos `dados` de realizar_calculo_simulacao. Gera (uc_id, resultado, erro)
+    na ordem das tarefas, à medida que ficam prontos. Lotes a partir de
+    `min_paralelo` tarefas são distribuídos em um pool de `processos` processos.
+    """
+    if len(tarefas) < min_paralelo or processos == 1:
+        yield from map(_simular_tarefa, tarefas)
+        return
+
+    processos = processos or os.cpu_count() or 1
+    # Tarefas agrupadas em pedaços para diluir o custo de envio entre processos.
+    tamanho_pedaco = max(1, len(tarefas) // (processos * 4))
+    executor = _executor(processos)
+    try:
+        yield from executor.map(_simular_tarefa, tarefas, chunksize=tamanho_pedaco)
+    except BrokenProcessPool:
+        # Um processo do pool morreu: encerramos e descartamos o pool (sem
+        # esperar pelos processos restantes); o próximo lote cria outro.
+        with _pool_lock:
+            if _pool["executor"] is executor:
+                _pool["executor"] = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+class CacheSimulacoes:
+    """
+    Cache LRU dos resultados de simulação, limitado a `tamanho` entradas. A
+    chave é uma tupla cujo primeiro item é a UC; os demais (período e versões
+    das tabelas) são montados por quem consulta. Conta acertos e faltas.
+    """
+
+    def __init__(self, tamanho):
+        self.tamanho = tamanho
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()
+        self.acertos = self.faltas = self.invalidacoes = 0
+
+    def obter(self, chave):
+        """Resultado guardado para `chave`, ou None."""
+        with self._lock:
+            resultado = self._itens.get(chave)
+            if resultado is None:
+                self.faltas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return resultado
+
+    def guardar(self, chave, resultado):
+        if self.tamanho <= 0:
+            return
+        with self._lock:
+            self._itens[chave] = resultado
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho:
+                self._itens.popitem(last=False)
+
+    def invalidar(self, uc_id=None):
+        """Descarta os resultados de uma UC, ou todos se uc_id for None."""
+        with self._lock:
+            if uc_id is None:
+                removidas = list(self._itens)
+            else:
+                removidas = [c for c in self._itens if str(c[0]) == str(uc_id)]
+            for chave in removidas:
+                del self._itens[chave]
+            self.invalidacoes += len(removidas)
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self.acertos + self.faltas
+            return {
+                "tamanho": len(self._itens),
+                "tamanho_maximo": self.tamanho,
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "invalidacoes": self.invalidacoes,
+                "taxa_acerto": self.acertos / consultas if consultas else 0.0,
+            }
+
+
+cache_simulacoes = CacheSimulacoes(Config.SIMULACAO_CACHE_TAMANHO)
@@ -1,84 +1,181 @@
+from functools import lru_cache
+
+import numpy as np
+
 from ..utils import to_float
 
+# Campos do histórico sujeitos às regras de tarifação, na ordem em que são
+# verificados (a primeira violação de um mês segue esta ordem).
+CAMPOS_REGRAS = (
+    "kWProjPonta",
+    "kWProjForaPonta",
+    "kWhProjPonta",
+    "kWhProjForaPonta",
+    "kWhProjHRes",
+    "kWhCompensadoHr",
+    "kWhProjDieselP",
+    "kWhProjPontaG",
+    "kWhProjForaPontaG",
+    "kWProjG",
+    "kWhCompensadoP",
+    "kWhCompensadoFP",
+    "kWGeracaoProjetada",
+    "DemandaCP",
+    "DemandaCFP",
+    "DemandaCG",
+)
+COLUNA_REGRA = {campo: i for i, campo in enumerate(CAMPOS_REGRAS)}
 
-def validar_regras_tarifacao(dados_unidade, dados_historico_mes):
-    """
-    Valida os dados de um mês do histórico contra as regras de tarifação da unidade.
-    Levanta um ValueError se uma regra for violada.
+# O diesel é a única regra que depende do próprio mês: o campo só pode ser
+# diferente de zero se for positivo (há gerador a diesel naquele mês).
+_COLUNA_DIESEL = COLUNA_REGRA["kWhProjDieselP"]
 
-    :param dados_unidade: Dicionário com os dados da tabela de Unidades.
-    :param dados_historico_mes: Dicionário com os dados de um único mês da tabela de Histórico.
+
+class PerfilTarifario:
+    """
+    Regras de tarifação compiladas para um perfil de unidade (subgrupo,
+    tarifa, usina e benefício rural): uma máscara dos campos que devem ser
+    zero e a lista dos campos obrigatórios quando o mês tem dados.
     """
-    # --- Extração e Preparação dos Dados ---
-    subgrupo = dados_unidade.get("SubgrupoTarifario", "").upper()
-    tarifa = dados_unidade.get("Tarifa", "").upper()
-    possui_usina = bool(dados_unidade.get("PossuiUsina", False))
 
-    # --- CORREÇÃO CRÍTICA AQUI ---
-    # Verifica se o valor não é None antes de fazer a comparação numérica.
-    beneficio_rural = to_float(dados_unidade.get("BeneficioRuralIrrigacao"))
-    is_rural_irrigante = beneficio_rural is not None and beneficio_rural > 0
-
-    gerador_diesel = to_float(dados_historico_mes.get("kWhProjDieselP"))
-    tem_gerador_diesel = gerador_diesel is not None and gerador_diesel > 0
-    # --- FIM DA CORREÇÃO ---
-
-    is_grupo_a = subgrupo.startswith("A")
-    is_grupo_b = subgrupo.startswith("B")
-    is_tarifa_azul = "AZUL" in tarifa
-    is_tarifa_verde = "VERDE" in tarifa
-
-    regras_de_zeramento = {
-        "kWProjPonta": is_tarifa_verde or is_grupo_b,
-        "kWProjForaPonta": is_tarifa_verde or is_grupo_b,
-        "kWhProjPonta": is_tarifa_verde or is_grupo_b,
-        "kWhProjForaPonta": is_tarifa_verde or is_grupo_b,
-        "kWhProjHRes": not is_rural_irrigante,
-        "kWhCompensadoHr": not possui_usina and not is_rural_irrigante,
-        "kWhProjDieselP": not tem_gerador_diesel,
-        "kWhProjPontaG": not possui_usina,
-        "kWhProjForaPontaG": not possui_usina,
-        "kWProjG": not possui_usina,
-        "kWhCompensadoP": not possui_usina,
-        "kWhCompensadoFP": not possui_usina,
-        "kWGeracaoProjetada": not possui_usina,
-        "DemandaCP": is_grupo_b or is_tarifa_verde,
-        "DemandaCFP": is_grupo_b,
-        "DemandaCG": is_grupo_b or not possui_usina,
-    }
-
-    for campo, condicao_para_zerar in regras_de_zeramento.items():
-        valor_campo = to_float(dados_historico_mes.get(campo))
-        if condicao_para_zerar and valor_campo and valor_campo != 0:
-            raise ValueError(
-                f"O campo '{campo}' deve ser zero para as condições atuais da unidade."
-            )
+    def __init__(self, subgrupo, tarifa, possui_usina, is_rural_irrigante):
+        is_grupo_a = subgrupo.startswith("A")
+        is_grupo_b = subgrupo.startswith("B")
+        is_tarifa_azul = "AZUL" in tarifa
+        is_tarifa_verde = "VERDE" in tarifa
 
-    campos_de_dados = list(regras_de_zeramento.keys())
-    tem_dados_no_mes = any(
-        to_float(dados_historico_mes.get(campo)) for campo in campos_de_dados
-    )
+        regras_de_zeramento = {
+            "kWProjPonta": is_tarifa_verde or is_grupo_b,
+            "kWProjForaPonta": is_tarifa_verde or is_grupo_b,
+            "kWhProjPonta": is_tarifa_verde or is_grupo_b,
+            "kWhProjForaPonta": is_tarifa_verde or is_grupo_b,
+            "kWhProjHRes": not is_rural_irrigante,
+            "kWhCompensadoHr": not possui_usina and not is_rural_irrigante,
+            "kWhProjDieselP": False,  # ver _COLUNA_DIESEL
+            "kWhProjPontaG": not possui_usina,
+            "kWhProjForaPontaG": not possui_usina,
+            "kWProjG": not possui_usina,
+            "kWhCompensadoP": not possui_usina,
+            "kWhCompensadoFP": not possui_usina,
+            "kWGeracaoProjetada": not possui_usina,
+            "DemandaCP": is_grupo_b or is_tarifa_verde,
+            "DemandaCFP": is_grupo_b,
+            "DemandaCG": is_grupo_b or not possui_usina,
+        }
+        self.zerar = np.array([regras_de_zeramento[campo] for campo in CAMPOS_REGRAS])
 
-    if tem_dados_no_mes:
+        self.obrigatorios = []
         if is_grupo_a and (is_tarifa_azul or is_tarifa_verde):
-            valor_demanda_cfp = to_float(dados_historico_mes.get("DemandaCFP"))
-            if not valor_demanda_cfp or valor_demanda_cfp <= 0:
-                raise ValueError(
-                    "O campo 'Demanda CFP' é obrigatório para Grupo A com Tarifa Azul ou Verde."
+            self.obrigatorios.append(
+                (
+                    "DemandaCFP",
+                    "O campo 'Demanda CFP' é obrigatório para Grupo A com Tarifa Azul ou Verde.",
                 )
-
+            )
         if is_grupo_a and is_tarifa_azul:
-            valor_demanda_cp = to_float(dados_historico_mes.get("DemandaCP"))
-            if not valor_demanda_cp or valor_demanda_cp <= 0:
-                raise ValueError(
-                    "O campo 'Demanda CP' é obrigatório para Grupo A com Tarifa Azul."
+            self.obrigatorios.append(
+                (
+                    "DemandaCP",
+                    "O campo 'Demanda CP' é obrigatório para Grupo A com Tarifa Azul.",
                 )
-
+            )
         if possui_usina:
-            valor_demanda_cg = to_float(dados_historico_mes.get("DemandaCG"))
-            if not valor_demanda_cg or valor_demanda_cg <= 0:
-                raise ValueError(
-                    "O campo 'Demanda CG' é obrigatório pois a unidade possui usina (Geração Distribuída)."
+            self.obrigatorios.append(
+                (
+                    "DemandaCG",
+                    "O campo 'Demanda CG' é obrigatório pois a unidade possui usina (Geração Distribuída).",
                 )
+            )
+
+
+# Limitado: as chaves vêm de texto livre das requisições (subgrupo e tarifa).
+@lru_cache(maxsize=256)
+def _compilar_perfil(subgrupo, tarifa, possui_usina, is_rural_irrigante):
+    return PerfilTarifario(subgrupo, tarifa, possui_usina, is_rural_irrigante)
+
+
+def perfil_da_unidade(dados_unidade):
+    """PerfilTarifario da unidade; unidades com o mesmo perfil compartilham as regras."""
+    beneficio_rural = to_float(dados_unidade.get("BeneficioRuralIrrigacao"))
+    return _compilar_perfil(
+        str(dados_unidade.get("SubgrupoTarifario") or "").upper(),
+        str(dados_unidade.get("Tarifa") or "").upper(),
+        bool(dados_unidade.get("PossuiUsina", False)),
+        beneficio_rural is not None and beneficio_rural > 0,
+    )
 
+
+def matriz_regras(meses):
+    """Valores de CAMPOS_REGRAS de cada mês (meses x campos); vazios viram 0."""
+    return np.array(
+        [[to_float(mes.get(campo)) or 0.0 for campo in CAMPOS_REGRAS] for mes in meses],
+        dtype=np.float64,
+    ).reshape(len(meses), len(CAMPOS_REGRAS))
+
+
+def validar_historico(dados_unidade, meses):
+    """
+    Valida vários meses do histórico de uma vez contra as regras de tarifação
+    da unidade. Retorna a lista de todas as violações (vazia se estiver tudo
+    certo), cada uma com a posição do mês em `meses`, o IDMes, o campo e a
+    mensagem de erro.
+    """
+    perfil = perfil_da_unidade(dados_unidade)
+    valores = matriz_regras(meses)
+    preenchidos = valores != 0
+
+    # Campos que deveriam ser zero: a máscara do perfil em todas as linhas.
+    a_zerar = preenchidos & perfil.zerar
+    diesel = valores[:, _COLUNA_DIESEL]
+    a_zerar[:, _COLUNA_DIESEL] = preenchidos[:, _COLUNA_DIESEL] & ~(diesel > 0)
+
+    violacoes = [
+        (linha, 0, coluna, CAMPOS_REGRAS[coluna], None)
+        for linha, coluna in zip(*np.nonzero(a_zerar))
+    ]
+
+    # Campos obrigatórios, só nos meses que têm algum dado.
+    tem_dados = preenchidos.any(axis=1)
+    for ordem, (campo, mensagem) in enumerate(perfil.obrigatorios):
+        faltando = tem_dados & (valores[:, COLUNA_REGRA[campo]] <= 0)
+        violacoes.extend(
+            (linha, 1, ordem, campo, mensagem) for linha in np.nonzero(faltando)[0]
+        )
+
+    violacoes.sort(key=lambda v: v[:3])
+    return [
+        {
+            "linha": int(linha),
+            "IDMes": meses[linha].get("IDMes"),
+            "campo": campo,
+            "erro": mensagem
+            or f"O campo '{campo}' deve ser zero para as condições atuais da unidade.",
+        }
+        for linha, _, _, campo, mensagem in violacoes
+    ]
+
+
+def validar_regras_tarifacao(dados_unidade, dados_historico_mes):
+    """
+    Valida os dados de um mês do histórico contra as regras de tarifação da unidade.
+    Levanta um ValueError se uma regra for violada.
+
+    :param dados_unidade: Dicionário com os dados da tabela de Unidades.
+    :param dados_historico_mes: Dicionário com os dados de um único mês da tabela de Histórico.
+    """
+    violacoes = validar_historico(dados_unidade, [dados_historico_mes])
+    if violacoes:
+        raise ValueError(violacoes[0]["erro"])
     return True
+
+
+def revalidar_historico(unidade_atual, unidade_nova, historico):
+    """
+    Revalida o histórico gravado de uma unidade contra os novos atributos dela
+    (ex: mudança de SubgrupoTarifario, Tarifa ou PossuiUsina). Se o perfil de
+    tarifação não mudou, o histórico já foi validado com as mesmas regras e
+    nada é verificado. Retorna as violações, como validar_historico.
+    """
+    if perfil_da_unidade(unidade_atual) is perfil_da_unidade(unidade_nova):
+        return []
+    return validar_historico(unidade_nova, historico)
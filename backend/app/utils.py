@@ -1,3 +1,20 @@
+import base64
+import functools
+import gzip
+import hashlib
+import json
+import zlib
+
+from flask import Response, current_app, make_response, request, stream_with_context
+
+from .database import tables_mark
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Tamanho aproximado de cada bloco enviado numa resposta em streaming.
+_BLOCO_STREAM = 64 * 1024
+
+
 def row_to_dict(cursor, row):
     """Converte uma linha do pyodbc para um dicionário."""
     columns = [column[0] for column in cursor.description]
@@ -23,3 +40,213 @@ def to_int(value):
         return int(float(str(value)))
     except (ValueError, TypeError):
         return None
+
+
+def encode_cursor(valores):
+    """Codifica os valores de ordenação da última linha de uma página em um token."""
+    texto = json.dumps(list(valores), ensure_ascii=False)
+    return base64.urlsafe_b64encode(texto.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """Decodifica um token gerado por encode_cursor. Levanta ValueError se inválido."""
+    try:
+        texto = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        valores = json.loads(texto.decode("utf-8"))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido.")
+    if not isinstance(valores, list):
+        raise ValueError("Cursor inválido.")
+    return tuple(valores)
+
+
+def parse_page_args(args, limite_padrao=50, limite_maximo=1000):
+    """
+    Lê os parâmetros `limit` e `cursor` da query string.
+    Retorna (limite, cursor); limite é None quando a requisição não pede paginação.
+    Levanta ValueError com a mensagem para o usuário se algum deles for inválido.
+    """
+    if "limit" not in args and "cursor" not in args:
+        return None, None
+    limite = to_int(args.get("limit")) if args.get("limit") else limite_padrao
+    if limite is None or limite <= 0:
+        raise ValueError("O parâmetro 'limit' deve ser um número inteiro positivo.")
+    cursor = decode_cursor(args["cursor"]) if args.get("cursor") else None
+    return min(limite, limite_maximo), cursor
+
+
+def parse_fields(args):
+    """Lista de campos pedidos em `fields` (separados por vírgula), ou None."""
+    campos = [c.strip() for c in args.get("fields", "").split(",") if c.strip()]
+    return campos or None
+
+
+def select_fields(linha, campos):
+    """Mantém apenas os `campos` pedidos da linha (todos, se campos for None)."""
+    if campos is None:
+        return linha
+    return {campo: linha[campo] for campo in campos if campo in linha}
+
+
+# --- Respostas em streaming ---
+# As linhas vêm de um gerador e são serializadas uma a uma, em blocos, sem
+# montar a lista nem o JSON inteiro em memória.
+
+
+def stream_mode(request):
+    """
+    Modo de streaming pedido: "ndjson" (Accept: application/x-ndjson ou
+    stream=ndjson), "json" (stream=1: o mesmo JSON da resposta normal, enviado
+    em blocos) ou None para a resposta normal.
+    """
+    stream = request.args.get("stream", "").lower()
+    if stream == "ndjson" or NDJSON_MIMETYPE in request.accept_mimetypes.values():
+        return "ndjson"
+    if stream in ("1", "true", "json"):
+        return "json"
+    return None
+
+
+def _em_blocos(partes):
+    bloco, tamanho = [], 0
+    for parte in partes:
+        bloco.append(parte)
+        tamanho += len(parte)
+        if tamanho >= _BLOCO_STREAM:
+            yield "".join(bloco)
+            bloco, tamanho = [], 0
+    if bloco:
+        yield "".join(bloco)
+
+
+def _lista_json(linhas, dumps):
+    yield "["
+    for i, linha in enumerate(linhas):
+        yield ("," if i else "") + dumps(linha)
+    yield "]"
+
+
+def _resposta_stream(partes, modo, headers=None):
+    mimetype = NDJSON_MIMETYPE if modo == "ndjson" else "application/json"
+    return Response(
+        stream_with_context(_em_blocos(partes)), mimetype=mimetype, headers=headers
+    )
+
+
+def stream_rows(linhas, modo, paginado=False, proximo_cursor=None):
+    """
+    Resposta em streaming de uma lista de linhas. No modo "json", o corpo é o
+    mesmo da resposta normal: a lista, ou {"dados": [...], "proximo_cursor"}
+    se `paginado`. No modo "ndjson", é uma linha por registro, e o cursor da
+    próxima página vai no cabeçalho X-Proximo-Cursor.
+    """
+    dumps = current_app.json.dumps
+    if modo == "ndjson":
+        partes = (dumps(linha) + "\n" for linha in linhas)
+        headers = {"X-Proximo-Cursor": proximo_cursor} if proximo_cursor else None
+        return _resposta_stream(partes, modo, headers)
+
+    def partes():
+        if paginado:
+            yield '{"dados":'
+        yield from _lista_json(linhas, dumps)
+        if paginado:
+            yield f',"proximo_cursor":{dumps(proximo_cursor)}}}'
+
+    return _resposta_stream(partes(), modo)
+
+
+def stream_sections(secoes, modo):
+    """
+    Resposta em streaming de um objeto com várias seções (lista de pares
+    (nome, linhas)), enviadas uma de cada vez; uma seção que é um dict sai
+    como objeto. No modo
+    "ndjson", cada linha é {"secao": nome, "dados": registro}.
+    """
+    dumps = current_app.json.dumps
+
+    def partes():
+        if modo == "ndjson":
+            for nome, linhas in secoes:
+                if isinstance(linhas, dict):
+                    linhas = [linhas]
+                for linha in linhas:
+                    yield dumps({"secao": nome, "dados": linha}) + "\n"
+            return
+        for i, (nome, linhas) in enumerate(secoes):
+            yield ("," if i else "{") + dumps(nome) + ":"
+            if isinstance(linhas, dict):
+                yield dumps(linhas)
+            else:
+                yield from _lista_json(linhas, dumps)
+        yield "}" if secoes else "{}"
+
+    return _resposta_stream(partes(), modo)
+
+
+# --- GET condicional (ETag) e compressão ---
+
+
+def _gzip_stream(partes):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for parte in partes:
+        bloco = compressor.compress(parte)
+        if bloco:
+            yield bloco
+    yield compressor.flush()
+
+
+def conditional_get(*tabelas, versao=None):
+    """
+    Decorador para rotas GET com ETag forte. `tabelas` são as chaves do config
+    das tabelas que a rota lê (ex: "LEADS_TABLE"); para dados de fora do banco,
+    `versao()` retorna uma marca deles (combinada com a das tabelas). O ETag é derivado dessa marca e do modo
+    de resposta. Se o ETag bate com o If-None-Match, a rota nem é
+    executada e a resposta é 304. Corpos a partir de GZIP_MIN_BYTES são
+    comprimidos com gzip quando o cliente aceita (com um ETag próprio, pois
+    o conteúdo enviado é outro). Outros métodos passam direto para a rota.
+    """
+
+    def decorador(rota):
+        @functools.wraps(rota)
+        def envolvida(*args, **kwargs):
+            if request.method != "GET":
+                return rota(*args, **kwargs)
+
+            marca = tables_mark(*(current_app.config[t] for t in tabelas))
+            if versao is not None:
+                marca = f"{marca}|{versao()}"
+            base = f"{marca}|{stream_mode(request)}"
+            etag = hashlib.sha1(base.encode("utf-8")).hexdigest()
+            etag_gzip = f"{etag}-gzip"
+            cabecalhos = {"Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+
+            for candidato in (etag, etag_gzip):
+                if request.if_none_match.contains(candidato):
+                    resposta = Response(status=304, headers=cabecalhos)
+                    resposta.set_etag(candidato)
+                    return resposta
+
+            resposta = make_response(rota(*args, **kwargs))
+            if resposta.status_code != 200:
+                return resposta
+            resposta.headers.update(cabecalhos)
+            resposta.set_etag(etag)
+
+            if (
+                request.accept_encodings["gzip"]
+                and "Content-Encoding" not in resposta.headers
+            ):
+                if resposta.is_streamed:
+                    resposta.response = _gzip_stream(resposta.iter_encoded())
+                elif resposta.content_length >= current_app.config["GZIP_MIN_BYTES"]:
+                    resposta.set_data(gzip.compress(resposta.get_data(), 6))
+                else:
+                    return resposta
+                resposta.headers["Content-Encoding"] = "gzip"
+                resposta.set_etag(etag_gzip)
+            return resposta
+
+        return envolvida
+
+    return decorador
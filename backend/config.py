@@ -11,11 +11,89 @@ class Config:
     # --- Configurações Gerais ---
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
+    # --- MOTOR DE ARMAZENAMENTO ---
+    # "json": arquivos JSON em instance/ (configurações abaixo).
+    # "sqlite": banco SQLite embutido em SQLITE_DB_PATH. Para importar um
+    # dados.json existente: `flask --app run importar-sqlite`.
+    STORAGE_ENGINE = "json"
+    SQLITE_DB_PATH = os.path.join(BASE_DIR, "instance", "dados.sqlite3")
+
     # --- CAMINHO DO NOVO "BANCO DE DADOS" JSON ---
     # Aponta para o arquivo dados.json dentro da pasta instance que você criou.
     JSON_DB_PATH = os.path.join(BASE_DIR, "instance", "dados.json")
 
+    # --- LAYOUT DO BANCO ---
+    # "arquivo_unico": todas as tabelas dentro do dados.json (formato original).
+    # "por_tabela": um arquivo por tabela em JSON_TABLES_DIR (<Tabela>.json e, com
+    # o journal ligado, <Tabela>.journal). Se a pasta ainda não existir, o
+    # dados.json é migrado automaticamente na primeira leitura
+    # (ou manualmente com `flask --app run migrar-tabelas`).
+    JSON_DB_LAYOUT = "por_tabela"
+    JSON_TABLES_DIR = os.path.join(BASE_DIR, "instance", "tabelas")
+
+    # --- JOURNAL (LOG DE ESCRITA) ---
+    # Com o journal ligado, cada alteração é anexada como um registro pequeno
+    # (tabela, chave, operação, linha) ao arquivo abaixo (no layout "por_tabela",
+    # a um journal por tabela), em vez de regravar o arquivo inteiro. O log é
+    # reaplicado sobre o último snapshot na leitura e compactado em segundo
+    # plano quando passa de JSON_JOURNAL_MAX_BYTES.
+    JSON_DB_JOURNAL = True
+    JSON_JOURNAL_PATH = os.path.join(BASE_DIR, "instance", "dados.journal")
+    JSON_JOURNAL_MAX_BYTES = 4 * 1024 * 1024
+    # Group commit: gravações que chegam dentro desta janela (em milissegundos)
+    # são persistidas juntas, com um único append e um único fsync por arquivo.
+    # 0 desliga a espera (cada gravação ainda pode pegar carona na anterior).
+    JSON_GROUP_COMMIT_MS = 2
+
+    # --- SEQUÊNCIAS (ex: NProposta) ---
+    # Contadores persistidos ao lado dos dados (no SQLite, na tabela _sequencias).
+    # Cada worker reserva SEQUENCE_BLOCK_SIZE números de uma vez: com 1 a
+    # numeração não tem buracos; valores maiores poupam acessos ao disco, mas os
+    # números que sobrarem no bloco de um worker que reinicia são perdidos.
+    JSON_SEQUENCES_PATH = os.path.join(BASE_DIR, "instance", "sequencias.json")
+    SEQUENCE_BLOCK_SIZE = 1
+
+    # --- SIMULAÇÃO EM LOTE (/api/simulacao/lote) ---
+    # Número de processos do pool de cálculo (None = um por núcleo). Lotes com
+    # menos UCs que SIMULACAO_LOTE_MIN_PARALELO são calculados no próprio
+    # processo, pois cada cálculo é rápido e o envio ao pool custaria mais.
+    SIMULACAO_PROCESSOS = None
+    SIMULACAO_LOTE_MIN_PARALELO = 16
+    # Resultados de simulação guardados em memória (LRU, por processo). A chave
+    # inclui as versões do histórico/unidade da UC e das tabelas de parâmetros,
+    # então uma alteração nesses dados nunca devolve um resultado antigo.
+    SIMULACAO_CACHE_TAMANHO = 256
+    # Limite de cenários (IPCA x descontos x preços) de /api/simulacao/cenarios,
+    # do horizonte em meses e de cenários x meses (tamanho das matrizes do cálculo)
+    SIMULACAO_CENARIOS_MAX = 1_000_000
+    SIMULACAO_MAX_MESES = 600
+    SIMULACAO_CENARIOS_MAX_VALORES = 50_000_000
+    # Monte Carlo de /api/simulacao/risco: caminhos padrão, limite e semente
+    # fixa (os mesmos dados sempre geram os mesmos percentis).
+    SIMULACAO_RISCO_CAMINHOS = 10000
+    SIMULACAO_RISCO_MAX_CAMINHOS = 50000
+    # Limite de caminhos x meses (tamanho das matrizes do Monte Carlo)
+    SIMULACAO_RISCO_MAX_VALORES = 6_000_000
+    SIMULACAO_RISCO_SEMENTE = 42
+
+    # --- IMPORTAÇÃO EM LOTE (/api/import/...) ---
+    # Linhas lidas e validadas por vez; o arquivo inteiro é gravado em um só commit.
+    IMPORTACAO_BLOCO_LINHAS = 5000
+
+    # --- RESPOSTAS HTTP ---
+    # Corpos a partir deste tamanho são enviados com gzip, se o cliente aceitar.
+    GZIP_MIN_BYTES = 1024
+
     EXCEL_LOCATIONS_PATH = os.path.join(BASE_DIR, "ListaDeMunicipios.xls")
+    # Índice compacto das localidades, gerado da planilha acima por
+    # `flask compilar-localidades` (ou na criação da aplicação, se faltar ou
+    # estiver desatualizado). Se a carga falhar, as rotas usam o que foi lido e
+    # só releem o arquivo depois de LOCALIDADES_RECARGA_SEGUNDOS.
+    LOCALIDADES_INDEX_PATH = os.path.join(BASE_DIR, "instance", "localidades.json")
+    LOCALIDADES_RECARGA_SEGUNDOS = 60
+    # Resultados do autocompletar de cidades (/api/localidades/busca): padrão e máximo
+    LOCALIDADES_BUSCA_LIMITE = 10
+    LOCALIDADES_BUSCA_LIMITE_MAX = 50
     # --- Nomes das "Tabelas" (Chaves no JSON) ---
     # Manter isso aqui é uma boa prática para evitar erros de digitação no resto do código.
     LEADS_TABLE = "CadastroLead"
@@ -36,3 +114,5 @@ class Config:
     AJUSTE_TARIFA_TABLE = "AjusteTarifa"
     DADOS_GERACAO_TABLE = "DadosGeracao"
     CURVA_GERACAO_TABLE = "CurvaGeracao"
+    # Agregados materializados do histórico (mês, ano e perfil por UC)
+    AGREGADOS_UC_TABLE = "AgregadosUc"
@@ -1,9 +1,12 @@
-
 # Importa a função que cria nossa aplicação de dentro da pasta `backend/app`
 from backend.app import create_app
 
-# Cria a instância da aplicação, chamando a função que configuramos no __init__.py
-app = create_app()
+# Cria a instância da aplicação, chamando a função que configuramos no __init__.py.
+# Os processos do pool de simulação ("spawn") reimportam este arquivo como
+# "__mp_main__" e não devem montar outra aplicação; `gunicorn run:app` e
+# `flask --app run` continuam encontrando `app`.
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
     # Roda o servidor de desenvolvimento do Flask
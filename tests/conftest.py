@@ -0,0 +1,25 @@
+import pytest
+
+from backend.app import database
+from backend.config import Config
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    """Banco JSON vazio em uma pasta temporária, com o cache em memória limpo."""
+    monkeypatch.setattr(Config, "STORAGE_ENGINE", "json")
+    monkeypatch.setattr(Config, "JSON_DB_PATH", str(tmp_path / "dados.json"))
+    monkeypatch.setattr(Config, "JSON_JOURNAL_PATH", str(tmp_path / "dados.journal"))
+    monkeypatch.setattr(Config, "JSON_TABLES_DIR", str(tmp_path / "tabelas"))
+    monkeypatch.setattr(Config, "JSON_SEQUENCES_PATH", str(tmp_path / "sequencias.json"))
+    monkeypatch.setattr(Config, "SQLITE_DB_PATH", str(tmp_path / "dados.sqlite3"))
+    database.invalidate_cache()
+    yield tmp_path
+    database.invalidate_cache()
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def motor(request, banco, monkeypatch):
+    """O mesmo banco vazio em cada motor de armazenamento."""
+    monkeypatch.setattr(Config, "STORAGE_ENGINE", request.param)
+    return request.param
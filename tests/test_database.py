@@ -0,0 +1,204 @@
+import json
+import os
+
+import pytest
+
+from backend.app import database
+from backend.app.database import IntegrityError, find_rows, next_id, transaction
+from backend.config import Config
+
+LEADS = Config.LEADS_TABLE
+HISTORICO = Config.HISTORICO_TABLE
+OBSERVACOES = Config.OBSERVACOES_TABLE
+PROPOSTAS = Config.PROPOSTA_TABLE
+
+
+def _lead(cpf, razao="Empresa"):
+    return {"Cpf_CnpjLead": cpf, "RazaoSocialLead": razao}
+
+
+def _estado(*tabelas):
+    """Conteúdo das tabelas, lido do motor configurado, em ordem estável."""
+    return {
+        tabela: sorted(
+            find_rows(tabela), key=lambda l: json.dumps(l, sort_keys=True)
+        )
+        for tabela in tabelas
+    }
+
+
+def _gravar_alteracoes():
+    """Inserções, atualizações e exclusões em transações separadas."""
+    with transaction() as tx:
+        for i in range(5):
+            tx.insert(LEADS, _lead(str(i)))
+    with transaction() as tx:
+        tx.update(LEADS, "1", {"RazaoSocialLead": "Alterada"})
+        tx.delete(LEADS, "2")
+        tx.put(LEADS, _lead("9", "Nova"))
+    with transaction() as tx:
+        tx.put(LEADS, _lead("2", "Reinserida"))
+        tx.delete(LEADS, "4")
+
+
+# --- JOURNAL ---
+
+
+@pytest.fixture(params=["arquivo_unico", "por_tabela"])
+def layout(request, banco, monkeypatch):
+    monkeypatch.setattr(Config, "JSON_DB_LAYOUT", request.param)
+    return request.param
+
+
+def _particao_leads():
+    return database._particao(LEADS)
+
+
+def test_journal_reaplicado_na_releitura(layout):
+    _gravar_alteracoes()
+    esperado = _estado(LEADS)
+
+    # As alterações estão só no journal: o snapshot ainda não existe.
+    particao = _particao_leads()
+    assert os.path.getsize(particao.caminho_journal) > 0
+    assert not os.path.exists(particao.caminho)
+
+    database.invalidate_cache()
+    assert _estado(LEADS) == esperado
+    assert [l["RazaoSocialLead"] for l in find_rows(LEADS, Cpf_CnpjLead="1")] == [
+        "Alterada"
+    ]
+    assert find_rows(LEADS, Cpf_CnpjLead="4") == []
+
+
+def test_journal_ignora_linhas_vazias_e_registro_incompleto(layout):
+    _gravar_alteracoes()
+    esperado = _estado(LEADS)
+
+    # Linhas em branco e um registro interrompido no meio da gravação.
+    with open(_particao_leads().caminho_journal, "ab") as f:
+        f.write(b"\n\n")
+        f.write(b'{"ops": [{"tabela": "' + LEADS.encode() + b'", "op": "del"')
+
+    database.invalidate_cache()
+    assert _estado(LEADS) == esperado
+
+    # O próximo registro descarta o resto incompleto em vez de colar nele.
+    with transaction() as tx:
+        tx.insert(LEADS, _lead("10"))
+    database.invalidate_cache()
+    assert len(find_rows(LEADS)) == len(esperado[LEADS]) + 1
+
+
+def test_compactacao_consolida_o_journal(layout):
+    _gravar_alteracoes()
+    esperado = _estado(LEADS)
+
+    particao = _particao_leads()
+    particao.compactar()
+
+    assert os.path.exists(particao.caminho)
+    assert os.path.getsize(particao.caminho_journal) == 0
+    database.invalidate_cache()
+    assert _estado(LEADS) == esperado
+
+
+def test_journal_reaplicado_sobre_snapshot_compactado_e_idempotente(layout):
+    _gravar_alteracoes()
+    esperado = _estado(LEADS)
+
+    # Simula uma queda entre as duas trocas da compactação: o snapshot novo
+    # já foi gravado, mas o journal antigo continua inteiro.
+    particao = _particao_leads()
+    with open(particao.caminho_journal, "rb") as f:
+        journal_antigo = f.read()
+    particao.compactar()
+    with open(particao.caminho_journal, "wb") as f:
+        f.write(journal_antigo)
+
+    database.invalidate_cache()
+    assert _estado(LEADS) == esperado
+
+    # Reaplicar o mesmo journal de novo também não muda nada.
+    database.invalidate_cache()
+    database._particao(LEADS).compactar()
+    database.invalidate_cache()
+    assert _estado(LEADS) == esperado
+
+
+# --- PARIDADE ENTRE OS MOTORES ---
+
+
+def _roteiro():
+    """
+    Mesma sequência de operações em qualquer motor. Retorna os valores
+    devolvidos pelas operações, para comparação entre os motores.
+    """
+    retornos = []
+    with transaction() as tx:
+        for i in range(4):
+            tx.insert(LEADS, _lead(str(i)))
+        for mes in range(1, 7):
+            tx.put(HISTORICO, {"NumeroDaUcLead": "U1", "IDMes": 202400 + mes})
+            tx.put(HISTORICO, {"NumeroDaUcLead": "U2", "IDMes": 202400 + mes})
+        # Tabela sem chave: gravada por inteiro.
+        tx.replace(
+            OBSERVACOES, [{"IdProposta": i % 2, "Texto": f"obs {i}"} for i in range(3)]
+        )
+
+    with transaction() as tx:
+        retornos.append(tx.get(LEADS, "1"))
+        retornos.append(tx.update(LEADS, "1", {"RazaoSocialLead": "Alterada"}))
+        retornos.append(tx.update(LEADS, "inexistente", {"RazaoSocialLead": "X"}))
+        # Mudar a chave move a linha.
+        retornos.append(tx.update(LEADS, "3", {"Cpf_CnpjLead": "30"}))
+        retornos.append(tx.delete(LEADS, "2"))
+        retornos.append(tx.delete(LEADS, "2"))
+        retornos.append(tx.delete_where(HISTORICO, NumeroDaUcLead="U2"))
+        retornos.append(tx.delete_where(OBSERVACOES, IdProposta=0))
+        retornos.append(
+            sorted(l["IDMes"] for l in tx.find(HISTORICO, NumeroDaUcLead="U1"))
+        )
+
+    # Uma transação que falha não grava nada, nem o que veio antes do erro.
+    with pytest.raises(IntegrityError):
+        with transaction() as tx:
+            tx.put(LEADS, _lead("50"))
+            tx.insert(LEADS, _lead("0"))
+    retornos.append(find_rows(LEADS, Cpf_CnpjLead="50"))
+
+    with transaction() as tx:
+        tx.insert(PROPOSTAS, {"NProposta": 7})
+    retornos.append([next_id(PROPOSTAS, "NProposta") for _ in range(3)])
+    return retornos
+
+
+def test_motores_json_e_sqlite_sao_equivalentes(banco, monkeypatch):
+    resultados = {}
+    for nome in ("json", "sqlite"):
+        monkeypatch.setattr(Config, "STORAGE_ENGINE", nome)
+        monkeypatch.setattr(Config, "SQLITE_DB_PATH", str(banco / f"{nome}.sqlite3"))
+        monkeypatch.setattr(Config, "JSON_TABLES_DIR", str(banco / f"{nome}_tabelas"))
+        monkeypatch.setattr(
+            Config, "JSON_SEQUENCES_PATH", str(banco / f"{nome}_sequencias.json")
+        )
+        database.invalidate_cache()
+        retornos = _roteiro()
+        resultados[nome] = (retornos, _estado(LEADS, HISTORICO, OBSERVACOES))
+
+    assert resultados["json"] == resultados["sqlite"]
+    retornos, estado = resultados["json"]
+    assert retornos[-1] == [8, 9, 10]
+    assert sorted(l["Cpf_CnpjLead"] for l in estado[LEADS]) == ["0", "1", "30"]
+    assert [l["Texto"] for l in estado[OBSERVACOES]] == ["obs 1"]
+
+
+def test_next_id_continua_depois_da_releitura(motor):
+    with transaction() as tx:
+        tx.insert(PROPOSTAS, {"NProposta": 41})
+    assert next_id(PROPOSTAS, "NProposta") == 42
+
+    # A sequência é persistida: outro processo (aqui, um motor novo) continua dela.
+    database.invalidate_cache()
+    database._motor["chave"] = None
+    assert next_id(PROPOSTAS, "NProposta") == 43
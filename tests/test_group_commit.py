@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+
+from backend.app import database
+from backend.app.database import (
+    ConflictError,
+    IntegrityError,
+    find_rows,
+    get_cache_stats,
+    transaction,
+)
+from backend.config import Config
+
+LEADS = Config.LEADS_TABLE
+HISTORICO = Config.HISTORICO_TABLE
+
+
+@pytest.fixture
+def group_commit(banco, monkeypatch):
+    # Uma janela maior que o normal para as threads caírem no mesmo commit.
+    monkeypatch.setattr(Config, "JSON_GROUP_COMMIT_MS", 20)
+    return banco
+
+
+def _em_paralelo(funcao, quantidade):
+    """Roda funcao(i) em `quantidade` threads liberadas ao mesmo tempo."""
+    largada = threading.Barrier(quantidade)
+    resultados = [None] * quantidade
+
+    def executar(i):
+        largada.wait()
+        try:
+            resultados[i] = funcao(i)
+        except Exception as e:
+            resultados[i] = e
+
+    threads = [threading.Thread(target=executar, args=(i,)) for i in range(quantidade)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return resultados
+
+
+def test_escritores_concorrentes_em_um_commit(group_commit):
+    antes = get_cache_stats()["group_commit"]
+
+    def gravar(i):
+        with transaction() as tx:
+            for j in range(10):
+                tx.insert(LEADS, {"Cpf_CnpjLead": f"{i}-{j}"})
+
+    assert _em_paralelo(gravar, 16) == [None] * 16
+
+    depois = get_cache_stats()["group_commit"]
+    lotes = depois["lotes"] - antes["lotes"]
+    commits = depois["commits"] - antes["commits"]
+    assert lotes == 16
+    assert commits < lotes
+
+    # Tudo chegou ao disco.
+    database.invalidate_cache()
+    assert len(find_rows(LEADS)) == 160
+
+
+def test_insercoes_concorrentes_da_mesma_chave(group_commit):
+    def inserir(i):
+        with transaction() as tx:
+            tx.insert(LEADS, {"Cpf_CnpjLead": "123", "RazaoSocialLead": f"Empresa {i}"})
+
+    resultados = _em_paralelo(inserir, 8)
+
+    assert resultados.count(None) == 1
+    assert all(isinstance(r, IntegrityError) for r in resultados if r is not None)
+    database.invalidate_cache()
+    assert len(find_rows(LEADS, Cpf_CnpjLead="123")) == 1
+
+
+def test_lote_em_conflito_nao_afeta_os_outros_do_mesmo_commit(group_commit):
+    # As transações 0 e 1 disputam a mesma chave; só uma pode gravar.
+    def gravar(i):
+        with transaction() as tx:
+            tx.insert(LEADS, {"Cpf_CnpjLead": f"novo-{i}"})
+            if i < 2:
+                tx.insert(LEADS, {"Cpf_CnpjLead": "disputada", "Origem": i})
+
+    resultados = _em_paralelo(gravar, 4)
+
+    assert sum(isinstance(r, IntegrityError) for r in resultados[:2]) == 1
+    assert resultados[2:] == [None, None]
+    vencedora = resultados.index(None)
+    database.invalidate_cache()
+    assert sorted(l["Cpf_CnpjLead"] for l in find_rows(LEADS)) == sorted(
+        ["disputada", f"novo-{vencedora}", "novo-2", "novo-3"]
+    )
+    assert find_rows(LEADS, Cpf_CnpjLead="disputada")[0]["Origem"] == vencedora
+
+
+def test_leitura_alterada_antes_do_commit_gera_conflito(banco):
+    with transaction() as tx:
+        tx.put(HISTORICO, {"NumeroDaUcLead": "U1", "IDMes": 202401})
+        tx.put(HISTORICO, {"NumeroDaUcLead": "U2", "IDMes": 202401})
+
+    with pytest.raises(ConflictError):
+        with transaction() as tx:
+            lidas = tx.find(HISTORICO, NumeroDaUcLead="U1")
+            tx.put(HISTORICO, {"NumeroDaUcLead": "U1", "IDMes": 202402})
+            # Outra gravação muda as linhas lidas antes deste commit.
+            with transaction() as outra:
+                outra.put(HISTORICO, {"NumeroDaUcLead": "U1", "IDMes": 202403})
+    assert len(lidas) == 1
+    assert sorted(l["IDMes"] for l in find_rows(HISTORICO, NumeroDaUcLead="U1")) == [
+        202401,
+        202403,
+    ]
+
+    # Alterar outra UC não invalida a leitura.
+    with transaction() as tx:
+        tx.find(HISTORICO, NumeroDaUcLead="U1")
+        tx.put(HISTORICO, {"NumeroDaUcLead": "U1", "IDMes": 202404})
+        with transaction() as outra:
+            outra.put(HISTORICO, {"NumeroDaUcLead": "U2", "IDMes": 202402})
+    assert len(find_rows(HISTORICO, NumeroDaUcLead="U1")) == 3
+
+
+def test_find_da_transacao_enxerga_as_alteracoes_pendentes(motor):
+    with transaction() as tx:
+        for mes in (1, 2, 3):
+            tx.put(HISTORICO, {"NumeroDaUcLead": "U1", "IDMes": 202400 + mes})
+
+    with transaction() as tx:
+        tx.delete(HISTORICO, ("U1", 202401))
+        tx.put(HISTORICO, {"NumeroDaUcLead": "U1", "IDMes": 202404})
+        tx.put(HISTORICO, {"NumeroDaUcLead": "U1", "IDMes": 202402, "kWh": 5})
+        vistas = {l["IDMes"]: l for l in tx.find(HISTORICO, NumeroDaUcLead="U1")}
+
+    assert sorted(vistas) == [202402, 202403, 202404]
+    assert vistas[202402]["kWh"] == 5
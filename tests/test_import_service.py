@@ -0,0 +1,84 @@
+import io
+
+from openpyxl import Workbook
+
+from backend.app.database import find_rows, transaction
+from backend.app.services.import_service import formato_do_arquivo, importar_historico
+from backend.config import Config
+
+CABECALHO = [
+    "NumeroDaUcLead",
+    "IDMes",
+    "kWhProjPonta",
+    "kWhProjForaPonta",
+    "DemandaCFP",
+    "DemandaCP",
+]
+
+
+def _xlsx(linhas):
+    """Planilha .xlsx em memória, com o cabeçalho na primeira linha."""
+    planilha = Workbook()
+    aba = planilha.active
+    aba.append(CABECALHO)
+    for linha in linhas:
+        aba.append(linha)
+    arquivo = io.BytesIO()
+    planilha.save(arquivo)
+    arquivo.seek(0)
+    return arquivo
+
+
+def _cadastrar_unidade(banco):
+    with transaction() as tx:
+        tx.put(
+            Config.UNIDADES_TABLE,
+            {
+                "Cpf_CnpjLead": "1",
+                "NumeroDaUcLead": "UC1",
+                "SubgrupoTarifario": "A4",
+                "Tarifa": "AZUL",
+                "AliquotaICMS": 18,
+            },
+        )
+
+
+def test_importa_historico_de_xlsx(banco):
+    _cadastrar_unidade(banco)
+    arquivo = _xlsx(
+        [
+            ["UC1", f"2024-{mes:02d}", 100 + mes, "2000,5", 50, 30]
+            for mes in range(1, 13)
+        ]
+        + [
+            ["UC1", "2025-01", 1, 1, 50, 0],  # Demanda CP obrigatória
+            ["UC9", "2025-01", 1, 1, 50, 30],  # unidade inexistente
+            ["UC1", "2025-13", 1, 1, 50, 30],  # IDMes inválido
+        ]
+    )
+
+    relatorio = importar_historico(
+        arquivo, formato_do_arquivo("h.xlsx"), tamanho_bloco=5
+    )
+
+    assert relatorio["linhas_lidas"] == 15
+    assert relatorio["importadas"] == 12
+    assert relatorio["ucs"] == 1
+    assert [e["linha"] for e in relatorio["erros"]] == [14, 15, 16]
+    assert "Demanda CP" in relatorio["erros"][0]["erro"]
+
+    historico = {
+        h["IDMes"]: h
+        for h in find_rows(Config.HISTORICO_TABLE, NumeroDaUcLead="UC1")
+    }
+    assert sorted(historico) == list(range(202401, 202413))
+    assert historico[202403]["kWhProjPonta"] == 103.0
+    assert historico[202403]["kWhProjForaPonta"] == 2000.5
+
+    # Os agregados do ano importado são gravados na mesma transação.
+    anos = [
+        a["Periodo"]
+        for a in find_rows(Config.AGREGADOS_UC_TABLE, NumeroDaUcLead="UC1")
+        if a["Tipo"] == "ano"
+    ]
+    assert anos == [2024]
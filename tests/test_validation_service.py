@@ -0,0 +1,170 @@
+import itertools
+import re
+
+import numpy as np
+import pytest
+
+from backend.app.services.validation_service import (
+    CAMPOS_REGRAS,
+    validar_historico,
+    validar_regras_tarifacao,
+)
+from backend.app.utils import to_float
+
+
+def _regras_por_mes(dados_unidade, dados_historico_mes):
+    """
+    Validação de um mês como era feita antes das regras compiladas (cópia da
+    versão original de validar_regras_tarifacao), usada como referência.
+    """
+    subgrupo = dados_unidade.get("SubgrupoTarifario", "").upper()
+    tarifa = dados_unidade.get("Tarifa", "").upper()
+    possui_usina = bool(dados_unidade.get("PossuiUsina", False))
+
+    beneficio_rural = to_float(dados_unidade.get("BeneficioRuralIrrigacao"))
+    is_rural_irrigante = beneficio_rural is not None and beneficio_rural > 0
+
+    gerador_diesel = to_float(dados_historico_mes.get("kWhProjDieselP"))
+    tem_gerador_diesel = gerador_diesel is not None and gerador_diesel > 0
+
+    is_grupo_a = subgrupo.startswith("A")
+    is_grupo_b = subgrupo.startswith("B")
+    is_tarifa_azul = "AZUL" in tarifa
+    is_tarifa_verde = "VERDE" in tarifa
+
+    regras_de_zeramento = {
+        "kWProjPonta": is_tarifa_verde or is_grupo_b,
+        "kWProjForaPonta": is_tarifa_verde or is_grupo_b,
+        "kWhProjPonta": is_tarifa_verde or is_grupo_b,
+        "kWhProjForaPonta": is_tarifa_verde or is_grupo_b,
+        "kWhProjHRes": not is_rural_irrigante,
+        "kWhCompensadoHr": not possui_usina and not is_rural_irrigante,
+        "kWhProjDieselP": not tem_gerador_diesel,
+        "kWhProjPontaG": not possui_usina,
+        "kWhProjForaPontaG": not possui_usina,
+        "kWProjG": not possui_usina,
+        "kWhCompensadoP": not possui_usina,
+        "kWhCompensadoFP": not possui_usina,
+        "kWGeracaoProjetada": not possui_usina,
+        "DemandaCP": is_grupo_b or is_tarifa_verde,
+        "DemandaCFP": is_grupo_b,
+        "DemandaCG": is_grupo_b or not possui_usina,
+    }
+
+    for campo, condicao_para_zerar in regras_de_zeramento.items():
+        valor_campo = to_float(dados_historico_mes.get(campo))
+        if condicao_para_zerar and valor_campo and valor_campo != 0:
+            raise ValueError(
+                f"O campo '{campo}' deve ser zero para as condições atuais da unidade."
+            )
+
+    campos_de_dados = list(regras_de_zeramento.keys())
+    tem_dados_no_mes = any(
+        to_float(dados_historico_mes.get(campo)) for campo in campos_de_dados
+    )
+
+    if tem_dados_no_mes:
+        if is_grupo_a and (is_tarifa_azul or is_tarifa_verde):
+            valor_demanda_cfp = to_float(dados_historico_mes.get("DemandaCFP"))
+            if not valor_demanda_cfp or valor_demanda_cfp <= 0:
+                raise ValueError(
+                    "O campo 'Demanda CFP' é obrigatório para Grupo A com Tarifa Azul ou Verde."
+                )
+
+        if is_grupo_a and is_tarifa_azul:
+            valor_demanda_cp = to_float(dados_historico_mes.get("DemandaCP"))
+            if not valor_demanda_cp or valor_demanda_cp <= 0:
+                raise ValueError(
+                    "O campo 'Demanda CP' é obrigatório para Grupo A com Tarifa Azul."
+                )
+
+        if possui_usina:
+            valor_demanda_cg = to_float(dados_historico_mes.get("DemandaCG"))
+            if not valor_demanda_cg or valor_demanda_cg <= 0:
+                raise ValueError(
+                    "O campo 'Demanda CG' é obrigatório pois a unidade possui usina (Geração Distribuída)."
+                )
+
+    return True
+
+
+def _erro_por_mes(dados_unidade, mes):
+    try:
+        _regras_por_mes(dados_unidade, mes)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+UNIDADES = [
+    {
+        "SubgrupoTarifario": subgrupo,
+        "Tarifa": tarifa,
+        "PossuiUsina": usina,
+        "BeneficioRuralIrrigacao": rural,
+    }
+    for subgrupo, tarifa, usina, rural in itertools.product(
+        ["A4", "a3a", "B1", "B3", ""],
+        ["AZUL", "Verde", "CONVENCIONAL", ""],
+        [True, False],
+        [None, "", "0", "12,5"],
+    )
+]
+
+
+def _meses(semente, quantidade=60):
+    """Meses com valores variados: vazios, zero, negativos, texto e números."""
+    gerador = np.random.default_rng(semente)
+    valores = [None, "", 0, "0", 5, 120.5, -3, "7,5", "abc"]
+    pesos = np.array([6, 2, 4, 1, 3, 2, 1, 1, 1], dtype=float)
+    meses = []
+    for i in range(quantidade):
+        mes = {"IDMes": 202001 + i}
+        # Alguns meses têm poucos campos preenchidos (ou nenhum).
+        preenchidos = gerador.random() * 0.6
+        for campo in CAMPOS_REGRAS:
+            if gerador.random() < preenchidos:
+                mes[campo] = valores[gerador.choice(len(valores), p=pesos / pesos.sum())]
+        meses.append(mes)
+    return meses
+
+
+@pytest.mark.parametrize("indice", range(len(UNIDADES)))
+def test_validar_historico_igual_as_regras_por_mes(indice):
+    unidade = UNIDADES[indice]
+    meses = _meses(indice)
+
+    violacoes = validar_historico(unidade, meses)
+
+    # Os mesmos meses violam as regras, e a primeira violação de cada mês
+    # é a que a validação antiga levantava.
+    primeiras = {}
+    for violacao in violacoes:
+        primeiras.setdefault(violacao["linha"], violacao["erro"])
+    esperadas = {
+        linha: erro
+        for linha, erro in enumerate(_erro_por_mes(unidade, mes) for mes in meses)
+        if erro is not None
+    }
+    assert primeiras == esperadas
+    for violacao in violacoes:
+        assert violacao["IDMes"] == meses[violacao["linha"]]["IDMes"]
+
+    # Validado mês a mês, o resultado também é o mesmo.
+    for mes in meses:
+        erro = _erro_por_mes(unidade, mes)
+        if erro is None:
+            assert validar_regras_tarifacao(unidade, mes) is True
+        else:
+            with pytest.raises(ValueError, match=re.escape(erro)):
+                validar_regras_tarifacao(unidade, mes)
+
+
+def test_validar_historico_retorna_todas_as_violacoes_do_mes():
+    unidade = {"SubgrupoTarifario": "B1", "Tarifa": "", "PossuiUsina": False}
+    mes = {"IDMes": 202401, "kWProjPonta": 1, "kWhProjPontaG": 2, "DemandaCG": 3}
+
+    violacoes = validar_historico(unidade, [mes])
+
+    assert [v["campo"] for v in violacoes] == ["kWProjPonta", "kWhProjPontaG", "DemandaCG"]
+    assert validar_historico(unidade, []) == []